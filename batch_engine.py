@@ -0,0 +1,413 @@
+"""
+NumPy lockstep engine for simulating many Hustle n' Tussle battles at once.
+
+BatchEngine keeps the state of N battles with the same field size in arrays
+and advances them all one round at a time, mirroring the rules of
+game_logic.Game: ties when every guest votes 3, no contest when every guest
+votes 4, double weight for guest votes, winner-stays pairing and the
+``max(num_leads, num_follows) - 1`` crown threshold.
+
+Contestants are identified by their index in the initial order; queues are
+ring buffers with a per-contestant count so membership checks are O(1).
+Battles whose queue would run dry (an IndexError in Game) are flagged in
+``errored`` and frozen.
+
+Use ``cross_check`` to confirm the engine agrees with Game on seeded runs.
+"""
+
+import numpy as np
+
+from game_logic import Game
+
+
+class _QueueArray:
+    """A FIFO queue of contestant indices per battle, stored as ring buffers."""
+
+    def __init__(self, n_battles, n_contestants):
+        # Duplicates can enter a queue, but never more than a few per contestant
+        self.capacity = 4 * n_contestants + 8
+        self.buf = np.full((n_battles, self.capacity), -1, dtype=np.int32)
+        self.head = np.zeros(n_battles, dtype=np.int64)
+        self.size = np.zeros(n_battles, dtype=np.int64)
+        self.counts = np.zeros((n_battles, n_contestants), dtype=np.int32)
+
+    def push(self, mask, values):
+        b = np.nonzero(mask)[0]
+        if b.size == 0:
+            return
+        if np.any(self.size[b] >= self.capacity):
+            raise OverflowError("Contestant queue overflowed its ring buffer")
+        v = values[b]
+        self.buf[b, (self.head[b] + self.size[b]) % self.capacity] = v
+        self.size[b] += 1
+        np.add.at(self.counts, (b, v), 1)
+
+    def pop(self, mask, errored):
+        """Pop the front of each masked queue. Empty queues flag ``errored``."""
+        out = np.full(mask.shape[0], -1, dtype=np.int32)
+        empty = mask & (self.size == 0)
+        errored |= empty
+        b = np.nonzero(mask & ~empty)[0]
+        if b.size:
+            v = self.buf[b, self.head[b] % self.capacity]
+            out[b] = v
+            self.head[b] = (self.head[b] + 1) % self.capacity
+            self.size[b] -= 1
+            np.add.at(self.counts, (b, v), -1)
+        return out
+
+    def to_list(self, battle):
+        return [int(self.buf[battle, (self.head[battle] + i) % self.capacity])
+                for i in range(self.size[battle])]
+
+
+class BatchEngine:
+    """Advances N battles with identical field sizes in lockstep.
+
+    Call ``judge`` for the leads and then the follows of the current round,
+    then ``end_round``, which finishes battles that have crowned both roles
+    and moves the rest on to the next round. Votes are arrays of decisions:
+    ``guest_votes`` is (N, num_guests) and ``contestant_votes`` is
+    (N, max_contestant_judges), of which only the first
+    ``contestant_judge_counts[b]`` columns are used for battle b.
+    """
+
+    def __init__(self, n_battles, n_leads, n_follows, n_guests):
+        if n_leads < 2 or n_follows < 2:
+            raise ValueError("Each role needs at least two contestants")
+        if n_guests < 1:
+            raise ValueError("At least one guest judge is required")
+        self.n_battles = n_battles
+        self.n_leads = n_leads
+        self.n_follows = n_follows
+        self.n_guests = n_guests
+        self.win_threshold = max(n_leads, n_follows) - 1
+        self.max_contestant_judges = max(0, min(3, n_leads + n_follows - 4))
+
+        N = n_battles
+        self.leads = _QueueArray(N, n_leads)
+        self.follows = _QueueArray(N, n_follows)
+        everyone = np.ones(N, dtype=bool)
+        for i in range(n_leads):
+            self.leads.push(everyone, np.full(N, i, dtype=np.int32))
+        for i in range(n_follows):
+            self.follows.push(everyone, np.full(N, i, dtype=np.int32))
+
+        self.lead_points = np.zeros((N, n_leads), dtype=np.int32)
+        self.follow_points = np.zeros((N, n_follows), dtype=np.int32)
+        self.winning_lead = np.full(N, -1, dtype=np.int32)
+        self.winning_follow = np.full(N, -1, dtype=np.int32)
+        self.has_winning_lead = np.zeros(N, dtype=bool)
+        self.has_winning_follow = np.zeros(N, dtype=bool)
+        self.last_lead_winner = np.full(N, -1, dtype=np.int32)
+        self.last_follow_winner = np.full(N, -1, dtype=np.int32)
+        self.tie_lead_pair = np.full((N, 2), -1, dtype=np.int32)
+        self.has_tie_lead = np.zeros(N, dtype=bool)
+        self.has_tie_follow = np.zeros(N, dtype=bool)
+        self.previous_pairs = np.full((N, 2, 2), -1, dtype=np.int32)
+        self.has_previous_pairs = np.zeros(N, dtype=bool)
+        self.round_num = np.ones(N, dtype=np.int32)
+        self.finished = np.zeros(N, dtype=bool)
+        self.errored = np.zeros(N, dtype=bool)
+        self.crowned_round = {"lead": np.full(N, -1, dtype=np.int32),
+                              "follow": np.full(N, -1, dtype=np.int32)}
+        self.crown_holder = {"lead": np.full(N, -1, dtype=np.int32),
+                             "follow": np.full(N, -1, dtype=np.int32)}
+
+        # Contestant judges are drawn before the first pairs leave the queues
+        self.contestant_judge_counts = self._contestant_judge_counts()
+        self.pair_1_lead = self.leads.pop(everyone, self.errored)
+        self.pair_1_follow = self.follows.pop(everyone, self.errored)
+        self.pair_2_lead = self.leads.pop(everyone, self.errored)
+        self.pair_2_follow = self.follows.pop(everyone, self.errored)
+
+    @property
+    def active(self):
+        return ~self.finished & ~self.errored
+
+    def _contestant_judge_counts(self):
+        return np.minimum(self.max_contestant_judges, self.leads.size + self.follows.size)
+
+    def judge(self, role, guest_votes, contestant_votes):
+        """Apply one role's votes to every active battle (Game.judge_round)."""
+        act = self.active
+        guest_votes = np.asarray(guest_votes)
+        contestant_votes = np.asarray(contestant_votes).reshape(self.n_battles, -1)
+        counted = np.arange(contestant_votes.shape[1]) < self.contestant_judge_counts[:, None]
+
+        if role == "lead":
+            c1, c2 = self.pair_1_lead, self.pair_2_lead
+            queue, points = self.leads, self.lead_points
+        else:
+            c1, c2 = self.pair_1_follow, self.pair_2_follow
+            queue, points = self.follows, self.follow_points
+
+        tie = act & np.all(guest_votes == 3, axis=1)
+        no_contest = act & ~tie & np.all(guest_votes == 4, axis=1)
+        normal = act & ~tie & ~no_contest
+
+        if role == "lead":
+            self.tie_lead_pair[tie, 0] = c1[tie]
+            self.tie_lead_pair[tie, 1] = c2[tie]
+            self.has_tie_lead |= tie
+        else:
+            self.has_tie_follow |= tie
+
+        # No contest: both go to the back and the front of the queue steps in
+        queue.push(no_contest, c1)
+        queue.push(no_contest, c2)
+        replacement = queue.pop(no_contest, self.errored)
+        winning = self.winning_lead if role == "lead" else self.winning_follow
+        winning[no_contest] = replacement[no_contest]
+
+        ties = np.sum(guest_votes == 3, axis=1)
+        score_1 = 2 * np.sum(guest_votes == 1, axis=1) + ties + np.sum(counted & (contestant_votes == 1), axis=1)
+        score_2 = 2 * np.sum(guest_votes == 2, axis=1) + ties + np.sum(counted & (contestant_votes == 2), axis=1)
+        first_wins = score_1 >= score_2
+        winner = np.where(first_wins, c1, c2)
+        loser = np.where(first_wins, c2, c1)
+
+        rows = np.arange(self.n_battles)
+        has_winner = self.has_winning_lead if role == "lead" else self.has_winning_follow
+        queue.push(normal, loser)
+        winning[normal] = winner[normal]
+        crowned = normal & ~has_winner & (points[rows, np.maximum(winner, 0)] + 1 >= self.win_threshold)
+        has_winner |= crowned
+        self.crowned_round[role][crowned] = self.round_num[crowned]
+        self.crown_holder[role][crowned] = winner[crowned]
+        if role == "follow":
+            # A newly crowned follow goes straight back into the queue
+            queue.push(crowned, winner)
+            winning[crowned] = -1
+
+        last = self.last_lead_winner if role == "lead" else self.last_follow_winner
+        last[normal] = winner[normal]
+        np.add.at(points, (rows[normal], winner[normal]), 1)
+
+    def end_round(self):
+        """Finish battles with both roles crowned and start the next round for the rest."""
+        self.finished |= self.active & self.has_winning_lead & self.has_winning_follow
+        self._next_round(self.active)
+
+    def _replenish(self, act, queue, competing_1, competing_2, n_contestants):
+        low = act & (queue.size < 2)
+        for i in range(n_contestants):
+            add = low & (competing_1 != i) & (competing_2 != i) & (queue.counts[:, i] == 0)
+            queue.push(add, np.full(self.n_battles, i, dtype=np.int32))
+
+    def _select(self, act, queue, points, winning, has_own, has_other, use_tie, tie_pair):
+        """Pick the two contestants of one role for the next round (Game.next_round)."""
+        settled = act & has_own & ~has_other
+        rows = np.arange(self.n_battles)
+        at_threshold = settled & (winning >= 0) & (points[rows, np.maximum(winning, 0)] >= self.win_threshold)
+        from_tie = act & ~at_threshold & use_tie
+        stays = act & ~at_threshold & ~from_tie & (winning >= 0)
+        from_queue = act & ~from_tie & ~stays
+
+        # A crowned contestant with the flag set goes to the back of the queue
+        queue.push(at_threshold, winning)
+        winning[at_threshold] = -1
+
+        first = np.full(self.n_battles, -1, dtype=np.int32)
+        second = np.full(self.n_battles, -1, dtype=np.int32)
+        first[from_tie] = tie_pair[from_tie, 0]
+        second[from_tie] = tie_pair[from_tie, 1]
+        first[stays] = winning[stays]
+        winning[stays] = -1
+
+        popped = queue.pop(from_queue, self.errored)
+        first[from_queue] = popped[from_queue]
+        popped = queue.pop(from_queue | stays, self.errored)
+        second[from_queue | stays] = popped[from_queue | stays]
+        return first, second, from_tie
+
+    def _next_round(self, act):
+        self.round_num[act] += 1
+        old_p1l, old_p1f = self.pair_1_lead.copy(), self.pair_1_follow.copy()
+        old_p2l, old_p2f = self.pair_2_lead.copy(), self.pair_2_follow.copy()
+
+        self._replenish(act, self.leads, old_p1l, old_p2l, self.n_leads)
+        self._replenish(act, self.follows, old_p1f, old_p2f, self.n_follows)
+
+        follow_tie = act & self.has_tie_follow
+        self.has_tie_follow[act] = False
+
+        lead_1, lead_2, used_lead_tie = self._select(
+            act, self.leads, self.lead_points, self.winning_lead,
+            self.has_winning_lead, self.has_winning_follow, self.has_tie_lead, self.tie_lead_pair)
+        self.has_tie_lead[used_lead_tie] = False
+
+        tie_follows = np.stack([old_p1f, old_p2f], axis=1)
+        follow_1, follow_2, _ = self._select(
+            act, self.follows, self.follow_points, self.winning_follow,
+            self.has_winning_follow, self.has_winning_lead, follow_tie, tie_follows)
+
+        # After a follow tie the winning lead dances with a different follow
+        lead_won = lead_1 == self.last_lead_winner
+        tie_lead_1 = np.where(lead_won, lead_1, lead_2)
+        tie_lead_2 = np.where(lead_won, lead_2, lead_1)
+        repeat = (((tie_lead_1 == old_p1l) & (follow_1 == old_p1f))
+                  | ((tie_lead_1 == old_p2l) & (follow_1 == old_p2f)))
+        tie_swap = follow_tie & repeat
+
+        # Otherwise avoid repeat partners and keep the two round winners apart
+        check = act & ~follow_tie & ~self.has_tie_lead
+        prev = self.previous_pairs
+
+        def was_paired(lead, follow):
+            return self.has_previous_pairs & (
+                ((prev[:, 0, 0] == lead) & (prev[:, 0, 1] == follow))
+                | ((prev[:, 1, 0] == lead) & (prev[:, 1, 1] == follow)))
+
+        repeat_swap = check & (was_paired(lead_1, follow_1) | was_paired(lead_2, follow_2))
+        f1 = np.where(repeat_swap, follow_2, follow_1)
+        f2 = np.where(repeat_swap, follow_1, follow_2)
+        winners_1 = (self.last_lead_winner == lead_1) & (self.last_follow_winner == f1)
+        winners_2 = (self.last_lead_winner == lead_2) & (self.last_follow_winner == f2)
+        winners_swap = check & (winners_1 | winners_2)
+
+        swap = tie_swap | (repeat_swap ^ winners_swap)
+        new_f1 = np.where(swap, follow_2, follow_1)
+        new_f2 = np.where(swap, follow_1, follow_2)
+        new_l1 = np.where(follow_tie, tie_lead_1, lead_1)
+        new_l2 = np.where(follow_tie, tie_lead_2, lead_2)
+
+        self.pair_1_lead[act] = new_l1[act]
+        self.pair_1_follow[act] = new_f1[act]
+        self.pair_2_lead[act] = new_l2[act]
+        self.pair_2_follow[act] = new_f2[act]
+        self.previous_pairs[act, 0, 0] = new_l1[act]
+        self.previous_pairs[act, 0, 1] = new_f1[act]
+        self.previous_pairs[act, 1, 0] = new_l2[act]
+        self.previous_pairs[act, 1, 1] = new_f2[act]
+        self.has_previous_pairs |= act
+
+        self._replenish(act, self.leads, self.pair_1_lead, self.pair_2_lead, self.n_leads)
+        self._replenish(act, self.follows, self.pair_1_follow, self.pair_2_follow, self.n_follows)
+        self.contestant_judge_counts = np.where(act, self._contestant_judge_counts(),
+                                                self.contestant_judge_counts)
+
+
+class BatchJudgeModel:
+    """Vectorized counterpart of simulate.JudgeModel."""
+
+    def __init__(self, discernment=1.0, position_bias=0.0, tie_rate=0.05, no_contest_rate=0.01):
+        self.discernment = discernment
+        self.position_bias = position_bias
+        self.tie_rate = tie_rate
+        self.no_contest_rate = no_contest_rate
+
+    def votes(self, skill_1, skill_2, n_guests, n_contestant_judges, rng):
+        """Return (guest_votes, contestant_votes) for one role of every battle."""
+        n = skill_1.shape[0]
+        p_first = 1 / (1 + np.exp(-(self.discernment * (skill_1 - skill_2) + self.position_bias)))
+        guest = np.where(rng.random((n, n_guests)) < p_first[:, None], 1, 2)
+        roll = rng.random((n, n_guests))
+        guest[roll < self.tie_rate + self.no_contest_rate] = 4
+        guest[roll < self.tie_rate] = 3
+        contestant = np.where(rng.random((n, n_contestant_judges)) < p_first[:, None], 1, 2)
+        return guest, contestant
+
+
+def play_round(engine, judge_model, lead_skills, follow_skills, rng):
+    """Generate votes for one round of every battle and apply them. Returns the votes."""
+    rows = np.arange(engine.n_battles)
+    all_votes = {}
+    for role, skills, c1, c2 in (
+        ("lead", lead_skills, engine.pair_1_lead, engine.pair_2_lead),
+        ("follow", follow_skills, engine.pair_1_follow, engine.pair_2_follow),
+    ):
+        guest, contestant = judge_model.votes(
+            skills[rows, np.maximum(c1, 0)], skills[rows, np.maximum(c2, 0)],
+            engine.n_guests, engine.max_contestant_judges, rng)
+        engine.judge(role, guest, contestant)
+        all_votes[role] = (guest, contestant)
+    engine.end_round()
+    return all_votes
+
+
+def run_batch(n_battles, n_leads, n_follows, n_guests, judge_model, skill_spread=1.0,
+              max_rounds=500, seed=0):
+    """Simulate ``n_battles`` complete battles and return the finished engine."""
+    rng = np.random.default_rng(seed)
+    engine = BatchEngine(n_battles, n_leads, n_follows, n_guests)
+    lead_skills = rng.normal(0, skill_spread, (n_battles, n_leads))
+    follow_skills = rng.normal(0, skill_spread, (n_battles, n_follows))
+    while engine.active.any() and engine.round_num[engine.active].min() <= max_rounds:
+        play_round(engine, judge_model, lead_skills, follow_skills, rng)
+    return engine
+
+
+def cross_check(n_battles=200, n_leads=6, n_follows=6, n_guests=2, judge_model=None,
+                max_rounds=60, seed=0):
+    """Play the same seeded votes through BatchEngine and Game and compare them.
+
+    Returns a list of ``(battle, round, description)`` mismatches; an empty
+    list means the engine agreed with Game on every battle and round.
+    """
+    judge_model = judge_model or BatchJudgeModel(tie_rate=0.15, no_contest_rate=0.1)
+    rng = np.random.default_rng(seed)
+    engine = BatchEngine(n_battles, n_leads, n_follows, n_guests)
+    lead_names = [f"Lead{i}" for i in range(n_leads)]
+    follow_names = [f"Follow{i}" for i in range(n_follows)]
+    guest_names = [f"Guest{i}" for i in range(n_guests)]
+    lead_index = {name: i for i, name in enumerate(lead_names)}
+    follow_index = {name: i for i, name in enumerate(follow_names)}
+
+    games = [Game(lead_names, follow_names, guest_names, seed=seed * n_battles + b) for b in range(n_battles)]
+    crashed = [False] * n_battles
+    lead_skills = rng.normal(0, 1, (n_battles, n_leads))
+    follow_skills = rng.normal(0, 1, (n_battles, n_follows))
+    mismatches = []
+
+    def compare(b, game, round_num):
+        expected = {
+            "pairs": (lead_index[game.pair_1[0].name], follow_index[game.pair_1[1].name],
+                      lead_index[game.pair_2[0].name], follow_index[game.pair_2[1].name]),
+            "points": ([c.points for c in game.initial_leads], [c.points for c in game.initial_follows]),
+            "crowned": (game.has_winning_lead, game.has_winning_follow),
+            "queues": ([lead_index[c.name] for c in game.leads], [follow_index[c.name] for c in game.follows]),
+            "contestant_judges": len(game.contestant_judges),
+        }
+        actual = {
+            "pairs": (int(engine.pair_1_lead[b]), int(engine.pair_1_follow[b]),
+                      int(engine.pair_2_lead[b]), int(engine.pair_2_follow[b])),
+            "points": (engine.lead_points[b].tolist(), engine.follow_points[b].tolist()),
+            "crowned": (bool(engine.has_winning_lead[b]), bool(engine.has_winning_follow[b])),
+            "queues": (engine.leads.to_list(b), engine.follows.to_list(b)),
+            "contestant_judges": int(engine.contestant_judge_counts[b]),
+        }
+        for key in expected:
+            if expected[key] != actual[key]:
+                mismatches.append((b, round_num, f"{key}: Game {expected[key]} != engine {actual[key]}"))
+
+    for b, game in enumerate(games):
+        compare(b, game, 1)
+
+    for round_num in range(1, max_rounds + 1):
+        active = engine.active.copy()
+        if not active.any():
+            break
+        votes = play_round(engine, judge_model, lead_skills, follow_skills, rng)
+        for b in np.nonzero(active)[0]:
+            game = games[b]
+            judges = game.guest_judges + [j.name for j in game.contestant_judges]
+            try:
+                for role, index in (("lead", 0), ("follow", 1)):
+                    guest, contestant = votes[role]
+                    decisions = list(guest[b]) + list(contestant[b][:len(game.contestant_judges)])
+                    game.judge_round(game.pair_1[index], game.pair_2[index], role,
+                                     [(j, int(d)) for j, d in zip(judges, decisions)])
+                game.check_for_win()
+                if not game.is_finished():
+                    game.next_round()
+            except IndexError:
+                crashed[b] = True
+            if crashed[b] != bool(engine.errored[b]):
+                mismatches.append((b, round_num, f"errored: Game {crashed[b]} != engine {bool(engine.errored[b])}"))
+            elif game.is_finished() != bool(engine.finished[b]):
+                mismatches.append((b, round_num, f"finished: Game {game.is_finished()} != engine {bool(engine.finished[b])}"))
+            elif not crashed[b]:
+                compare(b, game, round_num + 1)
+
+    return mismatches
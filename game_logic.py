@@ -1,8 +1,19 @@
+import hashlib
+import itertools
+import json
+import pickle
 import random
+import sys
+from collections import deque
 
 
 class Contestant:
-    def __init__(self, name) -> None:
+    # Slots keep large fields compact; ``id`` is a small integer unique within
+    # a game, so the hot paths compare integers rather than name strings
+    __slots__ = ("id", "name", "points")
+
+    def __init__(self, name, contestant_id=None) -> None:
+        self.id = contestant_id
         self.name = name
         self.points = 0
 
@@ -10,7 +21,64 @@ class Contestant:
         return f"{self.name} ({self.points})"
 
 
+class ContestantQueue:
+    """FIFO queue of contestants with O(1) membership checks.
+
+    A deque keeps popping from the front cheap, and a count of how many times
+    each contestant is queued answers ``contestant in queue`` without a scan,
+    so round transitions don't slow down as the field grows.
+    """
+
+    def __init__(self, contestants=()) -> None:
+        self._queue = deque()
+        self._counts = {}
+        for contestant in contestants:
+            self.append(contestant)
+
+    def append(self, contestant):
+        self._queue.append(contestant)
+        self._counts[contestant] = self._counts.get(contestant, 0) + 1
+
+    def popleft(self):
+        contestant = self._queue.popleft()
+        if self._counts[contestant] == 1:
+            del self._counts[contestant]
+        else:
+            self._counts[contestant] -= 1
+        return contestant
+
+    def sort(self, key=None, reverse=False):
+        self._queue = deque(sorted(self._queue, key=key, reverse=reverse))
+
+    def remap(self, contestants):
+        """Copy of the queue with each contestant replaced by ``contestants[contestant.id]``."""
+        queue = ContestantQueue.__new__(ContestantQueue)
+        queue._queue = deque([contestants[c.id] for c in self._queue])
+        queue._counts = {contestants[c.id]: count for c, count in self._counts.items()}
+        return queue
+
+    def __contains__(self, contestant):
+        return contestant in self._counts
+
+    def __getitem__(self, index):
+        return self._queue[index]
+
+    def __iter__(self):
+        return iter(self._queue)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __repr__(self) -> str:
+        return f"ContestantQueue({list(self._queue)!r})"
+
+
 class Round:
+    __slots__ = (
+        "round_num", "lead_votes", "follow_votes", "judges", "contestant_judges", "win_messages",
+        "pairs", "lead_winner", "follow_winner", "song_info", "session_id",
+    )
+
     def __init__(
         self, round_num, lead_votes, follow_votes, judges, contestant_judges, session_id
     ) -> None:
@@ -28,22 +96,56 @@ class Round:
 
 
 class Game:
+    """A battle between leads and follows.
+
+    Every change made through the public methods is appended to ``events``, a
+    JSON-serializable log from which ``Game.from_events`` rebuilds the exact
+    same game. Each game draws contestant judges from its own RNG seeded
+    with ``seed``, so the seed and the votes fully determine a battle. Stores
+    can take a pickled snapshot of the state (``take_snapshot``) so a long
+    battle doesn't have to be replayed from the start; games never take one
+    themselves, so simulations and forks don't pay for it.
+    """
     state = 0
+    PLAN_OUTCOMES = ("pair_1", "pair_2", "tie", "no_contest")
     
-    def __init__(self, lead_names, follow_names, guest_judge_names) -> None:
+    def __init__(self, lead_names, follow_names, guest_judge_names, session_id=None,
+                 seed=None, *, contestant_judge_ids=None) -> None:
         # Store the session ID
-        self.session_id = None  # Will be set when the game is created
+        self.session_id = session_id
+        
+        # Per-game RNG, so battles can be reproduced from their seed
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.rng = random.Random(self.seed)
         
-        # Initialize contestants
-        self.leads = [Contestant(name) for name in lead_names]
-        self.follows = [Contestant(name) for name in follow_names]
+        # Append-only event log and the latest (event count, pickled state) snapshot
+        self.events = []
+        self._snapshot = None
+        self._fingerprint = ("", 0)  # (digest, number of events hashed)
+        self._plan = None  # ((version, depth), planned branches)
+        
+        # Scoreboard projection: bumped whenever points or crowns change, and
+        # (version, scoreboard, JSON bytes) built on the first read after that
+        self.scoreboard_version = 0
+        self._scoreboard = (None, None, None)
+        
+        # Initialize contestants with integer IDs (leads first, then follows)
+        self.leads = ContestantQueue(
+            Contestant(sys.intern(name), i) for i, name in enumerate(lead_names))
+        self.follows = ContestantQueue(
+            Contestant(sys.intern(name), len(lead_names) + i) for i, name in enumerate(follow_names))
         
         # Store initial order
-        self.initial_leads = self.leads.copy()
-        self.initial_follows = self.follows.copy()
+        self.initial_leads = list(self.leads)
+        self.initial_follows = list(self.follows)
+        self._contestants = self.initial_leads + self.initial_follows  # Indexed by ID
         
-        # Initialize judges
+        # Initialize judges. Guest judges get integer IDs after the
+        # contestants', and votes are keyed by judge ID inside the game; names
+        # are only used for the votes passed in and the rounds' vote records.
+        # Voters with no ID (the audience) keep their name.
         self.guest_judges = guest_judge_names
+        self._index_judges()
         self.contestant_judges = []
         
         # Initialize game state
@@ -58,14 +160,22 @@ class Game:
         self.winning_follow = None
         self.has_winning_lead = False
         self.has_winning_follow = False
-        self.last_lead_winner = None
+        self.last_lead_winner = None  # Name of the last round winner
         self.last_follow_winner = None
+        self.last_lead_winner_id = None  # ID of the last round winner, for comparisons
+        self.last_follow_winner_id = None
+        
+        # Crown state, maintained as rounds are judged and archived
+        self.crowned_lead = None  # First lead to reach the winning threshold
+        self.crowned_follow = None
+        self.lead_crown_announced = False  # Whether an archived round carries the crown message
+        self.follow_crown_announced = False
         
         # Initialize tie state
         self.tie_lead_pair = None
         self.tie_follow_pair = None
         
-        # Initialize previous pairs tracking
+        # Initialize previous pairs tracking, keyed by (lead ID, follow ID)
         self.previous_pairs = {}
         
         # Calculate total number of contestants
@@ -79,16 +189,228 @@ class Game:
         self.num_contestant_judges = min(3, len(self.leads) + len(self.follows) - 4)
         
         # Start the first round
-        self.start_round()
+        self.start_round(contestant_judge_ids)
+        self._record({
+            "type": "start",
+            "leads": list(lead_names),
+            "follows": list(follow_names),
+            "judges": list(guest_judge_names),
+            "session_id": session_id,
+            "seed": self.seed,
+            "contestant_judges": [j.id for j in self.contestant_judges],
+        })
+
+    @classmethod
+    def from_events(cls, events, snapshot=None):
+        """Rebuild a game from its event log, resuming from a snapshot if given."""
+        if snapshot is not None:
+            seq, data = snapshot
+            game = cls._from_state(data)
+            game.events = list(events[:seq])
+            game._snapshot = snapshot
+            remaining = events[seq:]
+        else:
+            start = events[0]
+            game = cls(start["leads"], start["follows"], start["judges"], start["session_id"],
+                       start.get("seed"), contestant_judge_ids=start["contestant_judges"])
+            remaining = events[1:]
+        for event in remaining:
+            game.apply_event(event)
+        return game
+
+    def apply_event(self, event):
+        """Replay one recorded event (other than "start") against this game."""
+        kind = event["type"]
+        if kind == "judge":
+            # Logs recorded before judges had IDs name them instead
+            votes = [(self._judge_ids.get(voter, voter), decision) for voter, decision in event["votes"]]
+            self._judge(self._contestants[event["c1"]], self._contestants[event["c2"]], event["role"], votes)
+        elif kind == "check_for_win":
+            self.check_for_win()
+        elif kind == "next_round":
+            self.next_round(event["contestant_judges"])
+        elif kind == "song_info":
+            self.set_song_info(event["song_info"])
+        elif kind == "finalize":
+            self.finalize_results()
+        else:
+            raise ValueError(f"Unknown game event: {kind}")
+
+    @property
+    def version(self):
+        """Number of events recorded; increases with every change to the game."""
+        return len(self.events)
+
+    def fingerprint(self):
+        """Hex digest of the seed, contestants and every vote and action so far.
+
+        Games with the same fingerprint are in the same state, so results
+        derived from a game can be cached under it. Only events added since
+        the last call are hashed.
+        """
+        digest, hashed = self._fingerprint
+        for event in self.events[hashed:]:
+            digest = hashlib.sha256((digest + json.dumps(event, sort_keys=True)).encode()).hexdigest()
+        self._fingerprint = (digest, len(self.events))
+        return digest
+
+    @property
+    def snapshot(self):
+        """The latest ``(event count, pickled state)`` snapshot taken or loaded, or None."""
+        return self._snapshot
+
+    def take_snapshot(self):
+        """Snapshot the state as ``(event count, pickled state)`` and return it."""
+        self._snapshot = (len(self.events), self._pickle_state())
+        return self._snapshot
+
+    def _index_judges(self):
+        self._judge_names = [c.name for c in self._contestants] + list(self.guest_judges)
+        self._judge_ids = {name: i for i, name in enumerate(self._judge_names)}
+        self._guest_judge_ids = frozenset(range(len(self._contestants), len(self._judge_names)))
+
+    def _record(self, event):
+        self.events.append(event)
+
+    def _pickle_state(self):
+        """Pickle everything but the event log and derived caches."""
+        state = self.__dict__.copy()
+        del state["events"], state["_snapshot"], state["_plan"], state["_scoreboard"]
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def _from_state(cls, data):
+        game = cls.__new__(cls)
+        game.__dict__.update(pickle.loads(data))
+        if "_judge_ids" not in game.__dict__:  # Snapshots from before judges had IDs
+            game._index_judges()
+        game.events = []
+        game._snapshot = None
+        game._plan = None
+        game._scoreboard = (None, None, None)
+        return game
+
+    def fork(self, rng=None):
+        """Return an independent copy of the game for what-if analysis.
+
+        Finished rounds and recorded events never change, so the fork shares
+        them with this game; only the contestants, queues, current round and
+        RNG are copied. Changes to either game don't affect the other.
+
+        By default the fork draws the same contestant judges this game would.
+        Copying the RNG state is the most expensive part of a fork, so callers
+        that don't need matching draws (e.g. Monte Carlo) can pass their own
+        ``rng`` instead.
+        """
+        fork = Game.__new__(Game)
+        fork.__dict__.update(self.__dict__)
+
+        contestants = []
+        for c in self._contestants:
+            twin = Contestant(c.name, c.id)
+            twin.points = c.points
+            contestants.append(twin)
+
+        def twin_of(c):
+            return None if c is None else contestants[c.id]
+
+        def twins_of(pair):
+            return None if pair is None else (contestants[pair[0].id], contestants[pair[1].id])
+
+        fork._contestants = contestants
+        fork.initial_leads = contestants[:self.total_num_leads]
+        fork.initial_follows = contestants[self.total_num_leads:]
+        fork.leads = self.leads.remap(contestants)
+        fork.follows = self.follows.remap(contestants)
+        fork.contestant_judges = [contestants[c.id] for c in self.contestant_judges]
+        fork.pair_1 = twins_of(self.pair_1)
+        fork.pair_2 = twins_of(self.pair_2)
+        fork.tie_lead_pair = twins_of(self.tie_lead_pair)
+        fork.tie_follow_pair = twins_of(self.tie_follow_pair)
+        fork.winning_lead = twin_of(self.winning_lead)
+        fork.winning_follow = twin_of(self.winning_follow)
+        fork.crowned_lead = twin_of(self.crowned_lead)
+        fork.crowned_follow = twin_of(self.crowned_follow)
+
+        # Appending to either list must not show up in the other
+        fork.rounds = list(self.rounds)
+        fork.events = list(self.events)
+        fork.previous_pairs = dict(self.previous_pairs)
+
+        # The current round is still being judged; its fields are replaced, never mutated
+        current = Round.__new__(Round)
+        for slot in Round.__slots__:
+            setattr(current, slot, getattr(self.current_round, slot))
+        fork.current_round = current
+
+        if rng is None:
+            rng = random.Random.__new__(random.Random)
+            rng.setstate(self.rng.getstate())
+        fork.rng = rng
+        return fork
+
+    def plan_pairings(self, depth=1):
+        """Work out the pairings that follow each possible outcome of this round.
+
+        Roles not yet judged this round are branched over ``PLAN_OUTCOMES``
+        (up to 16 branches, or one once both roles are judged). Each branch
+        records the outcomes, whether the battle would be finished and
+        otherwise the next round's pairs and contestant judges, and with
+        ``depth`` > 1 the branches of the round after that under ``next``.
+        Branches are played out on forks of the game, so the plan always
+        agrees with ``next_round``; it is cached until the game changes.
+        """
+        key = (self.version, depth)
+        if self._plan is None or self._plan[0] != key:
+            self._plan = (key, self._plan_branches(depth))
+        return self._plan[1]
+
+    def _plan_branches(self, depth):
+        roles = [role for role, votes in (("lead", self.current_round.lead_votes),
+                                          ("follow", self.current_round.follow_votes)) if not votes]
+        branches = []
+        for outcomes in itertools.product(self.PLAN_OUTCOMES, repeat=len(roles)):
+            game = self.fork()
+            branch = dict(zip(roles, outcomes))
+            try:
+                for role, outcome in zip(roles, outcomes):
+                    index = 0 if role == "lead" else 1
+                    game._judge(game.pair_1[index], game.pair_2[index], role, game._outcome_votes(outcome))
+                game.check_for_win()
+                branch["finished"] = game.is_finished()
+                if not branch["finished"]:
+                    game.next_round()
+                    branch.update(game.get_game_state())
+                    if depth > 1:
+                        branch["next"] = game._plan_branches(depth - 1)
+            except IndexError:
+                # The queues would run dry on this branch; there is nothing to show
+                continue
+            branches.append(branch)
+        return branches
+
+    def _outcome_votes(self, outcome):
+        """Unanimous votes, keyed by judge ID, producing a planned outcome."""
+        guest_vote, contestant_vote = {"pair_1": (1, 1), "pair_2": (2, 2), "tie": (3, 1), "no_contest": (4, 1)}[outcome]
+        return ([(judge, guest_vote) for judge in self._guest_judge_ids] +
+                [(judge.id, contestant_vote) for judge in self.contestant_judges])
+
+    def _draw_contestant_judges(self, contestant_judge_ids=None):
+        judges = self.get_contestant_judges()
+        # Replays use the recorded draw; drawing anyway keeps the RNG in step
+        # with the original game
+        if contestant_judge_ids is not None:
+            return [self._contestants[i] for i in contestant_judge_ids]
+        return judges
         
-    def start_round(self):
+    def start_round(self, contestant_judge_ids=None):
         """Start a new round by selecting pairs and contestant judges."""
         # Select contestant judges
-        self.contestant_judges = self.get_contestant_judges()
+        self.contestant_judges = self._draw_contestant_judges(contestant_judge_ids)
         
         # Select pairs
-        self.pair_1 = (self.leads.pop(0), self.follows.pop(0))
-        self.pair_2 = (self.leads.pop(0), self.follows.pop(0))
+        self.pair_1 = (self.leads.popleft(), self.follows.popleft())
+        self.pair_2 = (self.leads.popleft(), self.follows.popleft())
         
         # Create new round
         self.current_round = Round(
@@ -113,29 +435,34 @@ class Game:
         }
 
     def get_contestant_judges(self):
-        pool = self.leads + self.follows
-        random.shuffle(pool)
+        pool = list(self.leads) + list(self.follows)
+        self.rng.shuffle(pool)
         return pool[: self.num_contestant_judges]
 
-    def next_round(self):
-        """Prepare the game for the next round."""
+    def next_round(self, contestant_judge_ids=None):
+        """Prepare the game for the next round.
+
+        ``contestant_judge_ids`` replays a recorded choice of contestant judges
+        instead of drawing them at random.
+        """
         self.round_num += 1
         self.rounds.append(self.current_round)
+        self._archive_crowns(self.current_round)
 
         # Replenish leads if we're running low
         if len(self.leads) < 2:
             # Add all leads back to the queue except the current competing leads
-            competing_leads = {self.pair_1[0].name, self.pair_2[0].name}
+            competing_leads = {self.pair_1[0].id, self.pair_2[0].id}
             for lead in self.initial_leads:
-                if lead.name not in competing_leads and lead not in self.leads:
+                if lead.id not in competing_leads and lead not in self.leads:
                     self.leads.append(lead)
 
         # Replenish follows if we're running low
         if len(self.follows) < 2:
             # Add all follows back to the queue except the current competing follows
-            competing_follows = {self.pair_1[1].name, self.pair_2[1].name}
+            competing_follows = {self.pair_1[1].id, self.pair_2[1].id}
             for follow in self.initial_follows:
-                if follow.name not in competing_follows and follow not in self.follows:
+                if follow.id not in competing_follows and follow not in self.follows:
                     self.follows.append(follow)
 
         # Store current follows if we have a follow tie
@@ -152,8 +479,8 @@ class Game:
                 self.winning_lead = None
                 
                 # Select the next two leads from the queue
-                lead1 = self.leads.pop(0)
-                lead2 = self.leads.pop(0)
+                lead1 = self.leads.popleft()
+                lead2 = self.leads.popleft()
             elif self.tie_lead_pair:
                 # Use the tied leads
                 lead1, lead2 = self.tie_lead_pair
@@ -163,11 +490,11 @@ class Game:
                 # stays in the competition
                 lead1 = self.winning_lead
                 self.winning_lead = None
-                lead2 = self.leads.pop(0)
+                lead2 = self.leads.popleft()
             else:
                 # Regular selection
-                lead1 = self.leads.pop(0)
-                lead2 = self.leads.pop(0)
+                lead1 = self.leads.popleft()
+                lead2 = self.leads.popleft()
         elif self.tie_lead_pair:
             # Use the tied leads
             lead1, lead2 = self.tie_lead_pair
@@ -178,11 +505,11 @@ class Game:
             if self.winning_lead:
                 lead1 = self.winning_lead
                 self.winning_lead = None
-                lead2 = self.leads.pop(0)
+                lead2 = self.leads.popleft()
             else:
                 # Regular selection
-                lead1 = self.leads.pop(0)
-                lead2 = self.leads.pop(0)
+                lead1 = self.leads.popleft()
+                lead2 = self.leads.popleft()
 
         # Handle follow selection based on game state
         if self.has_winning_follow and not self.has_winning_lead:
@@ -192,8 +519,8 @@ class Game:
                 self.winning_follow = None
                 
                 # Select the next two follows from the queue
-                follow1 = self.follows.pop(0)
-                follow2 = self.follows.pop(0)
+                follow1 = self.follows.popleft()
+                follow2 = self.follows.popleft()
             elif current_follows:  # If we have a follow tie, keep the same follows
                 follow1, follow2 = current_follows
             elif self.winning_follow:
@@ -201,11 +528,11 @@ class Game:
                 # stays in the competition
                 follow1 = self.winning_follow
                 self.winning_follow = None
-                follow2 = self.follows.pop(0)
+                follow2 = self.follows.popleft()
             else:
                 # Regular selection
-                follow1 = self.follows.pop(0)
-                follow2 = self.follows.pop(0)
+                follow1 = self.follows.popleft()
+                follow2 = self.follows.popleft()
         elif current_follows:  # If we have a follow tie, keep the same follows
             follow1, follow2 = current_follows
         else:
@@ -214,24 +541,24 @@ class Game:
             if self.winning_follow:
                 follow1 = self.winning_follow
                 self.winning_follow = None
-                follow2 = self.follows.pop(0)
+                follow2 = self.follows.popleft()
             else:
                 # Regular selection
-                follow1 = self.follows.pop(0)
-                follow2 = self.follows.pop(0)
+                follow1 = self.follows.popleft()
+                follow2 = self.follows.popleft()
 
         # When there's a follow tie, we need to ensure the couples are different
         if current_follows:
             # Get the winning lead and next lead from queue
-            winning_lead = lead1 if lead1.name == self.last_lead_winner else lead2
-            next_lead = lead2 if lead1.name == self.last_lead_winner else lead1
+            winning_lead = lead1 if lead1.id == self.last_lead_winner_id else lead2
+            next_lead = lead2 if lead1.id == self.last_lead_winner_id else lead1
             
             # Get the previous pairs for comparison
-            prev_pair1 = (self.pair_1[0].name, self.pair_1[1].name)
-            prev_pair2 = (self.pair_2[0].name, self.pair_2[1].name)
+            prev_pair1 = (self.pair_1[0].id, self.pair_1[1].id)
+            prev_pair2 = (self.pair_2[0].id, self.pair_2[1].id)
             
             # Try different combinations until we find one that doesn't match previous pairs
-            if (winning_lead.name, follow1.name) == prev_pair1 or (winning_lead.name, follow1.name) == prev_pair2:
+            if (winning_lead.id, follow1.id) == prev_pair1 or (winning_lead.id, follow1.id) == prev_pair2:
                 # If winning lead with follow1 would recreate a previous pair, swap follows
                 follow1, follow2 = follow2, follow1
             
@@ -245,8 +572,8 @@ class Game:
                 (lead1, lead2) != (None, None) and (follow1, follow2) != (None, None)):
                 
                 # Check if the default pairing would recreate previous pairs
-                pairing_1 = (lead1.name, follow1.name)
-                pairing_2 = (lead2.name, follow2.name)
+                pairing_1 = (lead1.id, follow1.id)
+                pairing_2 = (lead2.id, follow2.id)
                 
                 # If either pairing already exists in previous_pairs, swap follows
                 if pairing_1 in self.previous_pairs or pairing_2 in self.previous_pairs:
@@ -255,11 +582,11 @@ class Game:
                 
                 # Prevent pairing two winning contestants together
                 # Check if both lead1 and follow1 were winners in the last round
-                if (self.last_lead_winner == lead1.name and self.last_follow_winner == follow1.name):
+                if (self.last_lead_winner_id == lead1.id and self.last_follow_winner_id == follow1.id):
                     # Swap follows to prevent winners being paired
                     follow1, follow2 = follow2, follow1
                 # Check if both lead2 and follow2 were winners in the last round
-                elif (self.last_lead_winner == lead2.name and self.last_follow_winner == follow2.name):
+                elif (self.last_lead_winner_id == lead2.id and self.last_follow_winner_id == follow2.id):
                     # Swap follows to prevent winners being paired
                     follow1, follow2 = follow2, follow1
 
@@ -276,20 +603,20 @@ class Game:
         # Replenish leads if we're running low
         if len(self.leads) < 2:
             # Add all leads back to the queue except the current competing leads
-            competing_leads = {self.pair_1[0].name, self.pair_2[0].name}
+            competing_leads = {self.pair_1[0].id, self.pair_2[0].id}
             for lead in self.initial_leads:
-                if lead.name not in competing_leads and lead not in self.leads:
+                if lead.id not in competing_leads and lead not in self.leads:
                     self.leads.append(lead)
 
         # Replenish follows if we're running low
         if len(self.follows) < 2:
             # Add all follows back to the queue except the current competing follows
-            competing_follows = {self.pair_1[1].name, self.pair_2[1].name}
+            competing_follows = {self.pair_1[1].id, self.pair_2[1].id}
             for follow in self.initial_follows:
-                if follow.name not in competing_follows and follow not in self.follows:
+                if follow.id not in competing_follows and follow not in self.follows:
                     self.follows.append(follow)
 
-        self.contestant_judges = self.get_contestant_judges()
+        self.contestant_judges = self._draw_contestant_judges(contestant_judge_ids)
         self.current_round = Round(
             self.round_num,
             {},
@@ -311,13 +638,40 @@ class Game:
             }
         }
 
-    def judge_round(self, c1, c2, role, votes):
-        guest_votes = [d for (v, d) in votes if v in self.guest_judges]
+        self._record({"type": "next_round", "contestant_judges": [j.id for j in self.contestant_judges]})
+
+    def set_song_info(self, song_info):
+        """Attach the song played in the current round."""
+        self.current_round.song_info = song_info
+        self._record({"type": "song_info", "song_info": song_info})
 
-        # Store votes in the current round
+    def judge_round(self, c1, c2, role, votes):
+        """Judge one role of the round from ``(judge name, decision)`` votes."""
+        return self._judge(c1, c2, role, [(self._judge_ids.get(voter, str(voter)), decision)
+                                          for voter, decision in votes])
+
+    def _judge(self, c1, c2, role, votes):
+        # ``votes`` are keyed by judge ID, or by name for voters without one
+        result = self._judge_round(c1, c2, role, votes)
+        self._record({
+            "type": "judge",
+            "role": role,
+            "c1": c1.id,
+            "c2": c2.id,
+            "votes": [list(vote) for vote in votes],
+        })
+        return result
+
+    def _judge_name(self, voter):
+        return self._judge_names[voter] if isinstance(voter, int) else voter
+
+    def _judge_round(self, c1, c2, role, votes):
+        guest_votes = [d for (v, d) in votes if v in self._guest_judge_ids]
+
+        # Store votes in the current round, by judge name
         vote_dict = {}
         for voter, decision in votes:
-            vote_dict[voter] = decision
+            vote_dict[self._judge_name(voter)] = decision
             
         if role == "lead":
             self.current_round.lead_votes = vote_dict
@@ -343,17 +697,17 @@ class Game:
                 # enqueue old leads, select next
                 self.leads.append(c1)
                 self.leads.append(c2)
-                self.winning_lead = self.leads.pop(0)
+                self.winning_lead = self.leads.popleft()
             else:
                 self.follows.append(c1)
                 self.follows.append(c2)
-                self.winning_follow = self.follows.pop(0)
+                self.winning_follow = self.follows.popleft()
             return {"winner": "No Contest", "guest_votes": [], "contestant_votes": []}
 
         # Normal voting
         score1 = score2 = 0
         for voter, decision in votes:
-            is_guest = voter in self.guest_judges
+            is_guest = voter in self._guest_judge_ids
             if decision == 1:
                 score1 += 2 if is_guest else 1
             elif decision == 2:
@@ -385,9 +739,11 @@ class Game:
                 # Check if we've reached a win condition using the common threshold
                 if winner.points + 1 >= self.win_threshold:
                     self.has_winning_lead = True
+                    self.crowned_lead = winner
             
             # Track the lead winner for this round to prevent pairing with follow winner
             self.last_lead_winner = winner.name
+            self.last_lead_winner_id = winner.id
             # Also store the lead winner in the current round
             self.current_round.lead_winner = winner.name
             
@@ -406,22 +762,25 @@ class Game:
                 # Check if we've reached a win condition using the common threshold
                 if winner.points + 1 >= self.win_threshold:
                     self.has_winning_follow = True
+                    self.crowned_follow = winner
                     # If follow has reached threshold, add them to the queue
                     self.follows.append(winner)
                     self.winning_follow = None
             
             # Track the follow winner for this round to prevent pairing with lead winner
             self.last_follow_winner = winner.name
+            self.last_follow_winner_id = winner.id
             # Also store the follow winner in the current round
             self.current_round.follow_winner = winner.name
 
         winner.points += 1
+        self.scoreboard_version += 1
 
         gv = []
         cv = []
         for voter, decision in votes:
             if (decision == 1 and winner is c1) or (decision == 2 and winner is c2):
-                (gv if voter in self.guest_judges else cv).append(voter)
+                (gv if voter in self._guest_judge_ids else cv).append(self._judge_name(voter))
 
         return {"winner": winner.name, "guest_votes": gv, "contestant_votes": cv}
 
@@ -435,17 +794,8 @@ class Game:
             self.winning_lead.points >= self.win_threshold):
             
             # Only add crown message if we haven't already shown a crown message for this role
-            win_message = f"👑 {self.winning_lead.name} has won for the leads!"
-            
-            # Check if we've seen this message in any previous rounds
-            is_new_crown = True
-            for r in self.rounds:
-                if r.win_messages and any("👑" in msg and "leads" in msg for msg in r.win_messages):
-                    is_new_crown = False
-                    break
-                    
-            if is_new_crown:
-                out.append(win_message)
+            if not self.lead_crown_announced:
+                out.append(f"👑 {self.winning_lead.name} has won for the leads!")
         
         # Generate win message for follow winner if they've reached the winning threshold
         # Only show the message if this is the first winner for follows
@@ -453,17 +803,8 @@ class Game:
             self.winning_follow.points >= self.win_threshold):
             
             # Only add crown message if we haven't already shown a crown message for this role
-            win_message = f"👑 {self.winning_follow.name} has won for the follows!"
-            
-            # Check if we've seen this message in any previous rounds
-            is_new_crown = True
-            for r in self.rounds:
-                if r.win_messages and any("👑" in msg and "follows" in msg for msg in r.win_messages):
-                    is_new_crown = False
-                    break
-                    
-            if is_new_crown:
-                out.append(win_message)
+            if not self.follow_crown_announced:
+                out.append(f"👑 {self.winning_follow.name} has won for the follows!")
 
         # Only set game as finished if both roles have winners
         if self.has_winning_lead and self.has_winning_follow:
@@ -473,8 +814,43 @@ class Game:
         if out:
             self.current_round.win_messages = out
         
+        self._record({"type": "check_for_win"})
         return out if out else None
 
+    def _archive_crowns(self, round_):
+        """Remember which crown messages a finished round announced."""
+        if round_.win_messages:
+            if any("👑" in msg and "leads" in msg for msg in round_.win_messages):
+                self.lead_crown_announced = True
+            if any("👑" in msg and "follows" in msg for msg in round_.win_messages):
+                self.follow_crown_announced = True
+
+    def is_crowned(self, contestant):
+        """Whether a contestant was the first of their role to reach the winning threshold."""
+        return contestant is self.crowned_lead or contestant is self.crowned_follow
+
+    def scoreboard(self):
+        """Points and crown flags of every contestant, in starting order.
+
+        Only rebuilt after points or crowns change, so reading it is nearly
+        free; the result is shared between calls and must not be modified.
+        """
+        if self._scoreboard[0] != self.scoreboard_version:
+            board = {
+                "leads": [self._score_entry(c) for c in self.initial_leads],
+                "follows": [self._score_entry(c) for c in self.initial_follows],
+            }
+            self._scoreboard = (self.scoreboard_version, board, json.dumps(board).encode())
+        return self._scoreboard[1]
+
+    def scoreboard_json(self):
+        """The scoreboard pre-serialized as JSON bytes."""
+        self.scoreboard()
+        return self._scoreboard[2]
+
+    def _score_entry(self, contestant):
+        return {"name": contestant.name, "points": contestant.points, "is_winner": self.is_crowned(contestant)}
+
     def get_game_state(self):
         return {
             "round": self.round_num,
@@ -492,6 +868,8 @@ class Game:
         return self.state == 1
 
     def finalize_results(self):
+        before = (list(self.leads), list(self.follows))
+
         # Ensure final winners are in the lists
         if self.winning_lead and self.winning_lead not in self.leads:
             self.leads.append(self.winning_lead)
@@ -502,7 +880,12 @@ class Game:
         self.leads.sort(key=lambda c: c.points, reverse=True)
         self.follows.sort(key=lambda c: c.points, reverse=True)
 
-        return self.leads, self.follows
+        after = (list(self.leads), list(self.follows))
+        # Finalizing again without new results changes nothing, so leave the
+        # version alone and let repeated exports be recognised as unchanged
+        if after != before:
+            self._record({"type": "finalize"})
+        return after
 
     def debug_state(self):
         """Print the current state of the game for debugging."""
@@ -521,5 +904,5 @@ class Game:
 
     def _record_pairings(self):
         # Record initial pairings
-        self.previous_pairs[(self.pair_1[0].name, self.pair_1[1].name)] = True
-        self.previous_pairs[(self.pair_2[0].name, self.pair_2[1].name)] = True
+        self.previous_pairs[(self.pair_1[0].id, self.pair_1[1].id)] = True
+        self.previous_pairs[(self.pair_2[0].id, self.pair_2[1].id)] = True
@@ -49,14 +49,15 @@ if __name__ == "__main__":
     # Main loop with option to end early
     while True:
         state = game.get_game_state()
+        contestants = list(game.leads) + list(game.follows)
         print_header(f"Round {state['round']}")
         print(
-            f"Matchup 1: {format_contestant_with_points(state['pair_1'][0], game.leads+game.follows, game)} (Lead) & "
-            f"{format_contestant_with_points(state['pair_1'][1], game.leads+game.follows, game)} (Follow)"
+            f"Matchup 1: {format_contestant_with_points(state['pair_1'][0], contestants, game)} (Lead) & "
+            f"{format_contestant_with_points(state['pair_1'][1], contestants, game)} (Follow)"
         )
         print(
-            f"Matchup 2: {format_contestant_with_points(state['pair_2'][0], game.leads+game.follows, game)} (Lead) & "
-            f"{format_contestant_with_points(state['pair_2'][1], game.leads+game.follows, game)} (Follow)"
+            f"Matchup 2: {format_contestant_with_points(state['pair_2'][0], contestants, game)} (Lead) & "
+            f"{format_contestant_with_points(state['pair_2'][1], contestants, game)} (Follow)"
         )
         print(f"Contestant Judges: {', '.join(state['contestant_judges'])}")
 
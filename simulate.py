@@ -0,0 +1,403 @@
+"""
+Headless Monte Carlo simulator for Hustle n' Tussle battles.
+
+Plays complete battles through game_logic.Game with synthetic judges, spread
+over all CPU cores, and reports how many rounds it takes to crown each role,
+how often the first dancer in the queue takes the crown and how points are
+distributed. Use it to estimate how long an event will run and to check
+pairing fairness before changing the rules. ``project`` runs the same kind of
+simulation from a live battle to estimate each dancer's chance of the crown.
+
+Usage:
+    python simulate.py --games 100000 --leads 8 --follows 8
+    python simulate.py --games 1000000 --engine numpy
+    python simulate.py --cross-check
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from game_logic import Game
+
+
+class JudgeModel:
+    """Synthetic judges voting on contestants with hidden skill ratings.
+
+    A judge prefers the stronger dancer with probability
+    ``sigmoid(discernment * (skill_1 - skill_2) + position_bias)``, so a
+    discernment of 0 is a coin toss and a positive bias favours pair 1.
+    Guest judges may also call a tie or no contest.
+    """
+
+    def __init__(self, discernment=1.0, position_bias=0.0, tie_rate=0.05, no_contest_rate=0.01):
+        self.discernment = discernment
+        self.position_bias = position_bias
+        self.tie_rate = tie_rate
+        self.no_contest_rate = no_contest_rate
+
+    def prefers_first(self, skill_1, skill_2):
+        """Probability that a judge votes for the first contestant."""
+        x = self.discernment * (skill_1 - skill_2) + self.position_bias
+        return 1 / (1 + math.exp(-x))
+
+    def vote(self, skill_1, skill_2, is_guest, rng):
+        if is_guest:
+            roll = rng.random()
+            if roll < self.tie_rate:
+                return 3
+            if roll < self.tie_rate + self.no_contest_rate:
+                return 4
+        return 1 if rng.random() < self.prefers_first(skill_1, skill_2) else 2
+
+
+def play_out(game, judge_model, skills, rng, max_rounds=500):
+    """Drive a game to completion with synthetic votes.
+
+    ``skills`` maps contestant names to their hidden skill. Returns the round
+    each role was crowned in (None if it never was), who was crowned and
+    whether the battle finished within ``max_rounds``.
+    """
+    crowned = {"lead": game.round_num if game.has_winning_lead else None,
+               "follow": game.round_num if game.has_winning_follow else None}
+    crown_holder = {"lead": game.last_lead_winner if game.has_winning_lead else None,
+                    "follow": game.last_follow_winner if game.has_winning_follow else None}
+
+    while not game.is_finished() and game.round_num <= max_rounds:
+        judges = game.guest_judges + [j.name for j in game.contestant_judges]
+        for role, index in (("lead", 0), ("follow", 1)):
+            if game.current_round.lead_votes if role == "lead" else game.current_round.follow_votes:
+                # Already judged in a live battle we're projecting from
+                continue
+            c1, c2 = game.pair_1[index], game.pair_2[index]
+            votes = [
+                (judge, judge_model.vote(skills[c1.name], skills[c2.name], judge in game.guest_judges, rng))
+                for judge in judges
+            ]
+            already_crowned = game.has_winning_lead if role == "lead" else game.has_winning_follow
+            game.judge_round(c1, c2, role, votes)
+            now_crowned = game.has_winning_lead if role == "lead" else game.has_winning_follow
+            if now_crowned and not already_crowned:
+                crowned[role] = game.round_num
+                crown_holder[role] = game.last_lead_winner if role == "lead" else game.last_follow_winner
+
+        game.check_for_win()
+        if game.is_finished():
+            break
+        game.next_round()
+
+    return {
+        "finished": game.is_finished(),
+        "rounds": game.round_num,
+        "crowned_round": crowned,
+        "crown_holder": crown_holder,
+    }
+
+
+def _logit(p):
+    return math.log(p / (1 - p))
+
+
+def fit_judge_model(game, prior_weight=20):
+    """Fit a JudgeModel to the votes cast so far in a battle.
+
+    Tie and no contest rates come from the guest judges' votes and the
+    position bias from how often judges picked pair 1. Each estimate is
+    blended with the JudgeModel defaults as if those had been seen in
+    ``prior_weight`` earlier votes, so a battle's first rounds don't produce
+    extreme models.
+    """
+    default = JudgeModel()
+    guest_votes = first = second = 0
+    ties = no_contests = 0
+    for round_ in game.rounds + [game.current_round]:
+        for votes in (round_.lead_votes, round_.follow_votes):
+            for voter, decision in votes.items():
+                if voter in game.guest_judges:
+                    guest_votes += 1
+                    ties += decision == 3
+                    no_contests += decision == 4
+                first += decision == 1
+                second += decision == 2
+
+    def blend(count, total, prior):
+        return (count + prior * prior_weight) / (total + prior_weight)
+
+    return JudgeModel(
+        discernment=default.discernment,
+        position_bias=_logit(blend(first, first + second, 0.5)),
+        tie_rate=blend(ties, guest_votes, default.tie_rate),
+        no_contest_rate=blend(no_contests, guest_votes, default.no_contest_rate),
+    )
+
+
+def estimate_skills(game):
+    """Skill estimates from each contestant's round wins so far.
+
+    A contestant's skill is the log-odds of their (Laplace-smoothed) share of
+    rounds won, so unknown dancers start level at 0.
+    """
+    appearances = Counter()
+    wins = Counter()
+    for round_ in game.rounds:
+        for pair in round_.pairs.values():
+            appearances.update(pair.values())
+        wins.update(name for name in (round_.lead_winner, round_.follow_winner) if name)
+    return {c.name: _logit((wins[c.name] + 1) / (appearances[c.name] + 2))
+            for c in game.initial_leads + game.initial_follows}
+
+
+def project(game, simulations=1000, seed=0, max_rounds=200):
+    """Simulate the rest of a live battle from its current state.
+
+    Plays ``simulations`` forks of ``game`` to completion (giving up
+    ``max_rounds`` rounds from now) with a judge model and skills fitted to
+    the battle so far. Returns each contestant's share of simulations in
+    which they took their role's crown, keyed by role and name, and the
+    expected number of rounds left. ``game`` itself is not changed.
+    """
+    judge_model = fit_judge_model(game)
+    skills = estimate_skills(game)
+    rng = random.Random(seed)
+    crowns = {"lead": Counter(), "follow": Counter()}
+    played = rounds_left = 0
+
+    for _ in range(simulations):
+        # The forks draw contestant judges from our RNG; which ones is immaterial here
+        fork = game.fork(rng=rng)
+        try:
+            play_out(fork, judge_model, skills, rng, game.round_num + max_rounds)
+        except IndexError:
+            continue
+        played += 1
+        rounds_left += fork.round_num - game.round_num
+        for role, crowned in (("lead", fork.crowned_lead), ("follow", fork.crowned_follow)):
+            if crowned is not None:
+                crowns[role][crowned.name] += 1
+
+    played_share = 1 / played if played else 0
+    return {
+        "simulations": played,
+        "leads": {c.name: crowns["lead"][c.name] * played_share for c in game.initial_leads},
+        "follows": {c.name: crowns["follow"][c.name] * played_share for c in game.initial_follows},
+        "expected_rounds_remaining": rounds_left * played_share,
+    }
+
+
+class SimulationStats:
+    """Aggregated results of many simulated battles. Mergeable across workers."""
+
+    def __init__(self):
+        self.games = 0
+        self.finished = 0
+        self.errors = 0
+        self.rounds = Counter()  # rounds played -> battles
+        self.crowned_round = {"lead": Counter(), "follow": Counter()}
+        self.first_in_queue_crowns = {"lead": 0, "follow": 0}
+        self.points = {"lead": Counter(), "follow": Counter()}  # final points -> contestants
+
+    def record(self, game, result):
+        self.games += 1
+        self.finished += result["finished"]
+        self.rounds[result["rounds"]] += 1
+        for role, initial in (("lead", game.initial_leads), ("follow", game.initial_follows)):
+            if result["crowned_round"][role] is not None:
+                self.crowned_round[role][result["crowned_round"][role]] += 1
+            if result["crown_holder"][role] == initial[0].name:
+                self.first_in_queue_crowns[role] += 1
+            self.points[role].update(c.points for c in initial)
+
+    def merge(self, other):
+        self.games += other.games
+        self.finished += other.finished
+        self.errors += other.errors
+        self.rounds.update(other.rounds)
+        for role in ("lead", "follow"):
+            self.crowned_round[role].update(other.crowned_round[role])
+            self.first_in_queue_crowns[role] += other.first_in_queue_crowns[role]
+            self.points[role].update(other.points[role])
+        return self
+
+
+def _summary(counter):
+    """Mean, median and 90th percentile of a value -> frequency counter."""
+    values = sorted(counter.elements())
+    if not values:
+        return None
+    p90 = values[min(len(values) - 1, int(len(values) * 0.9))]
+    return statistics.fmean(values), statistics.median(values), p90
+
+
+def simulate_chunk(args):
+    """Play ``count`` battles in a worker process; returns SimulationStats."""
+    params, count, seed = args
+    rng = random.Random(seed)
+    judge_model = JudgeModel(params["discernment"], params["position_bias"],
+                             params["tie_rate"], params["no_contest_rate"])
+    lead_names = [f"Lead{i}" for i in range(1, params["leads"] + 1)]
+    follow_names = [f"Follow{i}" for i in range(1, params["follows"] + 1)]
+    guest_names = [f"Guest{i}" for i in range(1, params["judges"] + 1)]
+
+    stats = SimulationStats()
+    for _ in range(count):
+        skills = {name: rng.gauss(0, params["skill_spread"]) for name in lead_names + follow_names}
+        game = Game(lead_names, follow_names, guest_names, seed=rng.getrandbits(32))
+        try:
+            result = play_out(game, judge_model, skills, rng, params["max_rounds"])
+        except IndexError:
+            # Queues can run dry in degenerate fields; count them rather than abort the run
+            stats.errors += 1
+            continue
+        stats.record(game, result)
+    return stats
+
+
+def _batch_judge_model(params):
+    from batch_engine import BatchJudgeModel
+    return BatchJudgeModel(params["discernment"], params["position_bias"],
+                           params["tie_rate"], params["no_contest_rate"])
+
+
+def simulate_batch_chunk(args):
+    """Play ``count`` battles in lockstep with the NumPy engine; returns SimulationStats."""
+    from batch_engine import run_batch
+
+    params, count, seed = args
+    engine = run_batch(count, params["leads"], params["follows"], params["judges"],
+                       _batch_judge_model(params), params["skill_spread"], params["max_rounds"], seed)
+    ok = ~engine.errored
+
+    stats = SimulationStats()
+    stats.games = int(ok.sum())
+    stats.finished = int(engine.finished.sum())
+    stats.errors = int(engine.errored.sum())
+    stats.rounds.update(engine.round_num[ok].tolist())
+    for role, points in (("lead", engine.lead_points), ("follow", engine.follow_points)):
+        crowned = ok & (engine.crowned_round[role] >= 0)
+        stats.crowned_round[role].update(engine.crowned_round[role][crowned].tolist())
+        stats.first_in_queue_crowns[role] = int((crowned & (engine.crown_holder[role] == 0)).sum())
+        stats.points[role].update(points[ok].ravel().tolist())
+    return stats
+
+
+def run_simulation(params, games, workers=None, seed=0, chunk_size=250, engine="game"):
+    """Simulate ``games`` battles across a process pool.
+
+    ``engine`` is "game" to play each battle through game_logic.Game, or
+    "numpy" to advance whole chunks of battles at once with batch_engine.
+    """
+    if engine == "numpy":
+        worker, chunk_size = simulate_batch_chunk, max(chunk_size, 20000)
+    else:
+        worker = simulate_chunk
+
+    chunks = []
+    remaining = games
+    while remaining > 0:
+        count = min(chunk_size, remaining)
+        chunks.append((params, count, seed + len(chunks)))
+        remaining -= count
+
+    stats = SimulationStats()
+    if workers == 1:
+        for chunk in chunks:
+            stats.merge(worker(chunk))
+        return stats
+
+    with Pool(processes=workers) as pool:
+        for partial in pool.imap_unordered(worker, chunks):
+            stats.merge(partial)
+    return stats
+
+
+def print_report(stats, params, elapsed):
+    print(f"\n===== Simulated {stats.games} battles "
+          f"({params['leads']} leads, {params['follows']} follows, {params['judges']} guest judges) =====\n")
+    print(f"Finished within {params['max_rounds']} rounds: {stats.finished} "
+          f"({stats.finished / max(stats.games, 1):.1%})")
+    if stats.errors:
+        print(f"Aborted (queue ran dry): {stats.errors}")
+
+    summary = _summary(stats.rounds)
+    if summary:
+        print(f"Rounds per battle: mean {summary[0]:.1f}, median {summary[1]}, p90 {summary[2]}")
+    for role, label in (("lead", "Leads"), ("follow", "Follows")):
+        summary = _summary(stats.crowned_round[role])
+        if summary:
+            print(f"{label} crowned in round: mean {summary[0]:.1f}, median {summary[1]}, p90 {summary[2]}")
+
+    print("\nFirst-in-queue crown rate:")
+    for role, label, n in (("lead", "Leads", params["leads"]), ("follow", "Follows", params["follows"])):
+        rate = stats.first_in_queue_crowns[role] / max(stats.games, 1)
+        print(f" {label}: {rate:.1%} (uniform would be {1 / n:.1%})")
+
+    print("\nPoints distribution (points: share of contestants):")
+    for role, label in (("lead", "Leads"), ("follow", "Follows")):
+        total = sum(stats.points[role].values()) or 1
+        dist = ", ".join(f"{p}: {c / total:.1%}" for p, c in sorted(stats.points[role].items()))
+        print(f" {label}: {dist}")
+
+    print(f"\n{stats.games / elapsed:,.0f} games/s over {elapsed:.2f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo simulation of Hustle n' Tussle battles.")
+    parser.add_argument("--games", type=int, default=10000, help="number of battles to simulate")
+    parser.add_argument("--leads", type=int, default=8)
+    parser.add_argument("--follows", type=int, default=8)
+    parser.add_argument("--judges", type=int, default=2, help="number of guest judges")
+    parser.add_argument("--skill-spread", type=float, default=1.0,
+                        help="standard deviation of contestant skill")
+    parser.add_argument("--discernment", type=float, default=1.0,
+                        help="how strongly judges follow skill differences (0 = coin toss)")
+    parser.add_argument("--position-bias", type=float, default=0.0,
+                        help="judges' log-odds bias towards pair 1")
+    parser.add_argument("--tie-rate", type=float, default=0.05, help="chance a guest judge votes tie")
+    parser.add_argument("--no-contest-rate", type=float, default=0.01,
+                        help="chance a guest judge votes no contest")
+    parser.add_argument("--max-rounds", type=int, default=500, help="give up on a battle after this many rounds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["game", "numpy"], default="game",
+                        help="play battles one at a time through Game, or in lockstep with NumPy")
+    parser.add_argument("--cross-check", action="store_true",
+                        help="check that the NumPy engine agrees with Game instead of simulating")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {
+        "leads": args.leads,
+        "follows": args.follows,
+        "judges": args.judges,
+        "skill_spread": args.skill_spread,
+        "discernment": args.discernment,
+        "position_bias": args.position_bias,
+        "tie_rate": args.tie_rate,
+        "no_contest_rate": args.no_contest_rate,
+        "max_rounds": args.max_rounds,
+    }
+
+    if args.cross_check:
+        from batch_engine import cross_check
+
+        battles = min(args.games, 1000)
+        mismatches = cross_check(battles, args.leads, args.follows, args.judges,
+                                 _batch_judge_model(params), min(args.max_rounds, 200), args.seed)
+        for battle, round_num, description in mismatches[:20]:
+            print(f"Battle {battle}, round {round_num}: {description}")
+        print(f"Cross-checked {battles} battles: {len(mismatches)} mismatches")
+        return
+
+    start = time.perf_counter()
+    stats = run_simulation(params, args.games, workers=args.workers, seed=args.seed, engine=args.engine)
+    print_report(stats, params, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,38 @@
 import unittest
+import atexit
 import io
 import sys
 import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 from openpyxl import load_workbook
-from web.app import app, games
-from game_logic import Game
+
+# The tests clear the stores, so keep them away from the files a deployed app
+# uses; the environment has to be set before the app's config is imported
+TEST_DATA_DIR = tempfile.mkdtemp(prefix='hustlentussle_tests_')
+atexit.register(shutil.rmtree, TEST_DATA_DIR, ignore_errors=True)
+os.environ['GAME_STORE_PATH'] = os.path.join(TEST_DATA_DIR, 'games.sqlite3')
+os.environ['BALLOT_STORE_PATH'] = os.path.join(TEST_DATA_DIR, 'games.sqlite3')
+os.environ['AUDIENCE_STORE_PATH'] = os.path.join(TEST_DATA_DIR, 'audience.sqlite3')
+os.environ['EXPORT_STORE_PATH'] = os.path.join(TEST_DATA_DIR, 'games.sqlite3')
+os.environ['IMPORT_CACHE_DIR'] = os.path.join(TEST_DATA_DIR, 'imports')
+
+from web.app import app, audience, ballots, broadcaster, export_jobs, games, projections, spotify_tokens, tracks
+from web.audience import AudienceTally
+from web.ballots import BallotBox
+from web.exports import WINNER_STYLE, ExportJobs, write_battle_workbook
+from web.imports import ImportCache
+from game_logic import Contestant, ContestantQueue, Game
 from web.config import get_config
+from batch_engine import BatchJudgeModel, cross_check
+from simulate import JudgeModel, play_out, project, run_simulation
+from web.game_store import GameConflictError, GameStore, SQLiteBackend
+from web.spotify import (FakeTracksBackend, HTTPTokenBackend, HTTPTracksBackend, StubTokenBackend, TokenManager,
+                         TrackCache)
 
 class TestGameLogic(unittest.TestCase):
     @classmethod
@@ -42,6 +69,8 @@ class TestGameLogic(unittest.TestCase):
         try:
             self.app_context.pop()
             games.clear()
+            ballots.clear()
+            audience.clear()
         except Exception as e:
             print(f"Error in tearDown: {str(e)}")
     
@@ -383,6 +412,485 @@ class TestGameLogic(unittest.TestCase):
             "No couple should remain the same after follow tie"
         )
 
+    def test_contestant_queue(self):
+        """Test that contestant queues keep FIFO order and track membership."""
+        contestants = [Contestant(f"Lead{i}") for i in range(5)]
+        queue = ContestantQueue(contestants)
+        self.assertIs(queue.popleft(), contestants[0])
+        self.assertNotIn(contestants[0], queue)
+        self.assertIn(contestants[4], queue)
+
+        queue.append(contestants[0])
+        self.assertEqual([c.name for c in queue], ["Lead1", "Lead2", "Lead3", "Lead4", "Lead0"])
+        self.assertIs(queue[0], contestants[1])
+        self.assertIn(contestants[0], queue)
+
+    def test_crown_tracking(self):
+        """Test that the first contestant to reach the threshold is tracked as crowned."""
+        lead = self.game.pair_1[0]
+        lead.points = self.game.win_threshold - 1
+        self.game.judge_round(lead, self.game.pair_2[0], "lead", [("Judge1", 1), ("Judge2", 1)])
+
+        self.assertIs(self.game.crowned_lead, lead)
+        self.assertTrue(self.game.is_crowned(lead))
+        self.assertFalse(self.game.is_crowned(self.game.pair_2[0]))
+        self.assertEqual(self.game.check_for_win(), [f"👑 {lead.name} has won for the leads!"])
+
+        self.game.next_round()
+        self.assertTrue(self.game.lead_crown_announced)
+
+    def test_event_replay(self):
+        """Test that replaying the event log, with or without a snapshot, rebuilds the game."""
+        random.seed(3)
+        game = Game(["L1", "L2", "L3", "L4", "L5", "L6"], ["F1", "F2", "F3", "F4", "F5"], self.judge_names)
+        skills = {c.name: 0.0 for c in game.initial_leads + game.initial_follows}
+        play_out(game, JudgeModel(tie_rate=0.2, no_contest_rate=0.1), skills, random.Random(3))
+        game.finalize_results()
+        self.assertIsNone(game.snapshot)  # Only stores take snapshots
+        snapshot = game.take_snapshot()
+
+        for replayed in (Game.from_events(game.events), Game.from_events(game.events, snapshot)):
+            self.assertEqual(replayed.version, game.version)
+            self.assertEqual(replayed.get_game_state(), game.get_game_state())
+            self.assertEqual([str(c) for c in replayed.initial_leads + replayed.initial_follows],
+                             [str(c) for c in game.initial_leads + game.initial_follows])
+            self.assertEqual([(r.lead_votes, r.follow_votes, r.win_messages) for r in replayed.rounds],
+                             [(r.lead_votes, r.follow_votes, r.win_messages) for r in game.rounds])
+            self.assertEqual(replayed.is_finished(), game.is_finished())
+            self.assertEqual(replayed.fingerprint(), game.fingerprint())
+
+    def test_votes_are_recorded_by_judge_id(self):
+        """Test that judges are logged by ID, rounds keep their names, and name-keyed logs still replay."""
+        game = Game(["L1", "L2", "L3"], ["F1", "F2", "F3"], self.judge_names)
+        judge = game.contestant_judges[0].name
+        votes = [(self.judge_names[0], 1), (self.judge_names[1], 2), (judge, 2), ("Audience", 2)]
+        result = game.judge_round(game.pair_1[0], game.pair_2[0], "lead", votes)
+        self.assertEqual(result["guest_votes"], [self.judge_names[1]])
+        self.assertEqual(result["contestant_votes"], [judge, "Audience"])
+        self.assertEqual(game.current_round.lead_votes, dict(votes))
+        self.assertEqual(game.events[-1]["votes"],
+                         [[6, 1], [7, 2], [game.contestant_judges[0].id, 2], ["Audience", 2]])
+
+        events = game.events[:-1] + [dict(game.events[-1], votes=[list(vote) for vote in votes])]
+        replayed = Game.from_events(events)
+        self.assertEqual(replayed.current_round.lead_votes, dict(votes))
+        self.assertEqual(replayed.get_game_state(), game.get_game_state())
+
+    def test_seeded_games_are_reproducible(self):
+        """Test that games with the same seed and votes play out identically."""
+        names = (["L1", "L2", "L3", "L4"], ["F1", "F2", "F3", "F4", "F5"], self.judge_names)
+        first, second = Game(*names, seed=11), Game(*names, seed=11)
+        for game in (first, second):
+            play_out(game, JudgeModel(), {n: 0.0 for n in names[0] + names[1]}, random.Random(5))
+        self.assertEqual([r.contestant_judges for r in first.rounds], [r.contestant_judges for r in second.rounds])
+        self.assertEqual(first.fingerprint(), second.fingerprint())
+        self.assertNotEqual(first.fingerprint(), Game(*names, seed=12).fingerprint())
+
+        responses = [self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3,L4', 'follows': 'F1,F2,F3,F4', 'judges': 'Judge1,Judge2', 'seed': 42,
+        }).json for _ in range(2)]
+        self.assertEqual(responses[0]['seed'], 42)
+        for key in ('initial_leads', 'initial_follows', 'contestant_judges'):
+            self.assertEqual(responses[0][key], responses[1][key])
+
+    def test_scoreboard_projection(self):
+        """Test that the scoreboard is only rebuilt when points or crowns change."""
+        board = self.game.scoreboard_json()
+        self.assertIs(self.game.scoreboard_json(), board)
+        self.assertEqual([e["name"] for e in self.game.scoreboard()["leads"]], self.lead_names)
+
+        lead = self.game.pair_1[0]
+        lead.points = self.game.win_threshold - 1
+        self.simulate_round((lead, self.game.pair_2[0]), "lead", [("Judge1", 1), ("Judge2", 1)])
+        self.assertEqual(self.game.scoreboard_version, 1)
+        entry = next(e for e in self.game.scoreboard()["leads"] if e["name"] == lead.name)
+        self.assertEqual(entry, {"name": lead.name, "points": self.game.win_threshold, "is_winner": True})
+
+        self.game.next_round()
+        self.assertEqual(self.game.scoreboard_version, 1)
+
+    def test_fork(self):
+        """Test that a fork plays on independently while sharing finished history."""
+        skills = {c.name: 0.0 for c in self.game.initial_leads + self.game.initial_follows}
+        play_out(self.game, JudgeModel(), skills, random.Random(2), max_rounds=3)
+        before = (self.game.get_game_state(), [str(c) for c in self.game.initial_leads], self.game.version)
+
+        fork = self.game.fork()
+        self.assertIs(fork.rounds[0], self.game.rounds[0])
+        self.assertEqual(fork.get_game_state(), self.game.get_game_state())
+        play_out(fork, JudgeModel(), skills, random.Random(3))
+        self.assertTrue(fork.is_finished())
+        self.assertEqual((self.game.get_game_state(), [str(c) for c in self.game.initial_leads], self.game.version), before)
+
+        # Same votes on the game and a fork give the same result
+        fork = self.game.fork()
+        for game in (self.game, fork):
+            play_out(game, JudgeModel(), skills, random.Random(4))
+        self.assertEqual(fork.get_game_state(), self.game.get_game_state())
+        self.assertEqual(fork.fingerprint(), self.game.fingerprint())
+
+    def test_pairing_plan_matches_next_round(self):
+        """Test that every planned branch agrees with actually playing it out."""
+        plan = self.game.plan_pairings(depth=2)
+        self.assertEqual(len(plan), 16)
+        self.assertIs(self.game.plan_pairings(depth=2), plan)
+        for branch in plan:
+            game = Game.from_events(self.game.events)
+            for role, index in (("lead", 0), ("follow", 1)):
+                game._judge(game.pair_1[index], game.pair_2[index], role,
+                            game._outcome_votes(branch[role]))
+            game.check_for_win()
+            self.assertEqual(game.is_finished(), branch["finished"])
+            game.next_round()
+            state = game.get_game_state()
+            self.assertEqual((state["pair_1"], state["pair_2"], state["contestant_judges"]),
+                             (branch["pair_1"], branch["pair_2"], branch["contestant_judges"]))
+            self.assertTrue(branch["next"])
+
+        # Once the leads are judged only the follow outcome is left open
+        self.simulate_round((self.game.pair_1[0], self.game.pair_2[0]), "lead", [("Judge1", 1), ("Judge2", 1)])
+        self.assertEqual([set(branch) & {"lead", "follow"} for branch in self.game.plan_pairings()], [{"follow"}] * 4)
+
+    def test_on_deck_endpoint(self):
+        """Test that the on deck endpoint and judge_follows report upcoming pairs."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3,L4', 'follows': 'F1,F2,F3,F4', 'judges': 'Judge1,Judge2', 'seed': 1,
+        }).json
+        # Polling the plan mustn't save the game and wake its streams
+        wake = broadcaster.subscribe(start['session_id'])
+        response = self.client.get(f"/api/on_deck?session_id={start['session_id']}")
+        broadcaster.unsubscribe(start['session_id'], wake)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(wake.is_set())
+        self.assertEqual(len(response.json['branches']), 16)
+        for role in ('leads', 'follows'):
+            self.assertLessEqual(len(response.json['on_deck'][role]), 2)
+
+        judges = start['guest_judges'] + start['contestant_judges']
+        votes = [[judge, 1] for judge in judges]
+        self.client.post('/api/judge_leads', json={'session_id': start['session_id'], 'votes': votes})
+        judged = self.client.post('/api/judge_follows', json={'session_id': start['session_id'], 'votes': votes}).json
+        next_round = self.client.post('/api/next_round', json={'session_id': start['session_id']}).json
+        self.assertEqual(judged['next_pairs'], {'pair_1': next_round['pair_1'], 'pair_2': next_round['pair_2']})
+
+        # With the leads still to judge, the next pairs aren't known yet
+        follows_first = self.client.post('/api/judge_follows', json={
+            'session_id': start['session_id'], 'votes': votes}).json
+        self.assertIsNone(follows_first['next_pairs'])
+
+    def test_win_probabilities_endpoint(self):
+        """Test that win probabilities are computed in the background and then served."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3', 'follows': 'F1,F2,F3', 'judges': 'Judge1,Judge2', 'seed': 3,
+        }).json
+        url = f"/api/win_probabilities?session_id={start['session_id']}"
+        wake = broadcaster.subscribe(start['session_id'])
+        first = self.client.get(url)
+        broadcaster.unsubscribe(start['session_id'], wake)
+        self.assertFalse(wake.is_set())
+        if first.status_code == 202:
+            self.assertEqual(first.json['status'], 'pending')
+            projections.wait(timeout=30)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json['leads']), {'L1', 'L2', 'L3'})
+        self.assertAlmostEqual(sum(response.json['follows'].values()), 1.0)
+        self.assertEqual(self.client.get('/api/win_probabilities?session_id=game_0').status_code, 404)
+
+    def test_submit_round(self):
+        """Test that one request judges both roles, advances and returns the scores."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3,L4', 'follows': 'F1,F2,F3,F4', 'judges': 'Judge1,Judge2', 'seed': 8,
+        }).json
+        votes = [[judge, 1] for judge in start['guest_judges'] + start['contestant_judges']]
+        response = self.client.post('/api/submit_round', json={
+            'session_id': start['session_id'], 'lead_votes': votes, 'follow_votes': votes,
+            'song_info': {'title': 'Song'}, 'advance': True,
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json
+        self.assertEqual(data['lead']['winner'], start['pair_1'][0])
+        self.assertEqual(data['follow']['winner'], start['pair_1'][1])
+        self.assertEqual(data['round'], 2)
+        points = {c['name']: c['points'] for c in data['scores']['leads'] + data['scores']['follows']}
+        self.assertEqual(points[start['pair_1'][0]], 1)
+        self.assertEqual(points[start['pair_1'][1]], 1)
+        self.assertEqual(data['scores'], self.client.get(f"/api/get_scores?session_id={start['session_id']}").json)
+
+        game = games[start['session_id']]
+        self.assertEqual(game.rounds[0].song_info, {'title': 'Song'})
+        self.assertEqual(data['pair_1'], list(game.get_game_state()['pair_1']))
+
+        # Judging one role at a time leaves the round open until the follows are in
+        votes = [[judge, 2] for judge in data['contestant_judges'] + start['guest_judges']]
+        lead_only = self.client.post('/api/submit_round', json={
+            'session_id': start['session_id'], 'lead_votes': votes}).json
+        self.assertIsNone(lead_only['follow'])
+        self.assertIsNone(lead_only['next_pairs'])
+        self.assertEqual(lead_only['round'], 2)
+        follow_only = self.client.post('/api/submit_round', json={
+            'session_id': start['session_id'], 'follow_votes': votes}).json
+        self.assertIsNotNone(follow_only['next_pairs'])
+
+        # Follows judged before the leads leave the next pairs open
+        state = self.client.post('/api/next_round', json={'session_id': start['session_id']}).json
+        votes = [[judge, 1] for judge in state['contestant_judges'] + start['guest_judges']]
+        follows_first = self.client.post('/api/submit_round', json={
+            'session_id': start['session_id'], 'follow_votes': votes}).json
+        self.assertFalse(follows_first['game_finished'])
+        self.assertIsNone(follows_first['next_pairs'])
+        self.assertEqual(self.client.post('/api/submit_round', json={
+            'session_id': start['session_id']}).status_code, 400)
+
+    def test_conditional_get(self):
+        """Test that score and export reads answer 304 until the game changes."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3', 'follows': 'F1,F2,F3', 'judges': 'Judge1,Judge2', 'seed': 4,
+        }).json
+        scores_url = f"/api/get_scores?session_id={start['session_id']}"
+        export_url = f"/api/export_battle_data?session_id={start['session_id']}&format=json"
+        etags = {}
+        for url in (scores_url, export_url):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response.headers['ETag']
+            cached = self.client.get(url, headers={'If-None-Match': etags[url]})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.data, b'')
+
+        votes = [[judge, 1] for judge in start['guest_judges'] + start['contestant_judges']]
+        self.client.post('/api/submit_round', json={'session_id': start['session_id'], 'lead_votes': votes})
+        for url in (scores_url, export_url):
+            response = self.client.get(url, headers={'If-None-Match': etags[url]})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etags[url])
+
+    def test_live_stream(self):
+        """Test that the stream starts with the full state and then sends only what changed."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3', 'follows': 'F1,F2,F3', 'judges': 'Judge1,Judge2', 'seed': 6,
+        }).json
+        session_id = start['session_id']
+        response = self.client.get(f"/api/stream?session_id={session_id}")
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = (chunk.decode() for chunk in response.response)
+
+        def event_names(count):
+            return [next(chunks).split('\n')[0] for _ in range(count)]
+
+        self.assertTrue(next(chunks).startswith('retry:'))
+        self.assertEqual(event_names(4), ['event: round', 'event: result', 'event: crown', 'event: scores'])
+        self.assertEqual(broadcaster.subscriber_count(session_id), 1)
+
+        votes = [[judge, 1] for judge in start['guest_judges'] + start['contestant_judges']]
+        self.client.post('/api/submit_round', json={'session_id': session_id, 'lead_votes': votes})
+        self.assertEqual(event_names(2), ['event: result', 'event: scores'])
+
+        response.close()
+        self.assertEqual(broadcaster.subscriber_count(session_id), 0)
+        self.assertEqual(self.client.get('/api/stream?session_id=game_0').status_code, 404)
+
+    def test_live_stream_limit(self):
+        """Test that a worker turns away streams past its limit and frees closed ones."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3', 'follows': 'F1,F2,F3', 'judges': 'Judge1,Judge2', 'seed': 6,
+        }).json
+        url = f"/api/stream?session_id={start['session_id']}"
+        with mock.patch.object(broadcaster, '_max_subscribers', 1):
+            first = self.client.get(url)
+            refused = self.client.get(url)
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(refused.headers['Retry-After'], '30')
+
+            # Closed before a single event was sent
+            first.close()
+            second = self.client.get(url)
+            self.assertEqual(second.status_code, 200)
+            second.close()
+        self.assertEqual(broadcaster.subscriber_count(start['session_id']), 0)
+
+    def test_ballots(self):
+        """Test that judges' votes from their phones judge the round once everyone has voted."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3,L4', 'follows': 'F1,F2,F3,F4', 'judges': 'Judge1,Judge2', 'seed': 8,
+        }).json
+        session_id = start['session_id']
+        judges = start['guest_judges'] + start['contestant_judges']
+        opened = self.client.post('/api/ballots/open', json={'session_id': session_id, 'role': 'lead'}).json
+        self.assertEqual(opened['judges'], judges)
+        self.assertEqual(opened['state'], 'open')
+        for bad in ({'deadline': 'soon'}, {'deadline': -1}, {'quorum': 'half'}, {'quorum': 0}):
+            self.assertEqual(self.client.post('/api/ballots/open', json={
+                'session_id': session_id, 'role': 'lead', **bad}).status_code, 400)
+
+        def vote(judge, decision, **extra):
+            return self.client.post('/api/ballots/vote', json={
+                'session_id': session_id, 'role': 'lead', 'judge': judge, 'decision': decision, **extra})
+
+        self.assertEqual(vote('Nobody', 1).status_code, 400)
+        self.assertEqual(vote(start['contestant_judges'][0], 3).status_code, 400)  # Must pick a winner
+        self.assertEqual(vote(judges[0], 1, round=2).status_code, 409)
+        vote(judges[0], 2)
+        vote(judges[0], 1)  # Judges can change their vote until the ballot closes
+        for judge in judges[1:-1]:
+            self.assertEqual(vote(judge, 1).json['state'], 'open')
+        self.assertEqual(games[session_id].current_round.lead_votes, {})
+
+        closed = vote(judges[-1], 1).json
+        self.assertEqual(closed['state'], 'closed')
+        self.assertEqual(closed['result']['winner'], start['pair_1'][0])
+        self.assertEqual(games[session_id].current_round.lead_votes, {judge: 1 for judge in judges})
+        self.assertEqual(vote(judges[0], 2).status_code, 409)
+
+        # Past the deadline a quorum of votes is enough
+        self.client.post('/api/ballots/open', json={
+            'session_id': session_id, 'role': 'follow', 'deadline': 0.2, 'quorum': 2})
+        self.client.post('/api/ballots/vote', json={
+            'session_id': session_id, 'role': 'follow', 'judge': judges[0], 'decision': 2})
+        self.assertEqual(self.client.post('/api/ballots/close', json={
+            'session_id': session_id, 'role': 'follow'}).status_code, 409)
+        self.client.post('/api/ballots/vote', json={
+            'session_id': session_id, 'role': 'follow', 'judge': judges[1], 'decision': 2})
+        time.sleep(0.25)
+        status = self.client.get(f"/api/ballots/status?session_id={session_id}&role=follow").json
+        self.assertEqual(status['state'], 'closed')
+        self.assertEqual(status['result']['winner'], start['pair_2'][1])
+        self.assertEqual(games[session_id].current_round.follow_votes, {judges[0]: 2, judges[1]: 2})
+
+    def test_failed_ballot_close_can_be_retried(self):
+        """Test that a ballot whose votes fail to apply is reopened, not left closing."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3,L4', 'follows': 'F1,F2,F3,F4', 'judges': 'Judge1,Judge2', 'seed': 8,
+        }).json
+        session_id = start['session_id']
+        judges = start['guest_judges'] + start['contestant_judges']
+        self.client.post('/api/ballots/open', json={'session_id': session_id, 'role': 'lead'})
+        for judge in judges[:-1]:
+            self.client.post('/api/ballots/vote', json={
+                'session_id': session_id, 'role': 'lead', 'judge': judge, 'decision': 1})
+
+        last_vote = {'session_id': session_id, 'role': 'lead', 'judge': judges[-1], 'decision': 1}
+        with mock.patch.object(Game, 'judge_round', side_effect=IndexError('broken')), \
+                self.assertRaises(IndexError):
+            self.client.post('/api/ballots/vote', json=last_vote)
+        status = self.client.get(f"/api/ballots/status?session_id={session_id}&role=lead").json
+        self.assertEqual(status['state'], 'closed')
+        self.assertEqual(status['result']['winner'], start['pair_1'][0])
+
+    def test_ballot_votes_are_applied_once(self):
+        """Test that however many votes arrive at once, exactly one request closes the ballot."""
+        directory = tempfile.mkdtemp()
+        try:
+            box = BallotBox(os.path.join(directory, 'ballots.sqlite3'))
+            judges = [f"Judge{i}" for i in range(40)]
+            box.open('game_1', 1, 'lead', judges[:2], judges[2:], duration=60)
+            claims = []
+
+            def cast(judge):
+                votes = box.cast('game_1', 1, 'lead', judge, 1)
+                if votes is not None:
+                    claims.append(votes)
+
+            threads = [threading.Thread(target=cast, args=(judge,)) for judge in judges]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(claims), 1)
+            self.assertEqual([judge for judge, _ in claims[0]], judges)
+            self.assertEqual(box.status('game_1', 1, 'lead')['state'], 'closing')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_audience_vote(self):
+        """Test that the crowd's majority joins the judges as one Audience judge."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3', 'follows': 'F1,F2,F3', 'judges': 'Judge1,Judge2', 'seed': 3,
+        }).json
+        session_id = start['session_id']
+
+        def vote(token, decision, round_num=1):
+            return self.client.post('/api/audience/vote', json={
+                'session_id': session_id, 'round': round_num, 'role': 'lead',
+                'device_token': token, 'decision': decision})
+
+        for i in range(5):
+            self.assertTrue(vote(f"phone{i}", 2).json['counted'])
+        self.assertFalse(vote("phone0", 1).json['counted'])  # One vote per device
+        vote("phone5", 1)
+        self.assertEqual(vote("phone6", 3).status_code, 400)
+        self.assertEqual(vote("phone6", 1, round_num=2).status_code, 409)
+        self.assertEqual(self.client.post('/api/audience/vote', json={
+            'session_id': 'game_0', 'round': 1, 'role': 'lead', 'device_token': 'phone6', 'decision': 1,
+        }).status_code, 404)
+        self.assertEqual(self.client.get(
+            f"/api/audience/counts?session_id={session_id}&round=1&role=lead").json['pair_2'], 5)
+
+        # The judges split evenly, so the crowd decides
+        judges = start['guest_judges'] + start['contestant_judges']
+        votes = [[judge, 1 + i % 2] for i, judge in enumerate(judges)]
+        result = self.client.post('/api/submit_round', json={
+            'session_id': session_id, 'lead_votes': votes}).json
+        self.assertEqual(result['lead']['winner'], start['pair_2'][0])
+        self.assertEqual(games[session_id].current_round.lead_votes['Audience'], 2)
+        self.assertFalse(vote("phone7", 2).json['counted'])  # Voting closed with the judging
+
+    def test_audience_vote_survives_a_conflicting_save(self):
+        """Test that the crowd's votes still count when judging has to be retried."""
+        start = self.client.post('/api/start_game', json={
+            'leads': 'L1,L2,L3', 'follows': 'F1,F2,F3', 'judges': 'Judge1,Judge2', 'seed': 3,
+        }).json
+        session_id = start['session_id']
+        for i in range(3):
+            self.client.post('/api/audience/vote', json={
+                'session_id': session_id, 'round': 1, 'role': 'lead', 'device_token': f"phone{i}", 'decision': 2})
+
+        judges = start['guest_judges'] + start['contestant_judges']
+        request = {'session_id': session_id, 'lead_votes': [[judge, 1 + i % 2] for i, judge in enumerate(judges)]}
+        with mock.patch.object(games._backend, 'save', side_effect=GameConflictError(session_id)):
+            self.assertEqual(self.client.post('/api/submit_round', json=request).status_code, 409)
+        self.assertEqual(games[session_id].current_round.lead_votes, {})
+
+        result = self.client.post('/api/submit_round', json=request).json
+        self.assertEqual(result['lead']['winner'], start['pair_2'][0])
+        self.assertEqual(games[session_id].current_round.lead_votes['Audience'], 2)
+        # Judging the role again keeps the crowd's final count
+        self.client.post('/api/submit_round', json=request)
+        self.assertEqual(games[session_id].current_round.lead_votes['Audience'], 2)
+
+    def test_audience_tally_across_workers(self):
+        """Test that votes reaching different workers are all counted exactly once."""
+        path = os.path.join(TEST_DATA_DIR, 'audience_workers.sqlite3')
+        workers = [AudienceTally(path, shards=8, flush_interval=60), AudienceTally(path, shards=8, flush_interval=60)]
+
+        def cast(start):
+            for i in range(start, start + 500):
+                workers[i % 2].vote('game_1', 1, 'follow', f"phone{i % 1500}", 1 + i % 2)
+
+        threads = [threading.Thread(target=cast, args=(n * 500,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Devices that reached both workers count once, whichever batch is written first
+        workers[1].flush()
+        for i in range(10):
+            workers[1].vote('game_1', 1, 'follow', f"phone{2 * i}", 2)
+        self.assertEqual(workers[0].counts('game_1', 1, 'follow'), (750, 750))
+        self.assertEqual(workers[1].counts('game_1', 1, 'follow'), (750, 750))
+        self.assertIsNone(workers[1].judge_vote('game_1', 1, 'follow'))
+        self.assertFalse(workers[1].vote('game_1', 1, 'follow', 'late', 1))
+        # The other worker only learns voting has closed when it writes the vote out
+        workers[0].vote('game_1', 1, 'follow', 'late', 1)
+        self.assertEqual(workers[0].counts('game_1', 1, 'follow'), (750, 750))
+
+    def test_contestant_ids(self):
+        """Test that contestants get compact, unique integer IDs."""
+        contestants = self.game.initial_leads + self.game.initial_follows
+        self.assertEqual([c.id for c in contestants], list(range(len(contestants))))
+        self.assertFalse(hasattr(contestants[0], '__dict__'))
+        self.assertEqual([c.name for c in self.game.initial_leads], self.lead_names)
+
 class TestExportBattleData(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -635,5 +1143,405 @@ class TestExportBattleData(unittest.TestCase):
             print(f"Error in test_song_info_export: {str(e)}")
             self.fail(f"Test failed: {str(e)}")
 
+    def test_export_jobs(self):
+        """Test that Excel exports build in the background and are cached per game state."""
+        request = {'session_id': self.session_id, 'songs': {'1': {'title': 'Renamed Song'}}}
+        response = self.client.post('/api/export_jobs', json=request)
+        self.assertIn(response.status_code, (200, 202))
+        job_id = response.json['job_id']
+        export_jobs.wait(10)
+        self.assertEqual(self.client.get(f'/api/export_jobs/{job_id}').json['status'], 'ready')
+
+        again = self.client.post('/api/export_jobs', json=request)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json, {'job_id': job_id, 'status': 'ready'})
+
+        download = self.client.get(f'/api/export_jobs/{job_id}/download')
+        self.assertEqual(download.mimetype, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        round_sheet = load_workbook(io.BytesIO(download.data))["Round History"]
+        self.assertEqual(round_sheet.cell(row=2, column=6).value, 'Renamed Song')
+        self.assertEqual(round_sheet.cell(row=2, column=7).value, 'Test Artist')
+
+        # A different request, or a changed game, is a different workbook
+        plain = self.client.post('/api/export_jobs', json={'session_id': self.session_id}).json
+        self.assertNotEqual(plain['job_id'], job_id)
+        self.client.post('/api/next_round', json={'session_id': self.session_id})
+        self.assertNotEqual(self.client.post('/api/export_jobs', json=request).json['job_id'], job_id)
+        export_jobs.wait(10)
+        self.assertEqual(self.client.get('/api/export_jobs/game_0-v1-game').status_code, 404)
+
+    def test_export_jobs_across_workers(self):
+        """Test that any worker can report on, finish and serve an export job."""
+        request = {'session_id': self.session_id, 'songs': {'1': {'title': 'Renamed Song'}}}
+        job_id = self.client.post('/api/export_jobs', json=request).json['job_id']
+        export_jobs.wait(10)
+        other_worker = ExportJobs(export_jobs.path)
+        self.assertEqual(other_worker.status(job_id), 'ready')
+        self.assertEqual(other_worker.result(job_id), export_jobs.result(job_id))
+
+        # A build whose worker went away is started again from the game's history,
+        # at the version the job names, even after the game has moved on
+        self.client.post('/api/next_round', json={'session_id': self.session_id})
+        with mock.patch.object(ExportJobs, 'STALLED_AFTER', 0):
+            export_jobs._connection().execute(
+                "UPDATE export_jobs SET state = 'pending', workbook = NULL WHERE job_id = ?", (job_id,))
+            self.assertEqual(export_jobs.status(job_id), 'stalled')
+            self.assertEqual(self.client.get(f'/api/export_jobs/{job_id}').json['status'], 'pending')
+            export_jobs.wait(10)
+        download = self.client.get(f'/api/export_jobs/{job_id}/download')
+        self.assertEqual(download.status_code, 200)
+        round_sheet = load_workbook(io.BytesIO(download.data))["Round History"]
+        self.assertEqual(round_sheet.max_row, 2)
+        self.assertEqual(round_sheet.cell(row=2, column=6).value, 'Renamed Song')
+
+        # Without song details a job can be built by a worker that was never asked for it
+        plain_id = job_id.rsplit('-', 1)[0] + '-game'
+        self.assertEqual(self.client.get(f'/api/export_jobs/{plain_id}/download').status_code, 202)
+        export_jobs.wait(10)
+        self.assertEqual(self.client.get(f'/api/export_jobs/{plain_id}/download').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/export_jobs/{job_id[:-4]}beef').status_code, 404)
+
+    def test_import_exported_battle(self):
+        """Test that an exported battle file imports with its order, winners and votes."""
+        export = self.client.get(f'/api/export_battle_data?session_id={self.session_id}')
+        response = self.client.post('/api/process_uploaded_file', data={
+            'battle_file': (io.BytesIO(export.data), 'battle.xlsx')}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        data = response.json
+        self.assertEqual(data['initial_leads'], self.initial_leads)
+        self.assertEqual(data['initial_follows'], self.initial_follows)
+        self.assertEqual(data['summary']['total_rounds'], 1)
+        self.assertIsNotNone(data['summary']['date'])
+
+        game = games[self.session_id]
+        round_data = data['rounds'][0]
+        self.assertEqual(round_data['lead_winner'], game.current_round.lead_winner)
+        self.assertEqual(round_data['follow_winner'], game.current_round.follow_winner)
+        self.assertEqual(round_data['song_info']['title'], 'Test Song')
+        self.assertEqual(set(round_data['lead_votes']), {'Judge1', 'Judge2'} | set(game.current_round.contestant_judges))
+        points = {lead['name']: lead['points'] for lead in data['leads']}
+        self.assertEqual(points[game.current_round.lead_winner], 1)
+
+        bad = self.client.post('/api/process_uploaded_file', data={
+            'battle_file': (io.BytesIO(b'not a workbook'), 'battle.xlsx')}, content_type='multipart/form-data')
+        self.assertEqual(bad.status_code, 500)
+
+    def test_repeat_upload_is_cached(self):
+        """Test that uploading the same file again is answered without parsing it."""
+        export = self.client.get(f'/api/export_battle_data?session_id={self.session_id}').data
+
+        def upload():
+            return self.client.post('/api/process_uploaded_file', data={
+                'battle_file': (io.BytesIO(export), 'battle.xlsx')}, content_type='multipart/form-data')
+
+        first = upload()
+        with mock.patch('web.app.parse_battle_workbook', side_effect=AssertionError("parsed again")):
+            second = upload()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json, first.json)
+
+        # The cache on disk outlives the worker, and keeps only the newest files
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ImportCache(directory, max_entries=1, max_files=2)
+            for i in range(3):
+                cache.put(f"digest{i}", f"{{\"n\": {i}}}".encode())
+                os.utime(os.path.join(directory, f"digest{i}.json"), (i, i))
+            cache.put("digest3", b"{}")
+            self.assertEqual(sorted(os.listdir(directory)), ["digest2.json", "digest3.json"])
+            self.assertEqual(ImportCache(directory).get("digest2"), b'{"n": 2}')
+            self.assertIsNone(ImportCache(directory).get("digest0"))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_winners_share_one_style(self):
+        """Test that winning cells in a long battle are highlighted with the shared winner style."""
+        judges = [f"Judge{i}" for i in range(8)]
+        rounds = [{
+            'round_num': i,
+            'pairs': {'pair_1': {'lead': 'Lead1', 'follow': 'Follow1'},
+                      'pair_2': {'lead': 'Lead2', 'follow': 'Follow2'}},
+            'lead_votes': {judge: 1 for judge in judges},
+            'follow_votes': {judge: 2 for judge in judges},
+            'judges': judges[:2],
+            'contestant_judges': judges[2:],
+            'lead_winner': 'Lead1',
+            'follow_winner': 'Follow2',
+        } for i in range(1, 301)]
+        standings = [{'name': 'Lead1', 'points': 300, 'is_winner': True}]
+        excel_file = io.BytesIO()
+        write_battle_workbook(excel_file, 'game_1', standings, standings, rounds, ['Lead1'], ['Follow1'], 300)
+
+        wb = load_workbook(io.BytesIO(excel_file.getvalue()))
+        self.assertEqual(wb.sheetnames, ["Battle Summary", "Lead Leaderboard", "Follow Leaderboard",
+                                         "Round History", "Voting History"])
+        round_sheet = wb["Round History"]
+        self.assertEqual(round_sheet.max_row, 301)
+        last = [cell for cell in round_sheet[301]]
+        self.assertEqual([c.value for c in last[:5]], [300, 'Lead1', 'Lead2', 'Follow1', 'Follow2'])
+        self.assertEqual(last[1].style, WINNER_STYLE)
+        self.assertEqual(last[2].style, 'Normal')
+        self.assertEqual(last[4].style, WINNER_STYLE)
+        self.assertEqual(last[9].value, 'Lead1')  # Judge 1's lead vote, for the winner
+        self.assertEqual(last[9].style, WINNER_STYLE)
+        self.assertEqual(wb["Voting History"].max_row, 1 + 300 * len(judges))
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.params = {
+            "leads": 4, "follows": 5, "judges": 2, "skill_spread": 1.0, "discernment": 1.0,
+            "position_bias": 0.0, "tie_rate": 0.05, "no_contest_rate": 0.01, "max_rounds": 200,
+        }
+
+    def test_battles_run_to_completion(self):
+        """Test that simulated battles crown both roles and are all accounted for."""
+        stats = run_simulation(self.params, 40, workers=1, seed=1, chunk_size=15)
+        self.assertEqual(stats.games + stats.errors, 40)
+        self.assertEqual(stats.finished, stats.games)
+        self.assertEqual(sum(stats.crowned_round["lead"].values()), stats.games)
+        self.assertEqual(sum(stats.points["follow"].values()), stats.games * 5)
+
+    def test_simulation_is_reproducible(self):
+        """Test that the same seed gives the same results."""
+        first = run_simulation(self.params, 20, workers=1, seed=7)
+        second = run_simulation(self.params, 20, workers=1, seed=7)
+        self.assertEqual(first.rounds, second.rounds)
+        self.assertEqual(first.points, second.points)
+
+    def test_projection_from_live_state(self):
+        """Test that projecting a live battle leaves it untouched and accounts for every crown."""
+        game = Game(["L1", "L2", "L3", "L4"], ["F1", "F2", "F3", "F4"], ["Judge1", "Judge2"], seed=5)
+        skills = {c.name: 0.0 for c in game.initial_leads + game.initial_follows}
+        play_out(game, JudgeModel(), skills, random.Random(5), max_rounds=2)
+        game.judge_round(game.pair_1[0], game.pair_2[0], "lead", [("Judge1", 1), ("Judge2", 1)])
+        version = game.version
+
+        projection = project(game, simulations=200, seed=1)
+        self.assertEqual(game.version, version)
+        self.assertEqual(projection["simulations"], 200)
+        for role in ("leads", "follows"):
+            self.assertAlmostEqual(sum(projection[role].values()), 1.0)
+        self.assertGreaterEqual(projection["expected_rounds_remaining"], 0)
+        self.assertEqual(project(game, simulations=200, seed=1), projection)
+
+class TestBatchEngine(unittest.TestCase):
+    def test_cross_check_agrees_with_game(self):
+        """Test that the NumPy engine matches Game round by round on seeded votes."""
+        judge_model = BatchJudgeModel(tie_rate=0.2, no_contest_rate=0.15)
+        for n_leads, n_follows in ((3, 3), (4, 6), (7, 5)):
+            mismatches = cross_check(40, n_leads, n_follows, 2, judge_model, max_rounds=60, seed=n_leads)
+            self.assertEqual(mismatches, [], f"{n_leads} leads, {n_follows} follows: {mismatches[:3]}")
+
+    def test_numpy_engine_simulation(self):
+        """Test that the NumPy engine produces complete simulation stats."""
+        params = {
+            "leads": 5, "follows": 5, "judges": 2, "skill_spread": 1.0, "discernment": 1.0,
+            "position_bias": 0.0, "tie_rate": 0.05, "no_contest_rate": 0.01, "max_rounds": 200,
+        }
+        stats = run_simulation(params, 500, workers=1, engine="numpy")
+        self.assertEqual(stats.games + stats.errors, 500)
+        self.assertEqual(sum(stats.points["lead"].values()), stats.games * 5)
+
+class TestGameStore(unittest.TestCase):
+    def setUp(self):
+        """Create two stores over one SQLite file, like two gunicorn workers."""
+        self.temp_dir = tempfile.mkdtemp()
+        path = os.path.join(self.temp_dir, 'games.sqlite3')
+        self.worker_1 = GameStore(SQLiteBackend(path))
+        self.worker_2 = GameStore(SQLiteBackend(path))
+        self.game = Game(["Lead1", "Lead2", "Lead3"], ["Follow1", "Follow2", "Follow3"], ["Judge1", "Judge2"])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_game_visible_to_other_worker(self):
+        """Test that a game saved by one worker can be loaded by another."""
+        self.worker_1['game_1'] = self.game
+        self.assertIn('game_1', self.worker_2)
+        loaded = self.worker_2['game_1']
+        self.assertEqual(loaded.get_game_state(), self.game.get_game_state())
+
+    def test_stale_cache_is_reloaded(self):
+        """Test that a worker reloads a game another worker has updated."""
+        self.worker_1['game_1'] = self.game
+        self.worker_2['game_1']  # Warm the second worker's cache
+
+        game = self.worker_1['game_1']
+        game.judge_round(game.pair_1[0], game.pair_2[0], "lead", [("Judge1", 1), ("Judge2", 1)])
+        self.worker_1['game_1'] = game
+
+        reloaded = self.worker_2['game_1']
+        self.assertEqual(reloaded.pair_1[0].points, 1)
+
+    def test_idle_games_are_evicted_and_rehydrated(self):
+        """Test that idle games leave the cache but can still be loaded."""
+        store = GameStore(SQLiteBackend(os.path.join(self.temp_dir, 'ttl.sqlite3')), ttl=0)
+        store['game_1'] = self.game
+        self.assertEqual(store.evict_idle(), 0)
+        self.assertEqual(store['game_1'].get_game_state(), self.game.get_game_state())
+
+    def test_finished_games_are_not_cached(self):
+        """Test that finished games are spilled to the backend only."""
+        skills = {c.name: 0.0 for c in self.game.initial_leads + self.game.initial_follows}
+        play_out(self.game, JudgeModel(tie_rate=0, no_contest_rate=0), skills, random.Random(0))
+        self.worker_1['game_1'] = self.game
+        self.assertEqual(self.worker_1.evict_idle(), 0)
+        self.assertTrue(self.worker_1['game_1'].is_finished())
+
+    def test_long_games_are_snapshotted_on_save(self):
+        """Test that saving a long game stores a snapshot the other worker loads from."""
+        skills = {c.name: 0.0 for c in self.game.initial_leads + self.game.initial_follows}
+        play_out(self.game, JudgeModel(tie_rate=0, no_contest_rate=0), skills, random.Random(0))
+        with mock.patch.object(SQLiteBackend, 'SNAPSHOT_EVENTS', 10):
+            self.worker_1['game_1'] = self.game
+        self.assertEqual(self.game.snapshot[0], self.game.version)
+
+        loaded = self.worker_2['game_1']
+        self.assertEqual(loaded.snapshot, self.game.snapshot)
+        self.assertEqual(loaded.get_game_state(), self.game.get_game_state())
+
+    def test_session_ids_are_unique_across_workers(self):
+        """Test that workers sharing a backend never hand out the same session ID."""
+        ids = [self.worker_1.allocate_id() for _ in range(3)] + [self.worker_2.allocate_id() for _ in range(3)]
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_stale_session_update_is_rejected(self):
+        """Test that an update based on an outdated copy of a game raises a conflict."""
+        self.worker_1['game_1'] = self.game
+        with self.assertRaises(GameConflictError):
+            with self.worker_1.session('game_1') as game:
+                # Another worker updates the game while this update is in progress
+                other = self.worker_2['game_1']
+                other.judge_round(other.pair_1[0], other.pair_2[0], "lead", [("Judge1", 1), ("Judge2", 1)])
+                self.worker_2['game_1'] = other
+                game.judge_round(game.pair_1[0], game.pair_2[0], "lead", [("Judge1", 2), ("Judge2", 2)])
+        reloaded = self.worker_1['game_1']
+        self.assertEqual((reloaded.pair_1[0].points, reloaded.pair_2[0].points), (1, 0))
+
+    def test_missing_game(self):
+        """Test that unknown session IDs behave like a missing dict key."""
+        self.assertNotIn('game_42', self.worker_1)
+        self.assertIsNone(self.worker_1.get('game_42'))
+        with self.assertRaises(KeyError):
+            self.worker_1['game_42']
+
+class TestSpotify(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.backend = StubTokenBackend(expires_in=3600)
+        self.tokens = TokenManager(self.backend, refresh_margin=60, clock=lambda: self.now)
+
+    def test_token_is_cached_until_it_expires(self):
+        """Test that the token is reused until shortly before it expires."""
+        first = self.tokens.token()
+        self.now = 3000
+        self.assertEqual(self.tokens.token()['access_token'], first['access_token'])
+        self.assertEqual(self.tokens.token()['expires_in'], 600)
+        self.now = 3541
+        self.assertNotEqual(self.tokens.token()['access_token'], first['access_token'])
+        self.assertEqual(self.backend.fetches, 2)
+
+    def test_concurrent_refresh_is_single_flight(self):
+        """Test that many requests asking at once cause a single fetch."""
+        self.backend.latency = 0.05
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(self.tokens.token()['access_token']))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(set(tokens), {'stub-token-1'})
+        self.assertEqual(self.backend.fetches, 1)
+
+    def test_stale_token_is_replaced_once(self):
+        """Test that reporting a rejected token replaces it only if it is still current."""
+        stale = self.tokens.token()['access_token']
+        fresh = self.tokens.token(stale=stale)['access_token']
+        self.assertNotEqual(fresh, stale)
+        self.assertEqual(self.tokens.token(stale=stale)['access_token'], fresh)
+        self.assertEqual(self.backend.fetches, 2)
+
+    def test_token_endpoint(self):
+        """Test that the endpoint serves the shared token and reports missing credentials."""
+        client = app.test_client()
+        with mock.patch.object(spotify_tokens, 'backend', HTTPTokenBackend(None, None)), \
+                mock.patch.object(spotify_tokens, '_token', None):
+            response = client.get('/api/get_spotify_token')
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(response.json['error'], 'Spotify credentials not configured')
+        with mock.patch.object(spotify_tokens, 'backend', self.backend), \
+                mock.patch.object(spotify_tokens, '_token', None):
+            first = client.get('/api/get_spotify_token').json
+            self.assertEqual(first['token_type'], 'Bearer')
+            self.assertEqual(client.get('/api/get_spotify_token').json['access_token'], first['access_token'])
+
+    def test_tracks_are_looked_up_in_batches(self):
+        """Test that unknown tracks are fetched 50 at a time and then served from the cache."""
+        upstream = FakeTracksBackend()
+        cache = TrackCache(upstream, clock=lambda: self.now)
+        ids = [f"track{i}" for i in range(120)]
+        found = cache.lookup(ids + ["track0"])
+        self.assertEqual(len(found), 120)
+        self.assertEqual(found["track7"], {'title': 'Track track7', 'artist': 'Artist'})
+        self.assertEqual([len(batch) for batch in upstream.requests], [50, 50, 20])
+
+        found = cache.lookup(["track3", "track200", "not/an/id"])
+        self.assertIsNone(found["not/an/id"])
+        self.assertEqual(upstream.requests[-1], ["track200"])
+        self.assertEqual(len(upstream.requests), 4)
+
+    def test_track_cache_expires_and_evicts(self):
+        """Test that cached tracks, known or not, expire and the least recently used are evicted."""
+        upstream = FakeTracksBackend(tracks={
+            'a': {'name': 'Song A', 'artists': [{'name': 'One'}, {'name': 'Two'}]},
+            'b': {'name': 'Song B', 'artists': [{'name': 'Three'}]},
+        })
+        cache = TrackCache(upstream, max_entries=2, ttl=100, clock=lambda: self.now)
+        self.assertEqual(cache.lookup(['a', 'missing']),
+                         {'a': {'title': 'Song A', 'artist': 'One, Two'}, 'missing': None})
+        cache.lookup(['a', 'missing'])
+        self.assertEqual(len(upstream.requests), 1)
+
+        cache.lookup(['a'])
+        cache.lookup(['b'])  # Evicts 'missing', the least recently used
+        cache.lookup(['a', 'missing'])
+        self.assertEqual(upstream.requests[-1], ['missing'])
+
+        self.now = 101
+        cache.lookup(['a'])
+        self.assertEqual(upstream.requests[-1], ['a'])
+
+    def test_tracks_backend_retries_with_a_new_token(self):
+        """Test that a rejected token is replaced once and the batch retried."""
+        responses = [
+            mock.Mock(status_code=401),
+            mock.Mock(status_code=200, json=lambda: {'tracks': [
+                {'name': 'Song A', 'artists': [{'name': 'One'}]}, None]}),
+        ]
+        session = mock.Mock()
+        session.get.side_effect = responses
+        backend = HTTPTracksBackend(self.tokens, session=session)
+        self.assertEqual(backend.fetch_tracks(['a', 'b']),
+                         {'a': {'title': 'Song A', 'artist': 'One'}, 'b': None})
+        self.assertEqual(session.get.call_args_list[0].kwargs['params'], {'ids': 'a,b'})
+        self.assertEqual(session.get.call_args.kwargs['headers']['Authorization'], 'Bearer stub-token-2')
+        self.assertEqual(self.backend.fetches, 2)
+
+    def test_tracks_endpoint(self):
+        """Test that the endpoint resolves a song list in one response."""
+        client = app.test_client()
+        upstream = FakeTracksBackend()
+        with mock.patch.object(tracks, 'backend', upstream):
+            tracks.clear()
+            response = client.post('/api/tracks', json={'ids': ['x1', 'x2', 'x1']})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.json['tracks']), {'x1', 'x2'})
+            self.assertEqual(client.get('/api/tracks?ids=x2,x3').json['tracks']['x3']['title'], 'Track x3')
+            self.assertEqual(upstream.requests, [['x1', 'x2'], ['x3']])
+            self.assertEqual(client.post('/api/tracks', json={}).status_code, 400)
+            self.assertEqual(client.get('/api/tracks').status_code, 400)
+            tracks.clear()
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -1,14 +1,9 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import sys
 import os
 import pandas as pd
 import io
-import datetime
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from werkzeug.utils import secure_filename
 import random
-import requests
 from flask_cors import CORS
 from dotenv import load_dotenv
 import uuid
@@ -21,7 +16,15 @@ load_dotenv()
 # Add parent directory to path to import game_logic
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from game_logic import Game, Contestant
+from web.audience import AudienceTally
+from web.ballots import BallotBox, BallotError
 from web.config import get_config
+from web.exports import ExportJobs, battle_export, export_job_id, parse_export_job_id
+from web.game_store import GameConflictError, create_game_store
+from web.imports import ImportCache, content_hash, parse_battle_workbook
+from web.live import Broadcaster, format_event, game_updates
+from web.projections import ProjectionCache
+from web.spotify import SpotifyError, create_token_manager, create_track_cache
 
 # Get configuration based on environment
 config = get_config()
@@ -32,7 +35,29 @@ app = Flask(__name__,
             template_folder='.')  # Set template folder to current directory
 app.config.from_object(config)
 CORS(app)
-games = {}  # Store active games by session ID
+games = create_game_store(config)  # Active games by session ID, shared across workers
+projections = ProjectionCache(simulations=config.WIN_PROBABILITY_SIMULATIONS)
+broadcaster = Broadcaster(max_subscribers=config.STREAM_LIMIT)  # Live streams, a few per worker
+ballots = BallotBox(config.BALLOT_STORE_PATH)  # Votes cast from judges' phones
+audience = AudienceTally(config.AUDIENCE_STORE_PATH, shards=config.AUDIENCE_SHARDS,
+                         flush_interval=config.AUDIENCE_FLUSH_INTERVAL)  # The crowd's votes
+export_jobs = ExportJobs(config.EXPORT_STORE_PATH, workers=config.EXPORT_WORKERS,
+                         max_entries=config.EXPORT_CACHE_SIZE)  # Workbooks shared by all workers
+imports = ImportCache(config.IMPORT_CACHE_DIR, max_entries=config.IMPORT_CACHE_SIZE,
+                      max_files=config.IMPORT_CACHE_FILES)  # Parsed uploads by content hash
+spotify_tokens = create_token_manager(config)  # One Spotify token shared by every request
+tracks = create_track_cache(config, spotify_tokens)  # Song titles and artists by Spotify track ID
+games.on_save(broadcaster.publish)  # Every change wakes the streams watching that game
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+@app.errorhandler(GameConflictError)
+def handle_game_conflict(error):
+    return jsonify({'error': 'Game was updated by another request, please retry'}), 409
+
+@app.errorhandler(BallotError)
+def handle_ballot_error(error):
+    return jsonify({'error': str(error)}), 409
 
 @app.route('/')
 def index():
@@ -50,20 +75,24 @@ def start_game():
     follow_names = [name.strip() for name in follow_names if name.strip()]
     judge_names = [name.strip() for name in judge_names if name.strip()]
     
-    # Randomize the order of leads and follows
-    random.shuffle(lead_names)
-    random.shuffle(follow_names)
+    # An optional seed makes the battle reproducible
+    seed = data.get('seed')
+    if seed is None:
+        seed = random.getrandbits(32)
+    elif not isinstance(seed, int) or isinstance(seed, bool):
+        return jsonify({'error': 'seed must be an integer'}), 400
+    
+    # Randomize the order of leads and follows. The game draws contestant
+    # judges from Random(seed), so the order gets a stream of its own
+    rng = random.Random(f"order-{seed}")
+    rng.shuffle(lead_names)
+    rng.shuffle(follow_names)
     
     # Create a new game with the randomized order
-    session_id = f"game_{len(games) + 1}"
-    game = Game(lead_names, follow_names, judge_names)
-    game.session_id = session_id  # Set the session ID on the game object
+    session_id = games.allocate_id()
+    game = Game(lead_names, follow_names, judge_names, session_id, seed)
     games[session_id] = game
     
-    # Set session ID for the first round
-    if game.current_round:
-        game.current_round.session_id = session_id
-    
     # Get initial game state
     state = game.get_game_state()
     
@@ -75,94 +104,104 @@ def start_game():
         'contestant_judges': state['contestant_judges'],
         'guest_judges': game.guest_judges,
         'initial_leads': lead_names,  # Now contains the randomized order
-        'initial_follows': follow_names  # Now contains the randomized order
+        'initial_follows': follow_names,  # Now contains the randomized order
+        'seed': seed
     })
 
+def conditional(etag, build_response):
+    """Answer 304 if the client already has ``etag``, else build and tag the response.
+
+    ``no-cache`` makes browsers revalidate every time, so polling clients
+    only download anything when the game has changed.
+    """
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = build_response()
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/api/get_scores', methods=['GET'])
 def get_scores():
     session_id = request.args.get('session_id')
     
+    with games.read(session_id) as game:
+        if game is None:
+            return jsonify({'error': 'Game not found'}), 404
+        
+        # The game keeps its scoreboard serialized, so serving it is just a
+        # copy; read with its version so the ETag always names this body
+        etag = f"{session_id}-{game.seed}-scores-{game.scoreboard_version}"
+        body = game.scoreboard_json()
+    
+    return conditional(etag, lambda: app.response_class(body, mimetype='application/json'))
+
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events carrying the live state of a battle.
+
+    Sends round, result, crown and scores events whenever that part of the
+    game changes, starting with the full state, and an end event once the
+    battle is finished. Past ``STREAM_LIMIT`` open streams the worker
+    answers 503 and screens fall back to polling the scores.
+    """
+    session_id = request.args.get('session_id')
     if session_id not in games:
         return jsonify({'error': 'Game not found'}), 404
     
-    game = games[session_id]
-    
-    # Create dictionaries to track unique contestants by name
-    lead_dict = {}
-    follow_dict = {}
-    
-    # Helper function to determine if a contestant has earned a crown
-    def has_earned_crown(contestant, role):
-        if role == "lead":
-            # A lead earns a crown if they have reached the winning threshold
-            return contestant.points >= game.total_num_leads - 1 and game.has_winning_lead
-        else:  # role == "follow"
-            # A follow earns a crown if they have reached the winning threshold
-            return contestant.points >= game.total_num_follows - 1 and game.has_winning_follow
-    
-    # Add current pair contestants
-    lead_dict[game.pair_1[0].name] = {
-        'name': game.pair_1[0].name, 
-        'points': game.pair_1[0].points,
-        'is_winner': has_earned_crown(game.pair_1[0], "lead")
-    }
-    
-    lead_dict[game.pair_2[0].name] = {
-        'name': game.pair_2[0].name, 
-        'points': game.pair_2[0].points,
-        'is_winner': has_earned_crown(game.pair_2[0], "lead")
-    }
-    
-    follow_dict[game.pair_1[1].name] = {
-        'name': game.pair_1[1].name, 
-        'points': game.pair_1[1].points,
-        'is_winner': has_earned_crown(game.pair_1[1], "follow")
-    }
-    
-    follow_dict[game.pair_2[1].name] = {
-        'name': game.pair_2[1].name, 
-        'points': game.pair_2[1].points,
-        'is_winner': has_earned_crown(game.pair_2[1], "follow")
-    }
-    
-    # Add contestants from the queue (only if not already added)
-    for lead in game.leads:
-        lead_dict[lead.name] = {
-            'name': lead.name, 
-            'points': lead.points,
-            'is_winner': has_earned_crown(lead, "lead")
-        }
-    
-    for follow in game.follows:
-        follow_dict[follow.name] = {
-            'name': follow.name, 
-            'points': follow.points,
-            'is_winner': has_earned_crown(follow, "follow")
-        }
-    
-    # Check if we have winning lead/follow and add them if they exist and aren't already included
-    if hasattr(game, 'winning_lead') and game.winning_lead:
-        lead_dict[game.winning_lead.name] = {
-            'name': game.winning_lead.name, 
-            'points': game.winning_lead.points,
-            'is_winner': has_earned_crown(game.winning_lead, "lead")
-        }
-    
-    if hasattr(game, 'winning_follow') and game.winning_follow:
-        follow_dict[game.winning_follow.name] = {
-            'name': game.winning_follow.name, 
-            'points': game.winning_follow.points,
-            'is_winner': has_earned_crown(game.winning_follow, "follow")
-        }
-    
-    # Convert dictionaries to lists for the response
-    lead_list = list(lead_dict.values())
-    follow_list = list(follow_dict.values())
-    
-    return jsonify({
-        'leads': lead_list,
-        'follows': follow_list
-    })
+    poll_interval = app.config['STREAM_POLL_INTERVAL']
+    keepalive = app.config['STREAM_KEEPALIVE']
+    
+    wake = broadcaster.subscribe(session_id)
+    if wake is None:
+        # Every stream holds a thread; keep the rest for the judges' requests
+        return jsonify({'error': 'Too many live screens, poll /api/get_scores instead'}), 503, {'Retry-After': '30'}
+    
+    def events():
+        sent = {}
+        version = None
+        quiet = 0.0
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                # Checking the stored version also picks up saves from other workers
+                stored = games.version(session_id)
+                if stored is None:
+                    yield format_event('end', {'reason': 'not_found'})
+                    return
+                if stored != version:
+                    with games.read(session_id) as game:
+                        updates = list(game_updates(game, sent)) if game else []
+                        finished = game is not None and game.is_finished()
+                    version = stored
+                    for name, data in updates:
+                        yield format_event(name, data, version)
+                    if finished:
+                        yield format_event('end', {'reason': 'finished'})
+                        return
+                    quiet = 0.0
+                
+                if wake.wait(poll_interval):
+                    wake.clear()
+                else:
+                    quiet += poll_interval
+                    if quiet >= keepalive:
+                        yield ": keepalive\n\n"
+                        quiet = 0.0
+        finally:
+            broadcaster.unsubscribe(session_id, wake)
+    
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also give the slot back if the client goes before the stream starts
+    response.call_on_close(lambda: broadcaster.unsubscribe(session_id, wake))
+    return response
+
+def with_audience(session_id, game, role, votes):
+    """The judges' votes plus the crowd's, if it voted; closes audience voting for the role."""
+    audience_vote = audience.judge_vote(session_id, game.round_num, role)
+    return list(votes) + [audience_vote] if audience_vote else votes
 
 @app.route('/api/judge_leads', methods=['POST'])
 def judge_leads():
@@ -174,16 +213,17 @@ def judge_leads():
     if not session_id or not votes:
         return jsonify({'error': 'Missing session_id or votes'}), 400
     
-    game = games.get(session_id)
-    if not game:
-        return jsonify({'error': 'Invalid session ID'}), 400
-    
-    # Store song info in the current round
-    if song_info:
-        game.current_round.song_info = song_info
-    
-    # Process votes and determine winner
-    result = game.judge_round(game.pair_1[0], game.pair_2[0], "lead", votes)
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Invalid session ID'}), 400
+        
+        # Store song info in the current round
+        if song_info:
+            game.set_song_info(song_info)
+        
+        # Process votes and determine winner
+        votes = with_audience(session_id, game, "lead", votes)
+        result = game.judge_round(game.pair_1[0], game.pair_2[0], "lead", votes)
     
     return jsonify({
         'winner': result['winner'],
@@ -201,39 +241,319 @@ def judge_follows():
     if not session_id or not votes:
         return jsonify({'error': 'Missing session_id or votes'}), 400
     
-    game = games.get(session_id)
-    if not game:
-        return jsonify({'error': 'Invalid session ID'}), 400
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Invalid session ID'}), 400
+        
+        # Update song info in the current round if not already set
+        if song_info and not hasattr(game.current_round, 'song_info'):
+            game.set_song_info(song_info)
+        
+        # Process votes and determine winner
+        votes = with_audience(session_id, game, "follow", votes)
+        result = game.judge_round(game.pair_1[1], game.pair_2[1], "follow", votes)
+        
+        # Check for win condition
+        win_messages = game.check_for_win() or []
+        
+        # Once both roles are judged the plan has a single branch: the next
+        # round. With the leads still to judge it's only one possibility
+        plan = game.plan_pairings()
+        next_pairs = None
+        if len(plan) == 1 and not plan[0]['finished']:
+            next_pairs = {'pair_1': plan[0]['pair_1'], 'pair_2': plan[0]['pair_2']}
+        
+        response = {
+            'winner': result['winner'],
+            'guest_votes': result['guest_votes'],
+            'contestant_votes': result['contestant_votes'],
+            'win_messages': win_messages,
+            'game_finished': game.is_finished(),
+            'next_pairs': next_pairs
+        }
     
-    # Update song info in the current round if not already set
-    if song_info and not hasattr(game.current_round, 'song_info'):
-        game.current_round.song_info = song_info
+    return jsonify(response)
+
+@app.route('/api/on_deck', methods=['GET'])
+def on_deck():
+    """Upcoming pairings for every outcome of the rounds still to be judged."""
+    session_id = request.args.get('session_id')
+    depth = max(1, min(request.args.get('depth', 1, type=int), 2))
+    
+    # Planning plays out forks, so the game itself only needs locking, not saving
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        branches = game.plan_pairings(depth)
+        round_num = game.round_num
+    
+    # Dancers who will be on the floor next round whatever the outcome
+    upcoming = [b for b in branches if not b['finished']]
+    certain = {'leads': [], 'follows': []}
+    if upcoming:
+        for role, index in (('leads', 0), ('follows', 1)):
+            dancing = [{b['pair_1'][index], b['pair_2'][index]} for b in upcoming]
+            certain[role] = sorted(set.intersection(*dancing))
     
-    # Process votes and determine winner
-    result = game.judge_round(game.pair_1[1], game.pair_2[1], "follow", votes)
+    return jsonify({
+        'round': round_num,
+        'on_deck': certain,
+        'branches': branches
+    })
+
+@app.route('/api/win_probabilities', methods=['GET'])
+def win_probabilities():
+    """Each contestant's chance of the crown, projected from the live battle."""
+    session_id = request.args.get('session_id')
+    
+    # Projections run on a fork, so the game itself only needs locking, not saving
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        round_num, version = game.round_num, game.version
+        # Seeding by state makes the projection for a given state reproducible
+        projection = projections.get((session_id, round_num, version), game.fork,
+                                     seed=game.seed + version)
+    
+    if projection is None:
+        # Being computed in the background; poll again shortly
+        return jsonify({'status': 'pending', 'round': round_num, 'version': version}), 202
+    
+    return jsonify({'status': 'ready', 'round': round_num, 'version': version, **projection})
+
+@app.route('/api/submit_round', methods=['POST'])
+def submit_round():
+    """Judge a round in one request: lead votes, follow votes and optionally advance.
+
+    Either set of votes may be left out to judge one role at a time. All
+    changes are applied under one session lock and saved together, and the
+    response carries everything the round screen needs, scores included.
+    """
+    data = request.get_json()
+    session_id = data.get('session_id')
+    lead_votes = data.get('lead_votes')
+    follow_votes = data.get('follow_votes')
+    song_info = data.get('song_info', {})
+    advance = bool(data.get('advance', False))
     
-    # Check for win condition
-    win_messages = game.check_for_win() or []
+    if not session_id or not (lead_votes or follow_votes):
+        return jsonify({'error': 'Missing session_id or votes'}), 400
+    
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Invalid session ID'}), 400
+        
+        if song_info:
+            game.set_song_info(song_info)
+        
+        lead_result = follow_result = next_pairs = None
+        win_messages = []
+        if lead_votes:
+            lead_votes = with_audience(session_id, game, "lead", lead_votes)
+            lead_result = game.judge_round(game.pair_1[0], game.pair_2[0], "lead", lead_votes)
+        if follow_votes:
+            follow_votes = with_audience(session_id, game, "follow", follow_votes)
+            follow_result = game.judge_round(game.pair_1[1], game.pair_2[1], "follow", follow_votes)
+            win_messages = game.check_for_win() or []
+        
+        finished = game.is_finished()
+        if follow_votes and not finished:
+            if advance:
+                game.next_round()
+            else:
+                # Only certain once the leads are judged too
+                plan = game.plan_pairings()
+                if len(plan) == 1 and not plan[0]['finished']:
+                    next_pairs = {'pair_1': plan[0]['pair_1'], 'pair_2': plan[0]['pair_2']}
+        
+        state = game.get_game_state()
+        scores = game.scoreboard()
     
     return jsonify({
-        'winner': result['winner'],
-        'guest_votes': result['guest_votes'],
-        'contestant_votes': result['contestant_votes'],
+        'lead': lead_result,
+        'follow': follow_result,
         'win_messages': win_messages,
-        'game_finished': game.is_finished()
+        'game_finished': finished,
+        'next_pairs': next_pairs,
+        'round': state['round'],
+        'pair_1': state['pair_1'],
+        'pair_2': state['pair_2'],
+        'contestant_judges': state['contestant_judges'],
+        'scores': scores
     })
 
+def apply_ballot(session_id, round_num, role, votes):
+    """Judge a role with the votes of a closed ballot and record the result on it."""
+    try:
+        with games.session(session_id) as game:
+            if not game or game.round_num != round_num:
+                raise BallotError(f"Round {round_num} is no longer being judged")
+            index = 0 if role == "lead" else 1
+            votes = with_audience(session_id, game, role, votes)
+            result = game.judge_round(game.pair_1[index], game.pair_2[index], role, votes)
+            if role == "follow":
+                result['win_messages'] = game.check_for_win() or []
+                result['game_finished'] = game.is_finished()
+    except BallotError as error:
+        ballots.finish(session_id, round_num, role, {'error': str(error)})
+        raise
+    except Exception:
+        # A conflict or any other failure: leave the ballot to be closed again
+        # by the next vote or status check rather than stuck mid-close
+        ballots.release(session_id, round_num, role)
+        raise
+    ballots.finish(session_id, round_num, role, result)
+    return result
+
+@app.route('/api/ballots/open', methods=['POST'])
+def open_ballot():
+    """Start collecting one role's votes for the current round from the judges' phones."""
+    data = request.get_json()
+    session_id = data.get('session_id')
+    role = data.get('role')
+    if role not in ("lead", "follow"):
+        return jsonify({'error': 'Missing session_id or role'}), 400
+    duration = data.get('deadline', config.BALLOT_DEADLINE)
+    if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not 0 < duration < 86400:
+        return jsonify({'error': 'deadline must be a number of seconds, up to a day'}), 400
+    quorum = data.get('quorum')
+    if quorum is not None and (isinstance(quorum, bool) or not isinstance(quorum, int) or quorum < 1):
+        return jsonify({'error': 'quorum must be a positive integer'}), 400
+    
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Invalid session ID'}), 400
+        round_num = game.round_num
+        guests = list(game.guest_judges)
+        contestants = [judge.name for judge in game.contestant_judges]
+    
+    status = ballots.open(session_id, round_num, role, guests, contestants, duration, quorum)
+    return jsonify(status)
+
+@app.route('/api/ballots/vote', methods=['POST'])
+def cast_ballot():
+    """One judge's vote; the vote that completes the ballot judges the round."""
+    data = request.get_json()
+    session_id = data.get('session_id')
+    role = data.get('role')
+    judge = data.get('judge')
+    decision = data.get('decision')
+    if role not in ("lead", "follow") or not judge or decision is None:
+        return jsonify({'error': 'Missing session_id, role, judge or decision'}), 400
+    
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Invalid session ID'}), 400
+        round_num = game.round_num
+    # A phone still showing the last round mustn't vote in this one
+    if data.get('round', round_num) != round_num:
+        return jsonify({'error': f'Round {data["round"]} is no longer being judged'}), 409
+    
+    try:
+        votes = ballots.cast(session_id, round_num, role, judge, decision)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    if votes is not None:
+        apply_ballot(session_id, round_num, role, votes)
+    return jsonify(ballots.status(session_id, round_num, role))
+
+@app.route('/api/ballots/status', methods=['GET'])
+def ballot_status():
+    """Who has voted so far, and the result once the ballot has closed.
+
+    Closes the ballot if its deadline has passed, so polling screens are what
+    move a ballot on when the last judges never vote.
+    """
+    session_id = request.args.get('session_id')
+    role = request.args.get('role')
+    
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        round_num = request.args.get('round', game.round_num, type=int)
+    
+    votes = ballots.close_if_due(session_id, round_num, role)
+    if votes is not None:
+        apply_ballot(session_id, round_num, role, votes)
+    status = ballots.status(session_id, round_num, role)
+    if status is None:
+        return jsonify({'error': 'No ballot open for this round'}), 404
+    return jsonify(status)
+
+@app.route('/api/ballots/close', methods=['POST'])
+def close_ballot():
+    """Close a ballot early with the votes cast so far, if they make a quorum."""
+    data = request.get_json()
+    session_id = data.get('session_id')
+    role = data.get('role')
+    
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Invalid session ID'}), 400
+        round_num = game.round_num
+    
+    votes = ballots.close_if_due(session_id, round_num, role, force=True)
+    if votes is not None:
+        apply_ballot(session_id, round_num, role, votes)
+    status = ballots.status(session_id, round_num, role)
+    if status is None:
+        return jsonify({'error': 'No ballot open for this round'}), 404
+    return jsonify(status)
+
+@app.route('/api/audience/vote', methods=['POST'])
+def audience_vote():
+    """One vote from the crowd: pair 1 or pair 2, once per device per role per round.
+
+    Only the game's round is looked up; the vote is counted in memory and
+    written to a file of its own in batches, so a burst of the crowd's votes
+    doesn't hold up the judges.
+    """
+    data = request.get_json()
+    session_id = data.get('session_id')
+    round_num = data.get('round')
+    role = data.get('role')
+    device_token = data.get('device_token')
+    decision = data.get('decision')
+    if (not session_id or not isinstance(round_num, int) or role not in ("lead", "follow")
+            or not device_token):
+        return jsonify({'error': 'Missing session_id, round, role or device_token'}), 400
+    
+    with games.read(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        current_round = game.round_num
+    # A phone still showing the last round mustn't vote in this one
+    if round_num != current_round:
+        return jsonify({'error': f'Round {round_num} is no longer being judged'}), 409
+    
+    try:
+        counted = audience.vote(session_id, round_num, role, device_token, decision)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    return jsonify({'counted': counted})
+
+@app.route('/api/audience/counts', methods=['GET'])
+def audience_counts():
+    """The crowd's votes so far for one role of a round."""
+    session_id = request.args.get('session_id')
+    round_num = request.args.get('round', type=int)
+    role = request.args.get('role')
+    if not session_id or round_num is None or role not in ("lead", "follow"):
+        return jsonify({'error': 'Missing session_id, round or role'}), 400
+    
+    pair_1, pair_2 = audience.counts(session_id, round_num, role)
+    return jsonify({'round': round_num, 'role': role, 'pair_1': pair_1, 'pair_2': pair_2})
+
 @app.route('/api/next_round', methods=['POST'])
 def next_round():
     data = request.json
     session_id = data.get('session_id')
     
-    if session_id not in games:
-        return jsonify({'error': 'Game not found'}), 404
-    
-    game = games[session_id]
-    game.next_round()
-    state = game.get_game_state()
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        game.next_round()
+        state = game.get_game_state()
     
     return jsonify({
         'round': state['round'],
@@ -247,95 +567,93 @@ def end_game():
     data = request.json
     session_id = data.get('session_id')
     
-    if session_id not in games:
-        return jsonify({'error': 'Game not found'}), 404
-    
-    game = games[session_id]
-    leads, follows = game.finalize_results()
-    
-    # Format the results - include all leads
-    lead_results = []
-    # Get all leads from initial order to ensure we include everyone
-    all_leads = [lead.name for lead in game.initial_leads]
-    # Create a dictionary of lead points for easy lookup
-    lead_points = {lead.name: lead.points for lead in leads}
-    
-    # Sort leads by points (descending) and then by name (ascending) for consistent ordering
-    sorted_leads = sorted(all_leads, key=lambda x: (-lead_points.get(x, 0), x))
-    
-    for idx, lead_name in enumerate(sorted_leads):
-        points = lead_points.get(lead_name, 0)
-        medal = ["🥇", "🥈", "🥉"][idx] if idx < 3 else ""
-        is_winner = hasattr(game, 'last_lead_winner') and game.last_lead_winner == lead_name
-        lead_results.append({
-            'name': lead_name,
-            'points': points,
-            'medal': medal,
-            'is_winner': is_winner
-        })
-    
-    # Format the results - include all follows
-    follow_results = []
-    # Get all follows from initial order to ensure we include everyone
-    all_follows = [follow.name for follow in game.initial_follows]
-    # Create a dictionary of follow points for easy lookup
-    follow_points = {follow.name: follow.points for follow in follows}
-    
-    # Sort follows by points (descending) and then by name (ascending) for consistent ordering
-    sorted_follows = sorted(all_follows, key=lambda x: (-follow_points.get(x, 0), x))
-    
-    for idx, follow_name in enumerate(sorted_follows):
-        points = follow_points.get(follow_name, 0)
-        medal = ["🥇", "🥈", "🥉"][idx] if idx < 3 else ""
-        is_winner = hasattr(game, 'last_follow_winner') and game.last_follow_winner == follow_name
-        follow_results.append({
-            'name': follow_name,
-            'points': points,
-            'medal': medal,
-            'is_winner': is_winner
-        })
-    
-    # Collect round metadata
-    rounds_data = []
-    
-    # Add all completed rounds that belong to this session
-    for r in game.rounds:
-        if hasattr(r, 'session_id') and r.session_id == session_id:
-            round_data = {
-                'round_num': r.round_num,
-                'session_id': session_id,
-                'pairs': r.pairs,
-                'lead_votes': r.lead_votes,
-                'follow_votes': r.follow_votes,
-                'judges': r.judges,
-                'contestant_judges': r.contestant_judges,
-                'win_messages': r.win_messages,
-                'lead_winner': r.lead_winner,
-                'follow_winner': r.follow_winner,
-                'song_info': r.song_info if hasattr(r, 'song_info') else None
-            }
-            rounds_data.append(round_data)
-    
-    # Also include the current round if it exists and is not already in the rounds list
-    if game.current_round and game.current_round not in game.rounds:
-        if hasattr(game.current_round, 'session_id') and game.current_round.session_id == session_id:
-            current_round_data = {
-                'round_num': game.current_round.round_num,
-                'session_id': session_id,
-                'pairs': game.current_round.pairs,
-                'lead_votes': game.current_round.lead_votes,
-                'follow_votes': game.current_round.follow_votes,
-                'judges': game.current_round.judges,
-                'contestant_judges': game.current_round.contestant_judges,
-                'win_messages': game.current_round.win_messages,
-                'lead_winner': game.current_round.lead_winner,
-                'follow_winner': game.current_round.follow_winner,
-                'song_info': game.current_round.song_info if hasattr(game.current_round, 'song_info') else None
-            }
-            rounds_data.append(current_round_data)
-    
-    # Sort rounds by round number
-    rounds_data.sort(key=lambda x: x['round_num'])
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        leads, follows = game.finalize_results()
+        # Format the results - include all leads
+        lead_results = []
+        # Get all leads from initial order to ensure we include everyone
+        all_leads = [lead.name for lead in game.initial_leads]
+        # Create a dictionary of lead points for easy lookup
+        lead_points = {lead.name: lead.points for lead in leads}
+        
+        # Sort leads by points (descending) and then by name (ascending) for consistent ordering
+        sorted_leads = sorted(all_leads, key=lambda x: (-lead_points.get(x, 0), x))
+        
+        for idx, lead_name in enumerate(sorted_leads):
+            points = lead_points.get(lead_name, 0)
+            medal = ["🥇", "🥈", "🥉"][idx] if idx < 3 else ""
+            is_winner = hasattr(game, 'last_lead_winner') and game.last_lead_winner == lead_name
+            lead_results.append({
+                'name': lead_name,
+                'points': points,
+                'medal': medal,
+                'is_winner': is_winner
+            })
+        
+        # Format the results - include all follows
+        follow_results = []
+        # Get all follows from initial order to ensure we include everyone
+        all_follows = [follow.name for follow in game.initial_follows]
+        # Create a dictionary of follow points for easy lookup
+        follow_points = {follow.name: follow.points for follow in follows}
+        
+        # Sort follows by points (descending) and then by name (ascending) for consistent ordering
+        sorted_follows = sorted(all_follows, key=lambda x: (-follow_points.get(x, 0), x))
+        
+        for idx, follow_name in enumerate(sorted_follows):
+            points = follow_points.get(follow_name, 0)
+            medal = ["🥇", "🥈", "🥉"][idx] if idx < 3 else ""
+            is_winner = hasattr(game, 'last_follow_winner') and game.last_follow_winner == follow_name
+            follow_results.append({
+                'name': follow_name,
+                'points': points,
+                'medal': medal,
+                'is_winner': is_winner
+            })
+        
+        # Collect round metadata
+        rounds_data = []
+        
+        # Add all completed rounds that belong to this session
+        for r in game.rounds:
+            if hasattr(r, 'session_id') and r.session_id == session_id:
+                round_data = {
+                    'round_num': r.round_num,
+                    'session_id': session_id,
+                    'pairs': r.pairs,
+                    'lead_votes': r.lead_votes,
+                    'follow_votes': r.follow_votes,
+                    'judges': r.judges,
+                    'contestant_judges': r.contestant_judges,
+                    'win_messages': r.win_messages,
+                    'lead_winner': r.lead_winner,
+                    'follow_winner': r.follow_winner,
+                    'song_info': r.song_info if hasattr(r, 'song_info') else None
+                }
+                rounds_data.append(round_data)
+        
+        # Also include the current round if it exists and is not already in the rounds list
+        if game.current_round and game.current_round not in game.rounds:
+            if hasattr(game.current_round, 'session_id') and game.current_round.session_id == session_id:
+                current_round_data = {
+                    'round_num': game.current_round.round_num,
+                    'session_id': session_id,
+                    'pairs': game.current_round.pairs,
+                    'lead_votes': game.current_round.lead_votes,
+                    'follow_votes': game.current_round.follow_votes,
+                    'judges': game.current_round.judges,
+                    'contestant_judges': game.current_round.contestant_judges,
+                    'win_messages': game.current_round.win_messages,
+                    'lead_winner': game.current_round.lead_winner,
+                    'follow_winner': game.current_round.follow_winner,
+                    'song_info': game.current_round.song_info if hasattr(game.current_round, 'song_info') else None
+                }
+                rounds_data.append(current_round_data)
+        
+        # Sort rounds by round number
+        rounds_data.sort(key=lambda x: x['round_num'])
     
     return jsonify({
         'session_id': session_id,
@@ -350,274 +668,116 @@ def export_battle_data():
     session_id = request.args.get('session_id')
     format_type = request.args.get('format', 'excel')  # Default to excel format
     
-    if session_id not in games:
-        return jsonify({'error': 'Game not found'}), 404
-    
-    game = games[session_id]
-    
-    # Get all rounds data
-    all_rounds = []
-    all_rounds.extend(game.rounds)
-    if game.current_round not in game.rounds:
-        all_rounds.append(game.current_round)
-    
-    # Format the results
-    leads, follows = game.finalize_results()
-    
-    lead_results = []
-    for idx, lead in enumerate(leads):
-        medal = ["🥇", "🥈", "🥉"][idx] if idx < 3 else ""
-        is_winner = hasattr(game, 'last_lead_winner') and game.last_lead_winner == lead.name
-        lead_results.append({
-            'name': lead.name,
-            'points': lead.points,
-            'medal': medal,
-            'is_winner': is_winner
-        })
-    
-    follow_results = []
-    for idx, follow in enumerate(follows):
-        medal = ["🥇", "🥈", "🥉"][idx] if idx < 3 else ""
-        is_winner = hasattr(game, 'last_follow_winner') and game.last_follow_winner == follow.name
-        follow_results.append({
-            'name': follow.name,
-            'points': follow.points,
-            'medal': medal,
-            'is_winner': is_winner
-        })
-    
-    # Collect round metadata
-    rounds_data = []
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        
+        # Format the results
+        leads, follows = game.finalize_results()
+        version = game.version
+        
+        # A GET of the JSON export depends only on the game, so an unchanged
+        # game is answered without building the export again
+        etag = None
+        if format_type == 'json' and request.method == 'GET':
+            etag = f"{session_id}-{game.seed}-export-{version}"
+            if request.if_none_match.contains(etag):
+                return conditional(etag, None)
+        
+        export = battle_export(session_id, game, leads, follows)
     
     # Check if we received updated rounds data in the POST request
     if request.method == 'POST' and request.json and 'rounds' in request.json:
-        rounds_data = request.json['rounds']
-    else:
-        # Add all completed rounds from the game object
-        for r in all_rounds:
-            round_data = {
-                'round_num': r.round_num,
-                'session_id': session_id,
-                'pairs': r.pairs,
-                'lead_votes': r.lead_votes,
-                'follow_votes': r.follow_votes,
-                'judges': r.judges,
-                'contestant_judges': r.contestant_judges,
-                'win_messages': r.win_messages,
-                'lead_winner': r.lead_winner,
-                'follow_winner': r.follow_winner,
-                'song_info': r.song_info if hasattr(r, 'song_info') else None
-            }
-            rounds_data.append(round_data)
-    
-    # Sort rounds by round number
-    rounds_data.sort(key=lambda x: x['round_num'])
+        export['rounds'] = sorted(request.json['rounds'], key=lambda x: x['round_num'])
     
     if format_type == 'json':
-        return jsonify({
-            'session_id': session_id,
-            'leads': lead_results,
-            'follows': follow_results,
-            'rounds': rounds_data
-        })
+        export = {key: export[key] for key in ('session_id', 'seed', 'leads', 'follows', 'rounds')}
+        if etag:
+            return conditional(etag, lambda: jsonify(export))
+        return jsonify(export)
     else:
-        # Create Excel file in the previous multi-sheet format
-        wb = Workbook()
-        summary_sheet = wb.active
-        summary_sheet.title = "Battle Summary"
+        excel_file = io.BytesIO(ExportJobs.build(export))
+        return send_file(
+            excel_file,
+            mimetype=XLSX_MIMETYPE,
+            as_attachment=True,
+            download_name=f'battle_results_{session_id}.xlsx'
+        )
 
-        # Add game ID, date, and time
-        now = datetime.datetime.now()
-        date_str = now.strftime("%Y-%m-%d")
-        time_str = now.strftime("%H:%M:%S")
-        summary_sheet['A1'] = f"Game ID: {session_id}"
-        summary_sheet['A3'] = "Date:"
-        summary_sheet['B3'] = date_str
-        summary_sheet['A4'] = "Time:"
-        summary_sheet['B4'] = time_str
-        summary_sheet['A5'] = "Total Rounds:"
-        summary_sheet['B5'] = len(game.rounds) + (1 if game.current_round not in game.rounds else 0)
+@app.route('/api/export_jobs', methods=['POST'])
+def start_export_job():
+    """Start building the battle's Excel workbook in the background.
 
-        # Initial Order section
-        summary_sheet['A7'] = "Initial Order"
-        summary_sheet['A9'] = "Leads:"
-        initial_leads = [lead.name for lead in game.initial_leads]
-        for i, lead in enumerate(initial_leads, 1):
-            summary_sheet[f'A{9+i}'] = f"{i}. {lead}"
-        follow_start_row = 9 + len(initial_leads) + 2
-        summary_sheet[f'A{follow_start_row}'] = "Follows:"
-        initial_follows = [follow.name for follow in game.initial_follows]
-        for i, follow in enumerate(initial_follows, 1):
-            summary_sheet[f'A{follow_start_row+i}'] = f"{i}. {follow}"
+    ``songs`` optionally maps round numbers to song details (title, artist)
+    to use in place of the stored ones. The job ID names the game's current
+    state, so asking again for an unchanged battle returns the same job, and
+    its workbook once built.
+    """
+    data = request.get_json()
+    session_id = data.get('session_id')
+    songs = {str(round_num): song for round_num, song in (data.get('songs') or {}).items()}
+    
+    with games.session(session_id) as game:
+        if not game:
+            return jsonify({'error': 'Game not found'}), 404
+        leads, follows = game.finalize_results()
+        job_id = export_job_id(session_id, game.version, songs)
+        status = export_jobs.submit(
+            job_id, lambda: battle_export(session_id, game, leads, follows, songs), songs)
+    
+    return jsonify({'job_id': job_id, 'status': status}), 200 if status == 'ready' else 202
 
-        # Final Results section
-        results_start_row = follow_start_row + len(initial_follows) + 2
-        summary_sheet[f'A{results_start_row}'] = "Final Results"
-        summary_sheet[f'A{results_start_row+2}'] = "Lead Winners:"
-        for i, lead in enumerate(leads[:3], 1):
-            medal = ["🥇", "🥈", "🥉"][i-1]
-            is_winner = hasattr(game, 'last_lead_winner') and game.last_lead_winner == lead.name
-            crown = " 👑" if is_winner else ""
-            summary_sheet[f'A{results_start_row+2+i}'] = f"{medal} {lead.name}{crown}"
-            summary_sheet[f'B{results_start_row+2+i}'] = f"{lead.points} points"
-        follow_winners_start = results_start_row + 2 + len(leads[:3]) + 2
-        summary_sheet[f'A{follow_winners_start}'] = "Follow Winners:"
-        for i, follow in enumerate(follows[:3], 1):
-            medal = ["🥇", "🥈", "🥉"][i-1]
-            is_winner = hasattr(game, 'last_follow_winner') and game.last_follow_winner == follow.name
-            crown = " 👑" if is_winner else ""
-            summary_sheet[f'A{follow_winners_start+i}'] = f"{medal} {follow.name}{crown}"
-            summary_sheet[f'B{follow_winners_start+i}'] = f"{follow.points} points"
+def export_job_status_or_restart(job_id):
+    """A job's status, starting it again if the worker building it has gone.
 
-        # Lead Leaderboard
-        lead_sheet = wb.create_sheet("Lead Leaderboard")
-        lead_sheet['A1'] = "Lead"
-        lead_sheet['B1'] = "Points"
-        for i, lead in enumerate(leads, 2):
-            lead_sheet[f'A{i}'] = lead.name
-            lead_sheet[f'B{i}'] = lead.points
+    Jobs are rebuilt from the game's history at the version the job names,
+    so a job can be finished by any worker. Returns None for jobs that can't
+    be rebuilt: unknown games, and song details no worker was sent.
+    """
+    status = export_jobs.status(job_id)
+    if status not in (None, 'stalled'):
+        return status
+    parsed = parse_export_job_id(job_id)
+    songs = export_jobs.songs(job_id)
+    if parsed is None or (songs is None and not job_id.endswith('-game')):
+        return None
+    session_id, version = parsed
+    
+    with games.read(session_id) as game:
+        if not game or game.version < version:
+            return None
+        
+        def prepare():
+            # The game as it was when the job was asked for
+            snapshot = game.snapshot if game.snapshot and game.snapshot[0] <= version else None
+            past = Game.from_events(game.events[:version], snapshot)
+            leads, follows = past.finalize_results()
+            return battle_export(session_id, past, leads, follows, songs)
+        
+        return export_jobs.submit(job_id, prepare, songs)
 
-        # Follow Leaderboard
-        follow_sheet = wb.create_sheet("Follow Leaderboard")
-        follow_sheet['A1'] = "Follow"
-        follow_sheet['B1'] = "Points"
-        for i, follow in enumerate(follows, 2):
-            follow_sheet[f'A{i}'] = follow.name
-            follow_sheet[f'B{i}'] = follow.points
+@app.route('/api/export_jobs/<job_id>', methods=['GET'])
+def export_job_status(job_id):
+    status = export_job_status_or_restart(job_id)
+    if status is None:
+        return jsonify({'error': 'Export job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': status})
 
-        # Round History
-        round_sheet = wb.create_sheet("Round History")
-        base_headers = ["Round", "Lead 1", "Lead 2", "Follow 1", "Follow 2", "Song Title", "Artist", "Spotify Link"]
-        # Determine the maximum number of judges in any round
-        max_judges_count = 0
-        for round_data in rounds_data:
-            all_judges = set()
-            if 'judges' in round_data:
-                all_judges.update(round_data['judges'])
-            if 'contestant_judges' in round_data:
-                all_judges.update(round_data['contestant_judges'])
-            max_judges_count = max(max_judges_count, len(all_judges))
-        judge_headers = []
-        for i in range(max_judges_count):
-            judge_headers.append(f"Judge {i+1}")
-            judge_headers.append(f"Lead Vote {i+1}")
-            judge_headers.append(f"Follow Vote {i+1}")
-        headers = base_headers + judge_headers
-        for col, header in enumerate(headers, 1):
-            round_sheet.cell(row=1, column=col).value = header
-        for i, round_data in enumerate(rounds_data, 2):
-            round_sheet.cell(row=i, column=1).value = round_data['round_num']
-            if 'pairs' in round_data and round_data['pairs']:
-                lead1 = round_data['pairs'].get('pair_1', {}).get('lead', '')
-                lead2 = round_data['pairs'].get('pair_2', {}).get('lead', '')
-                follow1 = round_data['pairs'].get('pair_1', {}).get('follow', '')
-                follow2 = round_data['pairs'].get('pair_2', {}).get('follow', '')
-                
-                # Add contestants and set red color for winners
-                lead1_cell = round_sheet.cell(row=i, column=2)
-                lead1_cell.value = lead1
-                if lead1 == round_data.get('lead_winner'):
-                    lead1_cell.font = Font(color="FF0000")
-                
-                lead2_cell = round_sheet.cell(row=i, column=3)
-                lead2_cell.value = lead2
-                if lead2 == round_data.get('lead_winner'):
-                    lead2_cell.font = Font(color="FF0000")
-                
-                follow1_cell = round_sheet.cell(row=i, column=4)
-                follow1_cell.value = follow1
-                if follow1 == round_data.get('follow_winner'):
-                    follow1_cell.font = Font(color="FF0000")
-                
-                follow2_cell = round_sheet.cell(row=i, column=5)
-                follow2_cell.value = follow2
-                if follow2 == round_data.get('follow_winner'):
-                    follow2_cell.font = Font(color="FF0000")
-                
-                # Song info
-                if 'song_info' in round_data and round_data['song_info']:
-                    song_info = round_data['song_info']
-                    round_sheet.cell(row=i, column=6).value = song_info.get('title', '')
-                    round_sheet.cell(row=i, column=7).value = song_info.get('artist', '')
-                    round_sheet.cell(row=i, column=8).value = song_info.get('spotify_url', '')
-                # Judges and votes
-                all_judges = []
-                if 'judges' in round_data:
-                    all_judges.extend(round_data['judges'])
-                if 'contestant_judges' in round_data:
-                    all_judges.extend(round_data['contestant_judges'])
-                for j in range(max_judges_count):
-                    judge_col = 9 + j * 3
-                    lead_vote_col = judge_col + 1
-                    follow_vote_col = judge_col + 2
-                    judge_name = all_judges[j] if j < len(all_judges) else ""
-                    if judge_name:
-                        lead_vote = round_data['lead_votes'].get(judge_name, '')
-                        follow_vote = round_data['follow_votes'].get(judge_name, '')
-                        round_sheet.cell(row=i, column=judge_col).value = judge_name
-                        
-                        # Set lead vote and color if it matches winner
-                        lead_vote_cell = round_sheet.cell(row=i, column=lead_vote_col)
-                        # Convert lead vote number to contestant name or special case
-                        if lead_vote == 1:
-                            lead_vote_cell.value = lead1
-                            if lead1 == round_data.get('lead_winner'):
-                                lead_vote_cell.font = Font(color="FF0000")
-                        elif lead_vote == 2:
-                            lead_vote_cell.value = lead2
-                            if lead2 == round_data.get('lead_winner'):
-                                lead_vote_cell.font = Font(color="FF0000")
-                        elif lead_vote == 0:
-                            lead_vote_cell.value = "Tie"
-                        else:
-                            lead_vote_cell.value = "No Contest"
-                        
-                        # Set follow vote and color if it matches winner
-                        follow_vote_cell = round_sheet.cell(row=i, column=follow_vote_col)
-                        # Convert follow vote number to contestant name or special case
-                        if follow_vote == 1:
-                            follow_vote_cell.value = follow1
-                            if follow1 == round_data.get('follow_winner'):
-                                follow_vote_cell.font = Font(color="FF0000")
-                        elif follow_vote == 2:
-                            follow_vote_cell.value = follow2
-                            if follow2 == round_data.get('follow_winner'):
-                                follow_vote_cell.font = Font(color="FF0000")
-                        elif follow_vote == 0:
-                            follow_vote_cell.value = "Tie"
-                        else:
-                            follow_vote_cell.value = "No Contest"
-        # Voting History
-        voting_sheet = wb.create_sheet("Voting History")
-        voting_headers = ["Round", "Judge", "Lead Vote", "Follow Vote"]
-        for col, header in enumerate(voting_headers, 1):
-            voting_sheet.cell(row=1, column=col).value = header
-        row_index = 2
-        for round_data in rounds_data:
-            if 'pairs' in round_data and round_data['pairs']:
-                all_judges = set()
-                if 'judges' in round_data:
-                    all_judges.update(round_data['judges'])
-                if 'contestant_judges' in round_data:
-                    all_judges.update(round_data['contestant_judges'])
-                for judge in all_judges:
-                    lead_vote = round_data['lead_votes'].get(judge, '')
-                    follow_vote = round_data['follow_votes'].get(judge, '')
-                    voting_sheet.cell(row=row_index, column=1).value = round_data['round_num']
-                    voting_sheet.cell(row=row_index, column=2).value = judge
-                    voting_sheet.cell(row=row_index, column=3).value = lead_vote
-                    voting_sheet.cell(row=row_index, column=4).value = follow_vote
-                    row_index += 1
-        # Save the workbook
-        excel_file = io.BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
-        return send_file(
-            excel_file,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'battle_results_{session_id}.xlsx'
-        )
+@app.route('/api/export_jobs/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    workbook = export_jobs.result(job_id)
+    if workbook is None:
+        status = export_job_status_or_restart(job_id)
+        if status is None:
+            return jsonify({'error': 'Export job not found'}), 404
+        return jsonify({'job_id': job_id, 'status': status}), 202
+    session_id = parse_export_job_id(job_id)[0]
+    return send_file(
+        io.BytesIO(workbook),
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=f'battle_results_{session_id}.xlsx'
+    )
 
 @app.route('/api/process_uploaded_file', methods=['POST'])
 def process_uploaded_file():
@@ -633,431 +793,48 @@ def process_uploaded_file():
     if not file.filename.endswith('.xlsx'):
         return jsonify({'error': 'File must be an Excel (.xlsx) file'}), 400
         
-    # Save the file temporarily
-    temp_path = os.path.join('/tmp', secure_filename(file.filename))
-    file.save(temp_path)
-    
-    try:
-        # Load the Excel workbook
-        wb = load_workbook(temp_path)
-        
-        # Extract data from relevant sheets
-        data = {}
-        
-        # Track all contestants and their points from rounds
-        all_contestants = {
-            'leads': {},
-            'follows': {}
-        }
-        
-        # Battle Summary - Process this first to get initial order
-        if "Battle Summary" in wb.sheetnames:
-            summary_sheet = wb["Battle Summary"]
-            
-            # Extract date and time
-            date = summary_sheet['B3'].value if 'B3' in summary_sheet else None
-            time = summary_sheet['B4'].value if 'B4' in summary_sheet else None
-            total_rounds = summary_sheet['B5'].value if 'B5' in summary_sheet else 0
-            
-            print("Processing Battle Summary sheet...")
-            print(f"Date: {date}, Time: {time}, Total Rounds: {total_rounds}")
-            
-            # Extract initial order
-            initial_leads = []
-            initial_follows = []
-            
-            # Find the initial order section
-            current_row = 7  # Start after "Initial Order" header
-            found_initial_order = False
-            
-            # First, find the "Initial Order" section
-            while current_row < summary_sheet.max_row:
-                cell_value = summary_sheet[f'A{current_row}'].value
-                print(f"Checking row {current_row}: {cell_value}")
-                if cell_value == "Initial Order":
-                    found_initial_order = True
-                    print("Found Initial Order section")
-                    current_row += 2  # Skip the header and move to content
-                    break
-                current_row += 1
-            
-            if found_initial_order:
-                print("Processing initial order section...")
-                # Process leads
-                while current_row < summary_sheet.max_row:
-                    cell_value = summary_sheet[f'A{current_row}'].value
-                    print(f"Processing row {current_row}: {cell_value}")
-                    if cell_value == "Leads:":
-                        print("Found Leads section")
-                        current_row += 1
-                        while current_row < summary_sheet.max_row:
-                            lead_entry = summary_sheet[f'A{current_row}'].value
-                            print(f"Processing lead entry: {lead_entry}")
-                            if not lead_entry or lead_entry == "Follows:":
-                                break
-                            # Extract name from "1. Name" format
-                            if isinstance(lead_entry, str) and '. ' in lead_entry:
-                                lead_name = lead_entry.split('. ', 1)[1]
-                                print(f"Added lead: {lead_name}")
-                                initial_leads.append(lead_name)
-                            current_row += 1
-                    elif cell_value == "Follows:":
-                        print("Found Follows section")
-                        current_row += 1
-                        while current_row < summary_sheet.max_row:
-                            follow_entry = summary_sheet[f'A{current_row}'].value
-                            print(f"Processing follow entry: {follow_entry}")
-                            if not follow_entry or follow_entry == "Final Results":
-                                break
-                            # Extract name from "1. Name" format
-                            if isinstance(follow_entry, str) and '. ' in follow_entry:
-                                follow_name = follow_entry.split('. ', 1)[1]
-                                print(f"Added follow: {follow_name}")
-                                initial_follows.append(follow_name)
-                            current_row += 1
-                    elif cell_value == "Final Results":
-                        print("Found Final Results section")
-                        break
-                    current_row += 1
-            
-            print(f"Final initial leads: {initial_leads}")
-            print(f"Final initial follows: {initial_follows}")
-            
-            # Store initial order in data
-            data['initial_leads'] = initial_leads
-            data['initial_follows'] = initial_follows
-            
-            # Calculate row numbers for results sections
-            results_start_row = current_row  # This is where "Final Results" was found
-            follow_winners_start = results_start_row + 2 + len(initial_leads) + 2  # Add 2 for headers and spacing
-            
-            # Extract top leads
-            top_leads = []
-            for i in range(results_start_row + 2, results_start_row + 5):  # Rows for top 3 leads
-                name_cell = f'A{i}'
-                points_cell = f'B{i}'
-                if name_cell in summary_sheet and summary_sheet[name_cell].value:
-                    name_text = summary_sheet[name_cell].value
-                    points_text = summary_sheet[points_cell].value if points_cell in summary_sheet else "0 points"
-                    
-                    # Parse name and medal
-                    parts = name_text.split(' ')
-                    medal = parts[0] if parts[0] in ["🥇", "🥈", "🥉"] else ""
-                    is_winner = "👑" in name_text
-                    name = name_text.replace(medal, '').replace("👑", '').strip()
-                    
-                    # Parse points
-                    points = 0
-                    try:
-                        if isinstance(points_text, str):
-                            points = int(points_text.split(' ')[0])
-                        elif isinstance(points_text, (int, float)):
-                            points = int(points_text)
-                    except (ValueError, TypeError):
-                        # If parsing fails, try to get points from our calculated data
-                        if name in all_contestants['leads']:
-                            points = all_contestants['leads'][name]['points']
-                    
-                    # Mark as winner in our tracking dict
-                    if name in all_contestants['leads'] and is_winner:
-                        all_contestants['leads'][name]['is_winner'] = True
-                    
-                    top_leads.append({
-                        'name': name,
-                        'points': points,
-                        'medal': medal,
-                        'is_winner': is_winner
-                    })
-            
-            # Extract top follows
-            top_follows = []
-            for i in range(follow_winners_start + 1, follow_winners_start + 4):  # Rows for top 3 follows
-                name_cell = f'A{i}'
-                points_cell = f'B{i}'
-                if name_cell in summary_sheet and summary_sheet[name_cell].value:
-                    name_text = summary_sheet[name_cell].value
-                    points_text = summary_sheet[points_cell].value if points_cell in summary_sheet else "0 points"
-                    
-                    # Parse name and medal
-                    parts = name_text.split(' ')
-                    medal = parts[0] if parts[0] in ["🥇", "🥈", "🥉"] else ""
-                    is_winner = "👑" in name_text
-                    name = name_text.replace(medal, '').replace("👑", '').strip()
-                    
-                    # Parse points
-                    points = 0
-                    try:
-                        if isinstance(points_text, str):
-                            points = int(points_text.split(' ')[0])
-                        elif isinstance(points_text, (int, float)):
-                            points = int(points_text)
-                    except (ValueError, TypeError):
-                        # If parsing fails, try to get points from our calculated data
-                        if name in all_contestants['follows']:
-                            points = all_contestants['follows'][name]['points']
-                    
-                    # Mark as winner in our tracking dict
-                    if name in all_contestants['follows'] and is_winner:
-                        all_contestants['follows'][name]['is_winner'] = True
-                    
-                    top_follows.append({
-                        'name': name,
-                        'points': points,
-                        'medal': medal,
-                        'is_winner': is_winner
-                    })
-            
-            data['summary'] = {
-                'date': date,
-                'time': time,
-                'total_rounds': total_rounds
-            }
-        
-        # Round History - Process this first to collect all contestant points
-        if "Round History" in wb.sheetnames:
-            round_sheet = wb["Round History"]
-            rounds = []
-            
-            # Get column headers to understand the sheet format
-            headers = {}
-            for col in range(1, round_sheet.max_column + 1):
-                header = round_sheet.cell(row=1, column=col).value
-                if header:
-                    headers[col] = header
-                    
-            # Count how many judges (every 3 columns after column 5)
-            judge_count = (round_sheet.max_column - 5) // 3
-            
-            # Extract round data
-            for row in range(2, round_sheet.max_row + 1):
-                round_num = round_sheet.cell(row=row, column=1).value
-                if round_num:
-                    lead1 = round_sheet.cell(row=row, column=2).value
-                    lead2 = round_sheet.cell(row=row, column=3).value
-                    follow1 = round_sheet.cell(row=row, column=4).value
-                    follow2 = round_sheet.cell(row=row, column=5).value
-                    
-                    # Initialize contestants if they don't exist yet
-                    for lead in [lead1, lead2]:
-                        if lead and lead not in all_contestants['leads']:
-                            all_contestants['leads'][lead] = {'name': lead, 'points': 0, 'is_winner': False}
-                            
-                    for follow in [follow1, follow2]:
-                        if follow and follow not in all_contestants['follows']:
-                            all_contestants['follows'][follow] = {'name': follow, 'points': 0, 'is_winner': False}
-                    
-                    round_data = {
-                        'round_num': round_num,
-                        'pairs': {
-                            'pair_1': {
-                                'lead': lead1,
-                                'follow': follow1
-                            },
-                            'pair_2': {
-                                'lead': lead2,
-                                'follow': follow2
-                            }
-                        },
-                        'lead_votes': {},
-                        'follow_votes': {}
-                    }
-                    
-                    # Extract song information if available
-                    song_title = round_sheet.cell(row=row, column=6).value
-                    artist = round_sheet.cell(row=row, column=7).value
-                    spotify_url = round_sheet.cell(row=row, column=8).value
-                    
-                    if song_title or artist or spotify_url:
-                        round_data['song_info'] = {
-                            'title': song_title or '',
-                            'artist': artist or '',
-                            'spotify_url': spotify_url or ''
-                        }
-                    
-                    # Extract winner information and award points
-                    lead_winner = None
-                    follow_winner = None
-                    
-                    for col in [2, 3]:  # Lead columns
-                        cell = round_sheet.cell(row=row, column=col)
-                        font_color = cell.font.color
-                        if font_color and font_color.rgb == "FF0000":  # Red color
-                            lead_winner = cell.value
-                            round_data['lead_winner'] = lead_winner
-                            # Award a point to the winner
-                            if lead_winner and lead_winner in all_contestants['leads']:
-                                all_contestants['leads'][lead_winner]['points'] += 1
-                    
-                    for col in [4, 5]:  # Follow columns
-                        cell = round_sheet.cell(row=row, column=col)
-                        font_color = cell.font.color
-                        if font_color and font_color.rgb == "FF0000":  # Red color
-                            follow_winner = cell.value
-                            round_data['follow_winner'] = follow_winner
-                            # Award a point to the winner
-                            if follow_winner and follow_winner in all_contestants['follows']:
-                                all_contestants['follows'][follow_winner]['points'] += 1
-                    
-                    # Extract judge votes
-                    for j in range(judge_count):
-                        judge_col = 9 + j * 3  # Start after song info columns (6-8)
-                        lead_vote_col = judge_col + 1
-                        follow_vote_col = judge_col + 2
-                        
-                        judge_name = round_sheet.cell(row=row, column=judge_col).value
-                        if judge_name:
-                            lead_vote = round_sheet.cell(row=row, column=lead_vote_col).value
-                            follow_vote = round_sheet.cell(row=row, column=follow_vote_col).value
-                            
-                            if lead_vote:
-                                round_data['lead_votes'][judge_name] = lead_vote
-                            if follow_vote:
-                                round_data['follow_votes'][judge_name] = follow_vote
-                    
-                    rounds.append(round_data)
-            
-            data['rounds'] = rounds
-        
-        # Lead and Follow Leaderboards
-        if "Lead Leaderboard" in wb.sheetnames:
-            lead_sheet = wb["Lead Leaderboard"]
-            leads = []
-            for row in range(2, lead_sheet.max_row + 1):
-                name = lead_sheet.cell(row=row, column=1).value
-                points_cell = lead_sheet.cell(row=row, column=2).value
-                if name:
-                    # Try to parse points from the cell
-                    points = 0
-                    try:
-                        if isinstance(points_cell, (int, float)):
-                            points = int(points_cell)
-                        elif isinstance(points_cell, str) and points_cell.isdigit():
-                            points = int(points_cell)
-                    except (ValueError, TypeError):
-                        # If parsing fails, try to get points from our calculated data
-                        if name in all_contestants['leads']:
-                            points = all_contestants['leads'][name]['points']
-                            
-                    # Check if this contestant is a winner
-                    is_winner = False
-                    if name in all_contestants['leads']:
-                        is_winner = all_contestants['leads'][name]['is_winner']
-                    
-                    leads.append({
-                        'name': name,
-                        'points': points,
-                        'is_winner': is_winner
-                    })
-                    
-                    # Update our tracking dictionary
-                    if name in all_contestants['leads']:
-                        all_contestants['leads'][name]['points'] = max(all_contestants['leads'][name]['points'], points)
-            data['all_leads'] = leads
-        
-        if "Follow Leaderboard" in wb.sheetnames:
-            follow_sheet = wb["Follow Leaderboard"]
-            follows = []
-            for row in range(2, follow_sheet.max_row + 1):
-                name = follow_sheet.cell(row=row, column=1).value
-                points_cell = follow_sheet.cell(row=row, column=2).value
-                if name:
-                    # Try to parse points from the cell
-                    points = 0
-                    try:
-                        if isinstance(points_cell, (int, float)):
-                            points = int(points_cell)
-                        elif isinstance(points_cell, str) and points_cell.isdigit():
-                            points = int(points_cell)
-                    except (ValueError, TypeError):
-                        # If parsing fails, try to get points from our calculated data
-                        if name in all_contestants['follows']:
-                            points = all_contestants['follows'][name]['points']
-                    
-                    # Check if this contestant is a winner
-                    is_winner = False
-                    if name in all_contestants['follows']:
-                        is_winner = all_contestants['follows'][name]['is_winner']
-                    
-                    follows.append({
-                        'name': name,
-                        'points': points,
-                        'is_winner': is_winner
-                    })
-                    
-                    # Update our tracking dictionary
-                    if name in all_contestants['follows']:
-                        all_contestants['follows'][name]['points'] = max(all_contestants['follows'][name]['points'], points)
-            data['all_follows'] = follows
-        
-        # Convert tracking dictionaries to lists and use as final data if not already set
-        if 'leads' not in data or not data['leads']:
-            data['leads'] = list(all_contestants['leads'].values())
-            # Sort by points in descending order
-            data['leads'].sort(key=lambda x: x['points'], reverse=True)
-            
-            # Assign medals to top 3
-            for i, lead in enumerate(data['leads'][:3]):
-                if i == 0:
-                    lead['medal'] = '🥇'
-                elif i == 1:
-                    lead['medal'] = '🥈'
-                elif i == 2:
-                    lead['medal'] = '🥉'
-        
-        if 'follows' not in data or not data['follows']:
-            data['follows'] = list(all_contestants['follows'].values())
-            # Sort by points in descending order
-            data['follows'].sort(key=lambda x: x['points'], reverse=True)
-            
-            # Assign medals to top 3
-            for i, follow in enumerate(data['follows'][:3]):
-                if i == 0:
-                    follow['medal'] = '🥇'
-                elif i == 1:
-                    follow['medal'] = '🥈'
-                elif i == 2:
-                    follow['medal'] = '🥉'
-        
-        # Clean up
-        os.remove(temp_path)
-        
-        # Log data for debugging
-        print("Processed data:", data)
-        if 'leads' in data:
-            for lead in data['leads']:
-                print(f"Lead: {lead['name']}, Points: {lead['points']}, Type: {type(lead['points'])}")
-        
-        return jsonify(data)
-    
-    except Exception as e:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        print(f"Error processing Excel file: {str(e)}")
-        return jsonify({'error': f'Failed to process file: {str(e)}'}), 500
+    # The same file uploaded again is answered from the cache without opening it
+    digest = content_hash(file.stream)
+    body = imports.get(digest)
+    if body is None:
+        try:
+            data = parse_battle_workbook(file.stream)
+        except Exception as e:
+            print(f"Error processing Excel file: {str(e)}")
+            return jsonify({'error': f'Failed to process file: {str(e)}'}), 500
+        body = jsonify(data).get_data()
+        imports.put(digest, body)
+    
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/api/get_spotify_token', methods=['GET'])
 def get_spotify_token():
+    """The shared Spotify access token."""
     try:
-        # Get client credentials from environment variables
-        client_id = os.getenv('SPOTIFY_CLIENT_ID')
-        client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-        
-        if not client_id or not client_secret:
-            return jsonify({'error': 'Spotify credentials not configured'}), 500
-        
-        # Request access token from Spotify
-        auth_response = requests.post(
-            'https://accounts.spotify.com/api/token',
-            auth=(client_id, client_secret),
-            data={'grant_type': 'client_credentials'}
-        )
-        
-        if auth_response.status_code != 200:
-            return jsonify({'error': 'Failed to get Spotify access token'}), 500
-        
-        return jsonify(auth_response.json())
-    except Exception as e:
+        return jsonify(spotify_tokens.token())
+    except SpotifyError as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/tracks', methods=['GET', 'POST'])
+def get_tracks():
+    """Titles and artists for many Spotify tracks at once.
+
+    Takes the track IDs as ``ids`` (a JSON list, or comma-separated in the
+    query string) and answers ``{"tracks": {id: {"title", "artist"} or null}}``.
+    """
+    if request.method == 'POST':
+        ids = (request.get_json(silent=True) or {}).get('ids')
+    else:
+        ids = [track_id for track_id in request.args.get('ids', '').split(',') if track_id]
+    if not isinstance(ids, list) or not ids or not all(isinstance(track_id, str) for track_id in ids):
+        return jsonify({'error': 'Missing track ids'}), 400
+    if len(ids) > config.TRACK_LOOKUP_LIMIT:
+        return jsonify({'error': f'At most {config.TRACK_LOOKUP_LIMIT} tracks per request'}), 400
+    
+    try:
+        return jsonify({'tracks': tracks.lookup(ids)})
+    except SpotifyError as e:
+        return jsonify({'error': str(e)}), 502
+
 if __name__ == '__main__':
     app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG) 
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Audience voting for the Hustle n' Tussle web application.
+
+Everyone in the room can vote from their phone, once per role per round.
+A vote is only counted in this worker's memory as it arrives: it goes to one
+of a fixed number of shards picked by the device token, so it costs one dict
+update under a lock few other votes share, and never waits on the database
+or the game. A background thread writes the buffered votes to a SQLite file
+of their own every ``flush_interval`` seconds, one transaction per batch,
+keyed by device token so a phone that reaches several workers still counts
+once.
+
+When the role is judged the judging worker writes out its own buffer and
+closes voting, and the crowd's majority joins the judges' votes as a single
+"Audience" judge, with the weight of a contestant judge. Votes other workers
+haven't written out yet (at most ``flush_interval`` seconds' worth) arrive
+too late and are dropped.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from web.game_store import SQLiteStore
+
+
+AUDIENCE_JUDGE = "Audience"
+
+
+class _Shard:
+    __slots__ = ("lock", "pending", "voters", "closed")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # (session_id, round_num, role) -> {device token: (decision, cast at)} not yet written
+        self.voters = {}  # (session_id, round_num, role) -> device tokens that voted here
+        self.closed = OrderedDict()  # Recently closed keys, which take no more votes
+
+
+class AudienceTally(SQLiteStore):
+    """The crowd's votes, counted in memory and written in batches to a shared SQLite file."""
+
+    MAX_CLOSED = 1024  # Closed ballots remembered per shard
+    RETENTION = 86400  # Seconds closed ballots and abandoned votes are kept in the file
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS audience_votes ("
+        " session_id TEXT NOT NULL,"
+        " round_num INTEGER NOT NULL,"
+        " role TEXT NOT NULL,"
+        " device_token TEXT NOT NULL,"
+        " decision INTEGER NOT NULL,"
+        " cast_at REAL NOT NULL,"
+        " PRIMARY KEY (session_id, round_num, role, device_token)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS audience_closed ("
+        " session_id TEXT NOT NULL,"
+        " round_num INTEGER NOT NULL,"
+        " role TEXT NOT NULL,"
+        " closed_at REAL NOT NULL,"
+        " pair_1 INTEGER NOT NULL,"
+        " pair_2 INTEGER NOT NULL,"
+        " PRIMARY KEY (session_id, round_num, role)) WITHOUT ROWID",
+    )
+
+    def __init__(self, path, shards=16, flush_interval=1.0):
+        super().__init__(path)
+        self._shards = [_Shard() for _ in range(shards)]
+        self._flush_interval = flush_interval
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _start_flusher(self):
+        # Started by the first vote rather than at import, so each forked worker gets its own
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_forever, name='audience-flush', daemon=True)
+                self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass  # The votes stay buffered and go with the next batch
+
+    def vote(self, session_id, round_num, role, device_token, decision):
+        """Count one vote; returns False if the device already voted or voting has closed."""
+        if decision not in (1, 2):
+            raise ValueError(f"Invalid audience vote {decision!r}")
+        key = (session_id, round_num, role)
+        device_token = str(device_token)
+        # A device always lands on the same shard, so the shard can dedupe it alone
+        shard = self._shards[hash(device_token) % len(self._shards)]
+        with shard.lock:
+            if key in shard.closed:
+                return False
+            voters = shard.voters.setdefault(key, set())
+            if device_token in voters:
+                return False
+            voters.add(device_token)
+            shard.pending.setdefault(key, {})[device_token] = (decision, time.time())
+        if self._flusher is None:
+            self._start_flusher()
+        return True
+
+    def flush(self):
+        """Write the votes buffered in this worker to the shared file, in one transaction."""
+        with self._write_lock:
+            batch = []
+            for shard in self._shards:
+                with shard.lock:
+                    pending, shard.pending = shard.pending, {}
+                for key, votes in pending.items():
+                    batch.extend(key + (device, decision, cast_at) + key
+                                 for device, (decision, cast_at) in votes.items())
+            if not batch:
+                return
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Votes for closed ballots, and devices that voted on another worker, are skipped
+                conn.executemany(
+                    "INSERT OR IGNORE INTO audience_votes "
+                    "(session_id, round_num, role, device_token, decision, cast_at) "
+                    "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM audience_closed "
+                    "WHERE session_id = ? AND round_num = ? AND role = ?)",
+                    batch,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                # Put the votes back for the next batch
+                for row in batch:
+                    key, device, decision, cast_at = row[:3], row[3], row[4], row[5]
+                    shard = self._shards[hash(device) % len(self._shards)]
+                    with shard.lock:
+                        shard.pending.setdefault(key, {}).setdefault(device, (decision, cast_at))
+                raise
+
+    def counts(self, session_id, round_num, role):
+        """Votes so far for pair 1 and pair 2, this worker's included, without closing voting.
+
+        Once voting has closed these are the final counts.
+        """
+        self.flush()
+        conn = self._connection()
+        key = (session_id, round_num, role)
+        closed = conn.execute(
+            "SELECT pair_1, pair_2 FROM audience_closed WHERE session_id = ? AND round_num = ? AND role = ?",
+            key,
+        ).fetchone()
+        return tuple(closed) if closed is not None else self._counts(conn, key)
+
+    def _counts(self, conn, key):
+        totals = dict(conn.execute(
+            "SELECT decision, COUNT(*) FROM audience_votes "
+            "WHERE session_id = ? AND round_num = ? AND role = ? GROUP BY decision",
+            key,
+        ).fetchall())
+        return totals.get(1, 0), totals.get(2, 0)
+
+    def close(self, session_id, round_num, role):
+        """Close voting and return the final ``(pair 1, pair 2)`` counts.
+
+        The final counts are kept with the closed ballot, so judging the role
+        again (say, after the game's save conflicted) gets the same counts.
+        """
+        key = (session_id, round_num, role)
+        for shard in self._shards:
+            with shard.lock:
+                shard.voters.pop(key, None)
+                shard.closed[key] = True
+                while len(shard.closed) > self.MAX_CLOSED:
+                    shard.closed.popitem(last=False)
+        self.flush()
+
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            closed = conn.execute(
+                "SELECT pair_1, pair_2 FROM audience_closed WHERE session_id = ? AND round_num = ? AND role = ?",
+                key,
+            ).fetchone()
+            if closed is not None:
+                totals = tuple(closed)
+            else:
+                totals = self._counts(conn, key)
+                conn.execute("INSERT INTO audience_closed (session_id, round_num, role, closed_at, pair_1, pair_2) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", key + (now,) + totals)
+                conn.execute("DELETE FROM audience_votes WHERE session_id = ? AND round_num = ? AND role = ?", key)
+            # Votes for ballots never closed, and closed ballots too old to be voted in
+            cutoff = now - self.RETENTION
+            conn.execute("DELETE FROM audience_votes WHERE cast_at < ?", (cutoff,))
+            conn.execute("DELETE FROM audience_closed WHERE closed_at < ?", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return totals
+
+    def judge_vote(self, session_id, round_num, role):
+        """Close a role's voting and turn it into the Audience judge's ``(voter, decision)`` pair.
+
+        Returns None when the crowd didn't vote or split evenly.
+        """
+        pair_1, pair_2 = self.close(session_id, round_num, role)
+        if pair_1 == pair_2:
+            return None
+        return (AUDIENCE_JUDGE, 1 if pair_1 > pair_2 else 2)
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.pending.clear()
+                shard.voters.clear()
+                shard.closed.clear()
+        conn = self._connection()
+        conn.execute("DELETE FROM audience_votes")
+        conn.execute("DELETE FROM audience_closed")
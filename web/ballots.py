@@ -0,0 +1,213 @@
+"""
+Judge ballots for the Hustle n' Tussle web application.
+
+Instead of one operator entering every vote, each judge can vote from their
+own phone. A ballot is opened for one role of the current round with the
+judges expected to vote, a deadline and a quorum. Votes are collected in the
+SQLite file the games live in, so judges can reach any worker, and a judge
+may change their vote until the ballot closes.
+
+A ballot closes as soon as every judge has voted, or once the deadline has
+passed with at least a quorum of votes. Closing is claimed in the same
+transaction that checks the votes, so exactly one request gets to apply the
+votes to the game however many arrive at once.
+"""
+import json
+import time
+
+from web.game_store import SQLiteStore
+
+
+class BallotError(Exception):
+    """Raised when a vote or close can't be accepted in the ballot's current state."""
+
+
+class BallotBox(SQLiteStore):
+    """Ballots and votes stored in a SQLite file shared by all workers."""
+
+    GUEST_DECISIONS = (1, 2, 3, 4)  # Pair 1, pair 2, tie, no contest
+    CONTESTANT_DECISIONS = (1, 2)  # Contestant judges must pick a winner
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS ballot_rounds ("
+        " session_id TEXT NOT NULL,"
+        " round_num INTEGER NOT NULL,"
+        " role TEXT NOT NULL,"
+        " guests TEXT NOT NULL,"
+        " contestants TEXT NOT NULL,"
+        " quorum INTEGER NOT NULL,"
+        " deadline REAL NOT NULL,"
+        " state TEXT NOT NULL,"
+        " result TEXT,"
+        " PRIMARY KEY (session_id, round_num, role))",
+        "CREATE TABLE IF NOT EXISTS ballots ("
+        " session_id TEXT NOT NULL,"
+        " round_num INTEGER NOT NULL,"
+        " role TEXT NOT NULL,"
+        " judge TEXT NOT NULL,"
+        " decision INTEGER NOT NULL,"
+        " cast_at REAL NOT NULL,"
+        " PRIMARY KEY (session_id, round_num, role, judge)) WITHOUT ROWID",
+    )
+
+    def _transaction(self, work):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def open(self, session_id, round_num, role, guests, contestants, duration, quorum=None):
+        """Open (or reopen) a ballot; ``duration`` is seconds until the deadline."""
+        expected = len(guests) + len(contestants)
+        quorum = expected if quorum is None else max(1, min(quorum, expected))
+
+        def work(conn):
+            row = conn.execute(
+                "SELECT state FROM ballot_rounds WHERE session_id = ? AND round_num = ? AND role = ?",
+                (session_id, round_num, role),
+            ).fetchone()
+            if row and row[0] in ('closing', 'closed'):
+                raise BallotError(f"The {role} ballot for round {round_num} has already closed")
+            conn.execute(
+                "INSERT OR REPLACE INTO ballot_rounds "
+                "(session_id, round_num, role, guests, contestants, quorum, deadline, state) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'open')",
+                (session_id, round_num, role, json.dumps(list(guests)), json.dumps(list(contestants)),
+                 quorum, time.time() + duration),
+            )
+
+        self._transaction(work)
+        return self.status(session_id, round_num, role)
+
+    def cast(self, session_id, round_num, role, judge, decision):
+        """Record a judge's vote.
+
+        Returns the votes to apply if this vote completed the ballot (the
+        caller then owns applying them, see ``finish``), otherwise None.
+        """
+        def work(conn):
+            ballot = self._ballot(conn, session_id, round_num, role)
+            if ballot is None or ballot['state'] != 'open' or time.time() >= ballot['deadline']:
+                raise BallotError(f"The {role} ballot for round {round_num} is not open")
+            if judge in ballot['guests']:
+                allowed = self.GUEST_DECISIONS
+            elif judge in ballot['contestants']:
+                allowed = self.CONTESTANT_DECISIONS
+            else:
+                raise ValueError(f"{judge} is not judging this ballot")
+            if decision not in allowed:
+                raise ValueError(f"Invalid vote {decision!r} from {judge}")
+
+            conn.execute(
+                "INSERT OR REPLACE INTO ballots (session_id, round_num, role, judge, decision, cast_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, round_num, role, judge, decision, time.time()),
+            )
+            return self._claim(conn, ballot, force=False)
+
+        return self._transaction(work)
+
+    def close_if_due(self, session_id, round_num, role, force=False):
+        """Claim a ballot that is complete, past its deadline, or forced closed.
+
+        Returns the votes to apply, or None if the ballot stays open (or is
+        already closed). A ballot past its deadline without a quorum expires
+        and can be reopened.
+        """
+        def work(conn):
+            ballot = self._ballot(conn, session_id, round_num, role)
+            if ballot is None or ballot['state'] != 'open':
+                return None
+            return self._claim(conn, ballot, force)
+
+        return self._transaction(work)
+
+    def _claim(self, conn, ballot, force):
+        votes = self._votes(conn, ballot)
+        expected = len(ballot['guests']) + len(ballot['contestants'])
+        past_deadline = time.time() >= ballot['deadline']
+        if len(votes) < expected and not (force or past_deadline):
+            return None
+        key = (ballot['session_id'], ballot['round_num'], ballot['role'])
+        if len(votes) < ballot['quorum']:
+            if past_deadline:
+                conn.execute("UPDATE ballot_rounds SET state = 'expired' "
+                             "WHERE session_id = ? AND round_num = ? AND role = ?", key)
+            elif force:
+                raise BallotError(f"Only {len(votes)} of {ballot['quorum']} votes needed are in")
+            return None
+        conn.execute("UPDATE ballot_rounds SET state = 'closing' "
+                     "WHERE session_id = ? AND round_num = ? AND role = ?", key)
+        return votes
+
+    def finish(self, session_id, round_num, role, result):
+        """Mark a claimed ballot closed with the outcome of applying it."""
+        self._connection().execute(
+            "UPDATE ballot_rounds SET state = 'closed', result = ? "
+            "WHERE session_id = ? AND round_num = ? AND role = ?",
+            (json.dumps(result), session_id, round_num, role),
+        )
+
+    def release(self, session_id, round_num, role):
+        """Reopen a claimed ballot whose votes couldn't be applied, so it can be retried."""
+        self._connection().execute(
+            "UPDATE ballot_rounds SET state = 'open' "
+            "WHERE session_id = ? AND round_num = ? AND role = ? AND state = 'closing'",
+            (session_id, round_num, role),
+        )
+
+    def status(self, session_id, round_num, role):
+        """The ballot's state, who has voted (not how) and the result once closed."""
+        conn = self._connection()
+        ballot = self._ballot(conn, session_id, round_num, role)
+        if ballot is None:
+            return None
+        voted = [judge for judge, _ in self._votes(conn, ballot)]
+        return {
+            'round': round_num,
+            'role': role,
+            'state': ballot['state'],
+            'judges': ballot['guests'] + ballot['contestants'],
+            'voted': voted,
+            'quorum': ballot['quorum'],
+            'seconds_left': max(0.0, ballot['deadline'] - time.time()),
+            'result': ballot['result'],
+        }
+
+    def _ballot(self, conn, session_id, round_num, role):
+        row = conn.execute(
+            "SELECT guests, contestants, quorum, deadline, state, result FROM ballot_rounds "
+            "WHERE session_id = ? AND round_num = ? AND role = ?",
+            (session_id, round_num, role),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'session_id': session_id,
+            'round_num': round_num,
+            'role': role,
+            'guests': json.loads(row[0]),
+            'contestants': json.loads(row[1]),
+            'quorum': row[2],
+            'deadline': row[3],
+            'state': row[4],
+            'result': json.loads(row[5]) if row[5] else None,
+        }
+
+    def _votes(self, conn, ballot):
+        """Votes as ``(judge, decision)`` pairs, guests first, in the judges' order."""
+        cast = dict(conn.execute(
+            "SELECT judge, decision FROM ballots WHERE session_id = ? AND round_num = ? AND role = ?",
+            (ballot['session_id'], ballot['round_num'], ballot['role']),
+        ).fetchall())
+        return [(judge, cast[judge]) for judge in ballot['guests'] + ballot['contestants'] if judge in cast]
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM ballots")
+        conn.execute("DELETE FROM ballot_rounds")
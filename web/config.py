@@ -2,6 +2,7 @@
 Configuration settings for the Hustle n' Tussle web application.
 """
 import os
+import tempfile
 
 class Config:
     """Base configuration."""
@@ -12,6 +13,57 @@ class Config:
     DEBUG = True
     ENABLE_DEBUG_TOOLS = False  # Master switch for debug tools
     
+    # Game storage shared by all workers ('sqlite' or 'memory')
+    GAME_STORE_BACKEND = os.environ.get('GAME_STORE_BACKEND', 'sqlite')
+    GAME_STORE_PATH = os.environ.get(
+        'GAME_STORE_PATH', os.path.join(tempfile.gettempdir(), 'hustlentussle_games.sqlite3'))
+    GAME_CACHE_SIZE = int(os.environ.get('GAME_CACHE_SIZE', 128))  # Games kept in memory per worker
+    GAME_CACHE_TTL = int(os.environ.get('GAME_CACHE_TTL', 900))  # Seconds before an idle game is evicted
+    
+    # Monte Carlo simulations behind each live win probability projection
+    WIN_PROBABILITY_SIMULATIONS = int(os.environ.get('WIN_PROBABILITY_SIMULATIONS', 1000))
+    
+    # Live streams: how often to look for changes saved by other workers, and
+    # how long a quiet stream waits before sending a keepalive (seconds)
+    STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', 2))
+    STREAM_KEEPALIVE = float(os.environ.get('STREAM_KEEPALIVE', 15))
+    # Each open stream holds a worker thread; past this many per worker,
+    # screens are turned away rather than starving the judges' requests
+    STREAM_LIMIT = int(os.environ.get('STREAM_LIMIT', 8))
+    
+    # Judge ballots collected from phones live next to the games; a ballot
+    # closes early once every judge has voted
+    BALLOT_STORE_PATH = os.environ.get('BALLOT_STORE_PATH', GAME_STORE_PATH)
+    BALLOT_DEADLINE = float(os.environ.get('BALLOT_DEADLINE', 120))  # Seconds to vote
+    
+    # Audience votes are counted in memory across this many independently
+    # locked shards, and written in batches to a file of their own (not the
+    # games' file, so a crowd never competes with the judges for its lock)
+    AUDIENCE_SHARDS = int(os.environ.get('AUDIENCE_SHARDS', 16))
+    AUDIENCE_FLUSH_INTERVAL = float(os.environ.get('AUDIENCE_FLUSH_INTERVAL', 1))  # Seconds between batches
+    AUDIENCE_STORE_PATH = os.environ.get(
+        'AUDIENCE_STORE_PATH', os.path.splitext(GAME_STORE_PATH)[0] + '_audience.sqlite3')
+    
+    # Excel exports are built on a pool of background threads, and finished
+    # workbooks are kept per game state next to the games, for every worker
+    EXPORT_STORE_PATH = os.environ.get('EXPORT_STORE_PATH', GAME_STORE_PATH)
+    EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))
+    EXPORT_CACHE_SIZE = int(os.environ.get('EXPORT_CACHE_SIZE', 64))
+    
+    # Parsed battle file uploads, kept by content hash in memory and on disk
+    IMPORT_CACHE_DIR = os.environ.get(
+        'IMPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'hustlentussle_imports'))
+    IMPORT_CACHE_SIZE = int(os.environ.get('IMPORT_CACHE_SIZE', 32))  # Kept in memory per worker
+    IMPORT_CACHE_FILES = int(os.environ.get('IMPORT_CACHE_FILES', 256))  # Kept on disk
+    
+    # Spotify client credentials; 'stub' hands out local tokens without the network
+    SPOTIFY_BACKEND = os.environ.get('SPOTIFY_BACKEND', 'http')
+    SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID')
+    SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
+    TRACK_CACHE_SIZE = int(os.environ.get('TRACK_CACHE_SIZE', 2048))  # Tracks' metadata kept in memory
+    TRACK_CACHE_TTL = int(os.environ.get('TRACK_CACHE_TTL', 86400))  # Seconds before it's looked up again
+    TRACK_LOOKUP_LIMIT = 500  # Track IDs per /api/tracks request
+    
 
 class DevelopmentConfig(Config):
     """Development configuration."""
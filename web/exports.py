@@ -0,0 +1,380 @@
+"""
+Exports of battle results for the Hustle n' Tussle web application.
+
+``battle_export`` collects a battle's results and rounds as plain data, which
+is what the JSON export sends and what the Excel workbook is written from.
+
+Workbooks are written with openpyxl's write-only mode: each row is written
+once, in order, and streamed to the file instead of being kept as cell
+objects, so a battle with hundreds of rounds costs about as much memory as
+one with a handful. Winners are highlighted with a named style registered
+once per workbook rather than a new Font for every winning cell.
+"""
+import datetime
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, NamedStyle
+
+from web.game_store import SQLiteStore
+
+MEDALS = ["🥇", "🥈", "🥉"]
+WINNER_STYLE = "Round Winner"
+
+
+def battle_export(session_id, game, leads, follows, songs=None):
+    """The battle as exported: standings, rounds and the starting order.
+
+    ``leads`` and ``follows`` are the standings from ``game.finalize_results()``,
+    and ``songs`` optionally maps round numbers (as strings) to song details
+    to use in place of the stored ones. Call with the game locked; the result
+    can be used after it's released.
+    """
+    all_rounds = list(game.rounds)
+    if game.current_round not in game.rounds:
+        all_rounds.append(game.current_round)
+
+    def standings(contestants, last_winner):
+        return [{
+            'name': contestant.name,
+            'points': contestant.points,
+            'medal': MEDALS[idx] if idx < 3 else "",
+            'is_winner': last_winner == contestant.name,
+        } for idx, contestant in enumerate(contestants)]
+
+    rounds = [{
+        'round_num': r.round_num,
+        'session_id': session_id,
+        'pairs': r.pairs,
+        'lead_votes': dict(r.lead_votes),
+        'follow_votes': dict(r.follow_votes),
+        'judges': list(r.judges),
+        'contestant_judges': list(r.contestant_judges),
+        'win_messages': r.win_messages,
+        'lead_winner': r.lead_winner,
+        'follow_winner': r.follow_winner,
+        'song_info': dict(r.song_info) if r.song_info is not None else None,
+    } for r in all_rounds]
+    rounds.sort(key=lambda x: x['round_num'])
+    for round_data in rounds:
+        song = (songs or {}).get(str(round_data['round_num']))
+        if song:
+            round_data['song_info'] = {**(round_data['song_info'] or {}), **song}
+
+    return {
+        'session_id': session_id,
+        'seed': game.seed,
+        'leads': standings(leads, getattr(game, 'last_lead_winner', None)),
+        'follows': standings(follows, getattr(game, 'last_follow_winner', None)),
+        'rounds': rounds,
+        'initial_leads': [lead.name for lead in game.initial_leads],
+        'initial_follows': [follow.name for follow in game.initial_follows],
+        'total_rounds': len(all_rounds),
+    }
+
+
+def _judges(round_data):
+    judges = []
+    if 'judges' in round_data:
+        judges.extend(round_data['judges'])
+    if 'contestant_judges' in round_data:
+        judges.extend(round_data['contestant_judges'])
+    return judges
+
+
+def _vote_label(vote, first, second):
+    """A judge's vote as the contestant they picked, or the special outcome."""
+    if vote == 1:
+        return first
+    if vote == 2:
+        return second
+    if vote == 0:
+        return "Tie"
+    return "No Contest"
+
+
+def write_battle_workbook(out, session_id, leads, follows, rounds, initial_leads, initial_follows,
+                          total_rounds, now=None):
+    """Write the multi-sheet battle workbook to ``out`` (a path or binary file).
+
+    ``leads`` and ``follows`` are the final standings as exported to JSON
+    (name, points, is_winner), ``rounds`` the exported rounds sorted by
+    round number, and ``initial_leads``/``initial_follows`` the starting
+    order by name.
+    """
+    now = now or datetime.datetime.now()
+    wb = Workbook(write_only=True)
+    wb.add_named_style(NamedStyle(name=WINNER_STYLE, font=Font(color="FF0000")))
+
+    def cell(sheet, value, winner):
+        if not winner:
+            return value
+        styled = WriteOnlyCell(sheet, value=value)
+        styled.style = WINNER_STYLE
+        return styled
+
+    # Battle Summary
+    summary_sheet = wb.create_sheet("Battle Summary")
+    summary_sheet.append([f"Game ID: {session_id}"])
+    summary_sheet.append([])
+    summary_sheet.append(["Date:", now.strftime("%Y-%m-%d")])
+    summary_sheet.append(["Time:", now.strftime("%H:%M:%S")])
+    summary_sheet.append(["Total Rounds:", total_rounds])
+    summary_sheet.append([])
+    summary_sheet.append(["Initial Order"])
+    summary_sheet.append([])
+    summary_sheet.append(["Leads:"])
+    for i, name in enumerate(initial_leads, 1):
+        summary_sheet.append([f"{i}. {name}"])
+    summary_sheet.append([])
+    summary_sheet.append(["Follows:"])
+    for i, name in enumerate(initial_follows, 1):
+        summary_sheet.append([f"{i}. {name}"])
+    summary_sheet.append([])
+    summary_sheet.append(["Final Results"])
+    summary_sheet.append([])
+    for label, standings in (("Lead Winners:", leads), ("Follow Winners:", follows)):
+        if label == "Follow Winners:":
+            summary_sheet.append([])
+        summary_sheet.append([label])
+        for medal, contestant in zip(MEDALS, standings):
+            crown = " 👑" if contestant['is_winner'] else ""
+            summary_sheet.append([f"{medal} {contestant['name']}{crown}", f"{contestant['points']} points"])
+
+    # Leaderboards
+    for title, header, standings in (("Lead Leaderboard", "Lead", leads),
+                                     ("Follow Leaderboard", "Follow", follows)):
+        sheet = wb.create_sheet(title)
+        sheet.append([header, "Points"])
+        for contestant in standings:
+            sheet.append([contestant['name'], contestant['points']])
+
+    # Round History
+    round_sheet = wb.create_sheet("Round History")
+    max_judges_count = max((len(set(_judges(r))) for r in rounds), default=0)
+    headers = ["Round", "Lead 1", "Lead 2", "Follow 1", "Follow 2", "Song Title", "Artist", "Spotify Link"]
+    for i in range(max_judges_count):
+        headers.extend([f"Judge {i+1}", f"Lead Vote {i+1}", f"Follow Vote {i+1}"])
+    round_sheet.append(headers)
+    for round_data in rounds:
+        row = [round_data['round_num']]
+        if round_data.get('pairs'):
+            pairs = round_data['pairs']
+            lead1 = pairs.get('pair_1', {}).get('lead', '')
+            lead2 = pairs.get('pair_2', {}).get('lead', '')
+            follow1 = pairs.get('pair_1', {}).get('follow', '')
+            follow2 = pairs.get('pair_2', {}).get('follow', '')
+            lead_winner = round_data.get('lead_winner')
+            follow_winner = round_data.get('follow_winner')
+            row.extend([
+                cell(round_sheet, lead1, lead1 == lead_winner),
+                cell(round_sheet, lead2, lead2 == lead_winner),
+                cell(round_sheet, follow1, follow1 == follow_winner),
+                cell(round_sheet, follow2, follow2 == follow_winner),
+            ])
+            song_info = round_data.get('song_info')
+            if song_info:
+                row.extend([song_info.get('title', ''), song_info.get('artist', ''),
+                            song_info.get('spotify_url', '')])
+            else:
+                row.extend([None, None, None])
+
+            judges = _judges(round_data)
+            for judge_name in judges[:max_judges_count]:
+                if not judge_name:
+                    row.extend([None, None, None])
+                    continue
+                lead_vote = round_data['lead_votes'].get(judge_name, '')
+                follow_vote = round_data['follow_votes'].get(judge_name, '')
+                lead_pick = _vote_label(lead_vote, lead1, lead2)
+                follow_pick = _vote_label(follow_vote, follow1, follow2)
+                row.extend([
+                    judge_name,
+                    cell(round_sheet, lead_pick, lead_vote in (1, 2) and lead_pick == lead_winner),
+                    cell(round_sheet, follow_pick, follow_vote in (1, 2) and follow_pick == follow_winner),
+                ])
+        round_sheet.append(row)
+
+    # Voting History
+    voting_sheet = wb.create_sheet("Voting History")
+    voting_sheet.append(["Round", "Judge", "Lead Vote", "Follow Vote"])
+    for round_data in rounds:
+        if round_data.get('pairs'):
+            for judge in set(_judges(round_data)):
+                voting_sheet.append([
+                    round_data['round_num'],
+                    judge,
+                    round_data['lead_votes'].get(judge, ''),
+                    round_data['follow_votes'].get(judge, ''),
+                ])
+
+    wb.save(out)
+
+
+def export_job_id(session_id, version, songs=None):
+    """Name the workbook for a game state plus any song details sent by the client."""
+    digest = "game"
+    if songs:
+        encoded = json.dumps(songs, sort_keys=True).encode()
+        digest = hashlib.sha256(encoded).hexdigest()[:16]
+    return f"{session_id}-v{version}-{digest}"
+
+
+JOB_ID = re.compile(r'^(?P<session_id>\w+)-v(?P<version>\d+)-(?P<digest>[0-9a-f]{16}|game)$')
+
+
+def parse_export_job_id(job_id):
+    """The ``(session_id, version)`` a job ID from ``export_job_id`` names, or None."""
+    match = JOB_ID.match(job_id)
+    if match is None:
+        return None
+    return match['session_id'], int(match['version'])
+
+
+class ExportJobs(SQLiteStore):
+    """Excel workbooks built on a worker pool and kept in a SQLite file all workers share.
+
+    Job IDs come from ``export_job_id``, so a job names exactly one game
+    state and workbooks never need invalidating: downloading the same
+    battle again is served from the store, and a changed game gets a new ID.
+    A job's song details are stored when it is submitted, so whichever
+    worker is polled can report on it, and can start it again if the worker
+    building it has gone (see ``songs``).
+    """
+
+    STALLED_AFTER = 60  # Seconds a build may go without finishing before another worker takes over
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS export_jobs ("
+        " job_id TEXT PRIMARY KEY,"
+        " songs TEXT NOT NULL,"
+        " state TEXT NOT NULL,"
+        " error TEXT,"
+        " workbook BLOB,"
+        " updated_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path, workers=2, max_entries=64):
+        super().__init__(path)
+        self._max_entries = max_entries
+        self._pending = {}  # job_id -> Future, for the builds running in this worker
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+
+    def submit(self, job_id, prepare, songs=None):
+        """Start building ``job_id`` unless it is built or building; returns its status.
+
+        ``prepare`` is called (with the game's lock held by the caller) only
+        when a build has to start, and returns the export to write, as from
+        ``battle_export``. ``songs`` are the song details it was asked with.
+        """
+        with self._lock:
+            if job_id in self._pending:
+                return 'pending'
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT state, updated_at FROM export_jobs WHERE job_id = ?",
+                                   (job_id,)).fetchone()
+                now = time.time()
+                if row and row[0] == 'ready':
+                    # Keep recently downloaded workbooks from being pruned
+                    conn.execute("UPDATE export_jobs SET updated_at = ? WHERE job_id = ?", (now, job_id))
+                    conn.execute("COMMIT")
+                    return 'ready'
+                if row and row[0] == 'pending' and now - row[1] < self.STALLED_AFTER:
+                    conn.execute("COMMIT")
+                    return 'pending'
+                conn.execute(
+                    "INSERT OR REPLACE INTO export_jobs (job_id, songs, state, updated_at) "
+                    "VALUES (?, ?, 'pending', ?)",
+                    (job_id, json.dumps(songs or {}), now),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            future = self._executor.submit(self.build, prepare())
+            self._pending[job_id] = future
+        future.add_done_callback(lambda done: self._finish(job_id, done))
+        return 'pending'
+
+    @staticmethod
+    def build(export):
+        """Write the workbook for an export from ``battle_export`` and return its bytes."""
+        out = io.BytesIO()
+        write_battle_workbook(
+            out, export['session_id'], export['leads'], export['follows'], export['rounds'],
+            export['initial_leads'], export['initial_follows'], export['total_rounds'],
+        )
+        return out.getvalue()
+
+    def _finish(self, job_id, future):
+        error = future.exception()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if error is not None:
+                conn.execute("UPDATE export_jobs SET state = 'failed', error = ?, updated_at = ? "
+                             "WHERE job_id = ?", (str(error), time.time(), job_id))
+            else:
+                conn.execute("UPDATE export_jobs SET state = 'ready', workbook = ?, updated_at = ? "
+                             "WHERE job_id = ?", (future.result(), time.time(), job_id))
+            # Keep the most recently used finished jobs
+            conn.execute(
+                "DELETE FROM export_jobs WHERE state != 'pending' AND job_id NOT IN ("
+                " SELECT job_id FROM export_jobs WHERE state != 'pending'"
+                " ORDER BY updated_at DESC LIMIT ?)",
+                (self._max_entries,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+
+    def status(self, job_id):
+        """'ready', 'pending', 'failed', 'stalled' (the worker building it has gone), or None."""
+        with self._lock:
+            if job_id in self._pending:
+                return 'pending'
+        row = self._connection().execute(
+            "SELECT state, updated_at FROM export_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row[0] == 'pending' and time.time() - row[1] >= self.STALLED_AFTER:
+            return 'stalled'
+        return row[0]
+
+    def songs(self, job_id):
+        """The song details a job was submitted with, or None if no worker was asked for it."""
+        row = self._connection().execute(
+            "SELECT songs FROM export_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def result(self, job_id):
+        """The finished workbook's bytes, or None."""
+        row = self._connection().execute(
+            "SELECT workbook FROM export_jobs WHERE job_id = ? AND state = 'ready'", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def wait(self, timeout=None):
+        """Block until the builds in progress in this worker have finished and been stored."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return
+            time.sleep(0.01)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM export_jobs")
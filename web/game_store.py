@@ -0,0 +1,418 @@
+"""
+Game storage for the Hustle n' Tussle web application.
+
+Gunicorn runs several worker processes, so battles can't live in a plain
+module-level dict: a judge's request may land on a worker that never saw the
+game start. The GameStore keeps recently used games in an in-process LRU cache
+in front of a durable backend that every worker shares.
+
+The cache is bounded by size and idle time, and finished games are spilled to
+the backend straight away, so a worker's memory stays flat however many
+battles it has served. Evicted games are rehydrated on their next request.
+
+The SQLite backend stores each game as its event log plus the latest snapshot
+(see ``Game.events``), so saving a game appends the few events added since it
+was loaded instead of rewriting the whole battle.
+
+Session IDs are allocated atomically by the backend, and updates go through
+``GameStore.session``, which serializes requests for the same game within a
+worker and rejects stale writes from other workers.
+"""
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from game_logic import Game
+
+
+class GameConflictError(Exception):
+    """Raised when a game was changed by another worker while being updated."""
+
+
+class MemoryBackend:
+    """Process-local backend. Only suitable for a single worker (tests, dev)."""
+
+    def __init__(self):
+        self._games = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def allocate_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def version(self, session_id):
+        entry = self._games.get(session_id)
+        return entry[0] if entry else None
+
+    def load(self, session_id):
+        return self._games.get(session_id)
+
+    def save(self, session_id, game, expected_version=None):
+        with self._lock:
+            entry = self._games.get(session_id)
+            if expected_version is not None and (not entry or entry[0] != expected_version):
+                raise GameConflictError(session_id)
+            version = entry[0] + 1 if entry else 1
+            self._games[session_id] = (version, game)
+            return version
+
+    def delete(self, session_id):
+        with self._lock:
+            self._games.pop(session_id, None)
+
+    def count(self):
+        return len(self._games)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+
+class SQLiteStore:
+    """Base for stores kept in a SQLite file in WAL mode, shared by all workers.
+
+    Subclasses list their ``CREATE ... IF NOT EXISTS`` statements in
+    ``SCHEMA``. Each thread gets its own connection, in autocommit mode so
+    transactions are started explicitly.
+    """
+
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Create the schema with a throwaway connection so no connection is
+        # inherited by the workers if the app is imported before forking
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteBackend(SQLiteStore):
+    """Durable backend shared by all workers through a SQLite file in WAL mode.
+
+    A game's version is the length of its event log, so a save only has to
+    append the events past the stored version, and fails if another worker
+    appended first. Once ``SNAPSHOT_EVENTS`` events have been saved since the
+    last snapshot, a save stores a new one, so loading replays at most that many.
+    """
+
+    SNAPSHOT_EVENTS = 50
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS game_heads ("
+        " session_id TEXT PRIMARY KEY,"
+        " version INTEGER NOT NULL,"
+        " snapshot_seq INTEGER,"
+        " snapshot BLOB)",
+        "CREATE TABLE IF NOT EXISTS game_events ("
+        " session_id TEXT NOT NULL,"
+        " seq INTEGER NOT NULL,"
+        " event TEXT NOT NULL,"
+        " PRIMARY KEY (session_id, seq)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS session_ids ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT)",
+    )
+
+    def allocate_id(self):
+        # AUTOINCREMENT never hands out the same number twice, even across
+        # workers or after games have been deleted
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            new_id = conn.execute("INSERT INTO session_ids DEFAULT VALUES").lastrowid
+            conn.execute("DELETE FROM session_ids WHERE id < ?", (new_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return new_id
+
+    def version(self, session_id):
+        row = self._connection().execute(
+            "SELECT version FROM game_heads WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id):
+        conn = self._connection()
+        # Read the head and its events in one transaction so they agree
+        conn.execute("BEGIN")
+        try:
+            head = conn.execute(
+                "SELECT version, snapshot_seq, snapshot FROM game_heads WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if head is None:
+                return None
+            events = [json.loads(row[0]) for row in conn.execute(
+                "SELECT event FROM game_events WHERE session_id = ? AND seq < ? ORDER BY seq",
+                (session_id, head[0]),
+            )]
+        finally:
+            conn.execute("COMMIT")
+
+        version, snapshot_seq, snapshot = head
+        return version, Game.from_events(events, (snapshot_seq, snapshot) if snapshot else None)
+
+    def save(self, session_id, game, expected_version=None):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            head = conn.execute(
+                "SELECT version, snapshot_seq FROM game_heads WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            stored_version, stored_snapshot_seq = head if head else (0, None)
+            if expected_version is not None and (head is None or stored_version != expected_version):
+                raise GameConflictError(session_id)
+            if game.version < stored_version:
+                # An older copy of the game; saving it would drop events
+                raise GameConflictError(session_id)
+
+            conn.executemany(
+                "INSERT INTO game_events (session_id, seq, event) VALUES (?, ?, ?)",
+                ((session_id, seq, json.dumps(game.events[seq]))
+                 for seq in range(stored_version, game.version)),
+            )
+            if game.version - (stored_snapshot_seq or 0) >= self.SNAPSHOT_EVENTS:
+                snapshot_seq, snapshot_data = game.take_snapshot()
+            else:
+                snapshot_seq, snapshot_data = stored_snapshot_seq, None
+            conn.execute(
+                "INSERT INTO game_heads (session_id, version, snapshot_seq, snapshot) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, "
+                "snapshot_seq = excluded.snapshot_seq, "
+                "snapshot = COALESCE(excluded.snapshot, game_heads.snapshot)",
+                (session_id, game.version, snapshot_seq, snapshot_data),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return game.version
+
+    def delete(self, session_id):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM game_events WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM game_heads WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM game_heads").fetchone()[0]
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM game_events")
+            conn.execute("DELETE FROM game_heads")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class GameStore:
+    """Dict-like registry of games: an LRU cache over a shared backend.
+
+    The cache is only trusted while its version matches the backend, so a game
+    updated by another worker is reloaded on the next lookup. Callers must
+    store a game again (``games[session_id] = game``) after mutating it.
+
+    Games idle for longer than ``ttl`` seconds are dropped from the cache, and
+    finished games are not cached at all once they have been saved.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, backend, cache_size=128, ttl=None):
+        self._backend = backend
+        self._cache_size = cache_size
+        self._ttl = ttl
+        self._cache = OrderedDict()  # session_id -> (version, game, last_used)
+        self._lock = threading.Lock()
+        # Striped locks keep memory bounded while rarely making two sessions wait on each other
+        self._session_locks = [threading.RLock() for _ in range(self.LOCK_STRIPES)]
+        self._save_listeners = []
+
+    def on_save(self, callback):
+        """Call ``callback(session_id)`` after every successful save."""
+        self._save_listeners.append(callback)
+
+    def allocate_id(self):
+        """Return a session ID no other request or worker will be given."""
+        return f"game_{self._backend.allocate_id()}"
+
+    @contextmanager
+    def session(self, session_id):
+        """Lock a game for a read-modify-write and save it afterwards.
+
+        Yields None if the game doesn't exist. The game is only saved if the
+        block exits normally; if it raises, the cached copy is dropped so the
+        next lookup reloads the last saved state. GameConflictError is raised
+        if another worker saved the game in the meantime.
+        """
+        lock = self._session_locks[hash(session_id) % self.LOCK_STRIPES]
+        with lock:
+            entry = self._get_entry(session_id)
+            if entry is None:
+                yield None
+                return
+            version, game = entry
+            try:
+                yield game
+            except BaseException:
+                # The game may be half-updated; reload the saved copy next time
+                self._discard(session_id)
+                raise
+            self.save(session_id, game, expected_version=version)
+
+    @contextmanager
+    def read(self, session_id):
+        """Lock a game for reading without saving it; yields None if it doesn't exist."""
+        with self._session_locks[hash(session_id) % self.LOCK_STRIPES]:
+            entry = self._get_entry(session_id)
+            yield entry[1] if entry else None
+
+    def version(self, session_id):
+        """The stored version of a game, or None if it doesn't exist."""
+        if not session_id:
+            return None
+        return self._backend.version(session_id)
+
+    def get(self, session_id, default=None):
+        entry = self._get_entry(session_id)
+        return entry[1] if entry else default
+
+    def _get_entry(self, session_id):
+        if not session_id:
+            return None
+
+        version = self._backend.version(session_id)
+        if version is None:
+            self._discard(session_id)
+            return None
+
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry and entry[0] == version:
+                self._cache[session_id] = (version, entry[1], time.monotonic())
+                self._cache.move_to_end(session_id)
+                self._evict()
+                return version, entry[1]
+
+        loaded = self._backend.load(session_id)
+        if loaded is None:
+            return None
+        self._remember(session_id, *loaded)
+        return loaded
+
+    def save(self, session_id, game, expected_version=None):
+        try:
+            version = self._backend.save(session_id, game, expected_version)
+        except GameConflictError:
+            # Our copy is stale; make sure the next lookup reloads it
+            self._discard(session_id)
+            raise
+        if game.is_finished():
+            # Finished games are rarely touched again; keep them on disk only
+            self._discard(session_id)
+        else:
+            self._remember(session_id, version, game)
+        for callback in self._save_listeners:
+            callback(session_id)
+        return version
+
+    def _remember(self, session_id, version, game):
+        with self._lock:
+            self._cache[session_id] = (version, game, time.monotonic())
+            self._cache.move_to_end(session_id)
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used games over the size limit or past the TTL.
+
+        Must be called with the lock held. The cache is ordered by last use,
+        so only the oldest entries ever need to be looked at.
+        """
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        if self._ttl is not None:
+            cutoff = time.monotonic() - self._ttl
+            while self._cache and next(iter(self._cache.values()))[2] < cutoff:
+                self._cache.popitem(last=False)
+
+    def evict_idle(self):
+        """Drop idle games from the cache; returns how many are still cached."""
+        with self._lock:
+            self._evict()
+            return len(self._cache)
+
+    def _discard(self, session_id):
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def clear(self):
+        self._backend.clear()
+        with self._lock:
+            self._cache.clear()
+
+    def __getitem__(self, session_id):
+        game = self.get(session_id)
+        if game is None:
+            raise KeyError(session_id)
+        return game
+
+    def __setitem__(self, session_id, game):
+        self.save(session_id, game)
+
+    def __delitem__(self, session_id):
+        self._backend.delete(session_id)
+        self._discard(session_id)
+
+    def __contains__(self, session_id):
+        return bool(session_id) and self._backend.version(session_id) is not None
+
+    def __len__(self):
+        return self._backend.count()
+
+
+def create_game_store(config):
+    """Build the game store described by the app configuration."""
+    if config.GAME_STORE_BACKEND == 'memory':
+        backend = MemoryBackend()
+    elif config.GAME_STORE_BACKEND == 'sqlite':
+        backend = SQLiteBackend(config.GAME_STORE_PATH)
+    else:
+        raise ValueError(f"Unknown game store backend: {config.GAME_STORE_BACKEND}")
+    return GameStore(backend, cache_size=config.GAME_CACHE_SIZE, ttl=config.GAME_CACHE_TTL)
@@ -0,0 +1,312 @@
+"""
+Import of exported battle files for the Hustle n' Tussle web application.
+
+Uploads are parsed straight from the request stream with openpyxl's
+read-only mode: rows are read once, in order, as they are decompressed,
+instead of building the whole workbook as cell objects, and styles are only
+looked at for the contestant cells, where a red font marks the round winner.
+
+The same history files get uploaded again and again, so parsed results are
+kept by the SHA-256 of the file's contents (``ImportCache``), and a repeat
+upload is answered without opening the workbook at all.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from openpyxl import load_workbook
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+# Part of every cache key: bump it when parse_battle_workbook's output changes
+PARSER_VERSION = 1
+
+
+def _is_red(cell):
+    font = getattr(cell, 'font', None)
+    rgb = font.color.rgb if font is not None and font.color is not None else None
+    # Colors are stored as ARGB ("00FF0000"), though other tools may write RGB
+    return isinstance(rgb, str) and rgb[-6:].upper() == "FF0000"
+
+
+def _rows(sheet, **kwargs):
+    # Trust the rows in the file rather than the recorded sheet size, which
+    # other spreadsheet tools don't always keep up to date
+    sheet.reset_dimensions()
+    return sheet.iter_rows(**kwargs)
+
+
+def _read_summary(sheet):
+    """Date, time, round count, starting order and crowned winners from the Battle Summary."""
+    rows = [row for row in _rows(sheet, max_col=2, values_only=True)]
+    max_row = len(rows)
+
+    def cell(row, column=0):
+        return rows[row - 1][column] if row <= max_row else None
+
+    summary = {
+        'date': cell(3, 1),
+        'time': cell(4, 1),
+        'total_rounds': cell(5, 1) if max_row >= 5 else 0,
+    }
+
+    initial_leads = []
+    initial_follows = []
+
+    # Find the "Initial Order" section
+    current_row = 7
+    found_initial_order = False
+    while current_row < max_row:
+        if cell(current_row) == "Initial Order":
+            found_initial_order = True
+            current_row += 2  # Skip the header and move to content
+            break
+        current_row += 1
+
+    if found_initial_order:
+        while current_row < max_row:
+            value = cell(current_row)
+            if value in ("Leads:", "Follows:"):
+                names, end = (initial_leads, "Follows:") if value == "Leads:" else (initial_follows, "Final Results")
+                current_row += 1
+                while current_row < max_row:
+                    entry = cell(current_row)
+                    if not entry or entry == end:
+                        break
+                    # Extract name from "1. Name" format
+                    if isinstance(entry, str) and '. ' in entry:
+                        names.append(entry.split('. ', 1)[1])
+                    current_row += 1
+            elif value == "Final Results":
+                break
+            current_row += 1
+
+    # The top three of each role, with a crown on the battle's winner
+    crowned = {'leads': set(), 'follows': set()}
+    for role, label in (('leads', "Lead Winners:"), ('follows', "Follow Winners:")):
+        start = next((i for i in range(current_row, max_row + 1) if cell(i) == label), None)
+        if start is None:
+            continue
+        for row in range(start + 1, min(start + 4, max_row + 1)):
+            name_text = cell(row)
+            if not isinstance(name_text, str) or not name_text:
+                break
+            if "👑" in name_text:
+                medal = name_text.split(' ')[0]
+                medal = medal if medal in MEDALS else ""
+                crowned[role].add(name_text.replace(medal, '').replace("👑", '').strip())
+
+    return summary, initial_leads, initial_follows, crowned
+
+
+def _read_rounds(sheet, all_contestants):
+    """Rounds from the Round History, scoring a point for each round winner."""
+    rounds = []
+    for row in _rows(sheet, min_row=2):
+        values = [cell.value for cell in row]
+        if not values or not values[0]:
+            continue
+        round_num = values[0]
+
+        def value(column):
+            return values[column - 1] if column <= len(values) else None
+
+        lead1, lead2, follow1, follow2 = value(2), value(3), value(4), value(5)
+
+        # Initialize contestants if they don't exist yet
+        for lead in [lead1, lead2]:
+            if lead and lead not in all_contestants['leads']:
+                all_contestants['leads'][lead] = {'name': lead, 'points': 0, 'is_winner': False}
+        for follow in [follow1, follow2]:
+            if follow and follow not in all_contestants['follows']:
+                all_contestants['follows'][follow] = {'name': follow, 'points': 0, 'is_winner': False}
+
+        round_data = {
+            'round_num': round_num,
+            'pairs': {
+                'pair_1': {'lead': lead1, 'follow': follow1},
+                'pair_2': {'lead': lead2, 'follow': follow2},
+            },
+            'lead_votes': {},
+            'follow_votes': {},
+        }
+
+        song_title, artist, spotify_url = value(6), value(7), value(8)
+        if song_title or artist or spotify_url:
+            round_data['song_info'] = {
+                'title': song_title or '',
+                'artist': artist or '',
+                'spotify_url': spotify_url or '',
+            }
+
+        # Winners are in red; award each a point
+        for role, key, columns in (('leads', 'lead_winner', (2, 3)), ('follows', 'follow_winner', (4, 5))):
+            for column in columns:
+                if column <= len(row) and _is_red(row[column - 1]):
+                    winner = row[column - 1].value
+                    round_data[key] = winner
+                    if winner and winner in all_contestants[role]:
+                        all_contestants[role][winner]['points'] += 1
+
+        # Judge votes, three columns per judge after the song info (6-8)
+        for judge_col in range(9, len(values) + 1, 3):
+            judge_name = value(judge_col)
+            if judge_name:
+                lead_vote = value(judge_col + 1)
+                follow_vote = value(judge_col + 2)
+                if lead_vote:
+                    round_data['lead_votes'][judge_name] = lead_vote
+                if follow_vote:
+                    round_data['follow_votes'][judge_name] = follow_vote
+
+        rounds.append(round_data)
+    return rounds
+
+
+def _read_leaderboard(sheet, contestants):
+    standings = []
+    for name, points_cell in _rows(sheet, min_row=2, max_col=2, values_only=True):
+        if not name:
+            continue
+        points = 0
+        if isinstance(points_cell, (int, float)):
+            points = int(points_cell)
+        elif isinstance(points_cell, str) and points_cell.isdigit():
+            points = int(points_cell)
+
+        is_winner = contestants[name]['is_winner'] if name in contestants else False
+        standings.append({'name': name, 'points': points, 'is_winner': is_winner})
+
+        if name in contestants:
+            contestants[name]['points'] = max(contestants[name]['points'], points)
+    return standings
+
+
+def parse_battle_workbook(file):
+    """Read an exported battle workbook (a path or binary file) into the data shown for it."""
+    wb = load_workbook(file, read_only=True)
+    try:
+        data = {}
+        all_contestants = {'leads': {}, 'follows': {}}
+        crowned = {'leads': set(), 'follows': set()}
+
+        if "Battle Summary" in wb.sheetnames:
+            summary, initial_leads, initial_follows, crowned = _read_summary(wb["Battle Summary"])
+            data['initial_leads'] = initial_leads
+            data['initial_follows'] = initial_follows
+            data['summary'] = summary
+
+        if "Round History" in wb.sheetnames:
+            data['rounds'] = _read_rounds(wb["Round History"], all_contestants)
+
+        for role in ('leads', 'follows'):
+            for name in crowned[role]:
+                if name in all_contestants[role]:
+                    all_contestants[role][name]['is_winner'] = True
+
+        if "Lead Leaderboard" in wb.sheetnames:
+            data['all_leads'] = _read_leaderboard(wb["Lead Leaderboard"], all_contestants['leads'])
+        if "Follow Leaderboard" in wb.sheetnames:
+            data['all_follows'] = _read_leaderboard(wb["Follow Leaderboard"], all_contestants['follows'])
+    finally:
+        wb.close()
+
+    # Standings by points, with medals for the top three
+    for role in ('leads', 'follows'):
+        standings = sorted(all_contestants[role].values(), key=lambda x: x['points'], reverse=True)
+        for contestant, medal in zip(standings, MEDALS):
+            contestant['medal'] = medal
+        data[role] = standings
+    return data
+
+
+def content_hash(file, chunk_size=1 << 16):
+    """SHA-256 of a binary file's contents (plus the parser version), leaving it rewound."""
+    digest = hashlib.sha256(f"battle-import-{PARSER_VERSION}:".encode())
+    file.seek(0)
+    for chunk in iter(lambda: file.read(chunk_size), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class ImportCache:
+    """Parsed uploads by content hash: an LRU in memory over files on disk.
+
+    Entries are the serialized responses, stored as bytes, so a hit is
+    returned as is. The memory LRU holds ``max_entries``; the directory keeps
+    the ``max_files`` most recently used, is shared by all workers and
+    survives restarts.
+    """
+
+    def __init__(self, directory, max_entries=32, max_files=256):
+        self.directory = directory
+        self._max_entries = max_entries
+        self._max_files = max_files
+        self._entries = OrderedDict()  # digest -> bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest):
+        with self._lock:
+            body = self._entries.get(digest)
+            if body is not None:
+                self._entries.move_to_end(digest)
+                return body
+        try:
+            with open(self._path(digest), 'rb') as f:
+                body = f.read()
+            os.utime(self._path(digest))  # Keep recently used files from being pruned
+        except OSError:
+            return None
+        self._remember(digest, body)
+        return body
+
+    def put(self, digest, body):
+        self._remember(digest, body)
+        # Write then rename so other workers never read a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(temp_path, self._path(digest))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._prune()
+
+    def _remember(self, digest, body):
+        with self._lock:
+            self._entries[digest] = body
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                files = [(entry.stat().st_mtime, entry.path) for entry in entries
+                         if entry.name.endswith('.json')]
+        except OSError:
+            return
+        if len(files) <= self._max_files:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self._max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Already pruned by another worker
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
@@ -8,6 +8,7 @@ let currentLeads = []; // Store current lead contestants with points
 let currentFollows = []; // Store current follow contestants with points
 let initialLeads = []; // Store initial order of leads
 let initialFollows = []; // Store initial order of follows
+let battleStream = null; // Live updates for the current battle
 
 // DOM Elements (initialized in the DOMContentLoaded event)
 let homeScreen, uploadScreen, setupScreen, roundScreen, resultsScreen;
@@ -20,7 +21,7 @@ let leadVotingSection, followVotingSection, leadJudgesContainer, followJudgesCon
 let leadResults, followResults, leadWinner, followWinner;
 let leadGuestVotes, leadContestantVotes, followGuestVotes, followContestantVotes;
 let determineLeadWinnerBtn, determineFollowWinnerBtn;
-let roundResultsSection, winMessages, nextRoundBtn, endBattleBtn;
+let roundResultsSection, winMessages, onDeck, nextRoundBtn, endBattleBtn;
 let leadsLeaderboard, followsLeaderboard;
 let backToHomeFromResultsBtn, downloadBattleDataBtn;
 
@@ -82,6 +83,7 @@ document.addEventListener('DOMContentLoaded', () => {
 // Results elements
     roundResultsSection = document.getElementById('round-results');
     winMessages = document.getElementById('win-messages');
+    onDeck = document.getElementById('on-deck');
     nextRoundBtn = document.getElementById('next-round');
     endBattleBtn = document.getElementById('end-battle');
     leadsLeaderboard = document.getElementById('leads-leaderboard');
@@ -301,8 +303,12 @@ async function startCompetition() {
         // Update session ID display
         updateSessionIdDisplay();
         
-        // Get initial scores
-        await fetchScores();
+        // Follow live updates, which start with the initial scores
+        if (window.EventSource) {
+            subscribeToBattle();
+        } else {
+            await fetchScores();
+        }
         
         // Update UI with initial round data
         updateRoundUI(data);
@@ -316,6 +322,33 @@ async function startCompetition() {
     }
 }
 
+// Keep the score table current from the server's live stream, so screens
+// can follow a battle without polling
+function subscribeToBattle() {
+    closeBattleStream();
+    battleStream = new EventSource(`/api/stream?session_id=${sessionId}`);
+    battleStream.addEventListener('scores', event => {
+        const scores = JSON.parse(event.data);
+        updateScoreTable(scores.leads, scores.follows);
+    });
+    battleStream.addEventListener('end', closeBattleStream);
+    battleStream.onerror = () => {
+        // A server with no room for another stream refuses it for good;
+        // the scores then come with each round's response instead
+        if (battleStream && battleStream.readyState === EventSource.CLOSED) {
+            closeBattleStream();
+            fetchScores();
+        }
+    };
+}
+
+function closeBattleStream() {
+    if (battleStream) {
+        battleStream.close();
+        battleStream = null;
+    }
+}
+
 function fetchScores() {
     fetch(`/api/get_scores?session_id=${sessionId}`)
         .then(response => response.json())
@@ -369,6 +402,7 @@ function updateRoundUI(data) {
     followResults.classList.add('hidden');
     roundResultsSection.classList.add('hidden');
     winMessages.innerHTML = '';
+    onDeck.classList.add('hidden');
     
     // Reset collected votes
     leadVotes = {};
@@ -572,12 +606,13 @@ async function submitLeadVotes() {
     determineLeadWinnerBtn.disabled = true;
     
     try {
-        const response = await fetch('/api/judge_leads', {
+        // One request judges the leads and returns the updated scores
+        const response = await fetch('/api/submit_round', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 session_id: sessionId,
-                votes: votesArray,
+                lead_votes: votesArray,
                 song_info: songInfo
             })
         });
@@ -585,9 +620,9 @@ async function submitLeadVotes() {
         const data = await response.json();
         
         // Update results UI
-        leadWinner.textContent = data.winner;
-        leadGuestVotes.textContent = data.guest_votes.join(', ') || 'None';
-        leadContestantVotes.textContent = data.contestant_votes.join(', ') || 'None';
+        leadWinner.textContent = data.lead.winner;
+        leadGuestVotes.textContent = data.lead.guest_votes.join(', ') || 'None';
+        leadContestantVotes.textContent = data.lead.contestant_votes.join(', ') || 'None';
         
         leadResults.classList.remove('hidden');
         
@@ -595,7 +630,7 @@ async function submitLeadVotes() {
         followVotingSection.classList.remove('hidden');
         
         // Update scores after voting
-        await fetchScores();
+        updateScoreTable(data.scores.leads, data.scores.follows);
     } catch (error) {
         console.error('Error submitting lead votes:', error);
         alert('Failed to submit lead votes. Please try again.');
@@ -625,21 +660,22 @@ async function submitFollowVotes() {
     determineFollowWinnerBtn.disabled = true;
     
     try {
-        const response = await fetch('/api/judge_follows', {
+        // One request judges the follows, checks for a win and returns the updated scores
+        const response = await fetch('/api/submit_round', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 session_id: sessionId,
-                votes: votesArray
+                follow_votes: votesArray
             })
         });
         
         const data = await response.json();
         
         // Update results UI
-        followWinner.textContent = data.winner;
-        followGuestVotes.textContent = data.guest_votes.join(', ') || 'None';
-        followContestantVotes.textContent = data.contestant_votes.join(', ') || 'None';
+        followWinner.textContent = data.follow.winner;
+        followGuestVotes.textContent = data.follow.guest_votes.join(', ') || 'None';
+        followContestantVotes.textContent = data.follow.contestant_votes.join(', ') || 'None';
         
         followResults.classList.remove('hidden');
         
@@ -648,6 +684,13 @@ async function submitFollowVotes() {
             winMessages.innerHTML = data.win_messages.map(msg => `<p>${msg}</p>`).join('');
         }
         
+        // Show who dances next round
+        if (data.next_pairs) {
+            const { pair_1, pair_2 } = data.next_pairs;
+            onDeck.textContent = `On deck: ${pair_1[0]} & ${pair_1[1]} vs ${pair_2[0]} & ${pair_2[1]}`;
+            onDeck.classList.remove('hidden');
+        }
+        
         // Show round results section
         roundResultsSection.classList.remove('hidden');
         
@@ -657,7 +700,7 @@ async function submitFollowVotes() {
         }
         
         // Update scores after voting
-        await fetchScores();
+        updateScoreTable(data.scores.leads, data.scores.follows);
     } catch (error) {
         console.error('Error submitting follow votes:', error);
         alert('Failed to submit follow votes. Please try again.');
@@ -699,6 +742,8 @@ function resetAndGoHome() {
 }
 
 function resetCompetition() {
+    closeBattleStream();
+    
     // Reset global variables
     sessionId = null;
     guestJudges = [];
@@ -856,51 +901,7 @@ async function displayResults(data) {
     
     // Fetch Spotify metadata for all rounds if available
     if (data.rounds && data.rounds.length > 0) {
-        try {
-            const access_token = await getSpotifyToken();
-            
-            // Fetch metadata for all rounds in parallel
-            await Promise.all(data.rounds.map(async (round) => {
-                if (round.song_info && round.song_info.spotify_url) {
-                    try {
-                        const spotifyUrl = new URL(round.song_info.spotify_url);
-                        const trackId = spotifyUrl.pathname.split('/').pop();
-                        
-                        if (trackId) {
-                            const metadataResponse = await fetch(`https://api.spotify.com/v1/tracks/${trackId}`, {
-                                headers: {
-                                    'Authorization': `Bearer ${access_token}`
-                                }
-                            });
-                            
-                            if (metadataResponse.status === 401) {
-                                // Token expired, get a new one and retry
-                                const newToken = await getSpotifyToken();
-                                const retryResponse = await fetch(`https://api.spotify.com/v1/tracks/${trackId}`, {
-                                    headers: {
-                                        'Authorization': `Bearer ${newToken}`
-                                    }
-                                });
-                                
-                                if (retryResponse.ok) {
-                                    const metadata = await retryResponse.json();
-                                    round.song_info.title = metadata.name;
-                                    round.song_info.artist = metadata.artists.map(artist => artist.name).join(', ');
-                                }
-                            } else if (metadataResponse.ok) {
-                                const metadata = await metadataResponse.json();
-                                round.song_info.title = metadata.name;
-                                round.song_info.artist = metadata.artists.map(artist => artist.name).join(', ');
-                            }
-                        }
-                    } catch (e) {
-                        console.error(`Error fetching metadata for ${round.song_info.spotify_url}:`, e);
-                    }
-                }
-            }));
-        } catch (error) {
-            console.error('Error fetching Spotify metadata:', error);
-        }
+        await fillSongMetadata(data.rounds);
         
         // Display round history with the updated metadata
         displayRoundHistory(data.rounds);
@@ -1137,20 +1138,81 @@ function getFollowVoteText(vote, round) {
     }
 }
 
-async function getSpotifyToken() {
+// Fill in each round's song title and artist with one request for all the tracks
+async function fillSongMetadata(rounds) {
+    const trackIds = {};
+    rounds.forEach(round => {
+        if (round.song_info && round.song_info.spotify_url) {
+            try {
+                const trackId = new URL(round.song_info.spotify_url).pathname.split('/').pop();
+                if (trackId) {
+                    trackIds[round.round_num] = trackId;
+                }
+            } catch (e) {
+                console.error(`Invalid Spotify URL ${round.song_info.spotify_url}:`, e);
+            }
+        }
+    });
+    const ids = [...new Set(Object.values(trackIds))];
+    if (ids.length === 0) {
+        return;
+    }
+    
     try {
-        const response = await fetch('/api/get_spotify_token');
+        const response = await fetch('/api/tracks', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ ids: ids })
+        });
         if (!response.ok) {
-            throw new Error('Failed to get Spotify access token');
+            throw new Error(`Failed to fetch track metadata: ${response.status}`);
         }
         const data = await response.json();
-        return data.access_token;
+        rounds.forEach(round => {
+            const metadata = data.tracks[trackIds[round.round_num]];
+            if (metadata) {
+                round.song_info.title = metadata.title;
+                round.song_info.artist = metadata.artist;
+            }
+        });
     } catch (error) {
-        console.error('Error getting Spotify token:', error);
-        throw error;
+        console.error('Error fetching Spotify metadata:', error);
     }
 }
 
+// Start an Excel export job and poll it until the workbook is ready
+async function waitForExport(songs) {
+    const response = await fetch('/api/export_jobs', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            session_id: sessionId,
+            songs: songs
+        })
+    });
+    if (!response.ok) {
+        throw new Error(`Failed to start Excel export: ${response.status}`);
+    }
+    let job = await response.json();
+    
+    while (job.status === 'pending') {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        const statusResponse = await fetch(`/api/export_jobs/${encodeURIComponent(job.job_id)}`);
+        if (!statusResponse.ok) {
+            throw new Error(`Failed to check Excel export: ${statusResponse.status}`);
+        }
+        job = await statusResponse.json();
+    }
+    if (job.status !== 'ready') {
+        throw new Error('Failed to generate Excel file');
+    }
+    return job.job_id;
+}
+
 async function downloadBattleData() {
     if (!sessionId) {
         console.error('No active session to download data from.');
@@ -1167,73 +1229,27 @@ async function downloadBattleData() {
         // Get the battle data as JSON first
         const battleData = await response.json();
         
-        // Get Spotify access token
-        const access_token = await getSpotifyToken();
+        // Look up the songs' titles and artists
+        await fillSongMetadata(battleData.rounds);
         
-        // Fetch metadata for all rounds in parallel
-        await Promise.all(battleData.rounds.map(async (round) => {
+        // Build the Excel file in the background with the updated song details
+        const songs = {};
+        battleData.rounds.forEach(round => {
             if (round.song_info && round.song_info.spotify_url) {
-                try {
-                    const spotifyUrl = new URL(round.song_info.spotify_url);
-                    const trackId = spotifyUrl.pathname.split('/').pop();
-                    
-                    if (trackId) {
-                        const metadataResponse = await fetch(`https://api.spotify.com/v1/tracks/${trackId}`, {
-                            headers: {
-                                'Authorization': `Bearer ${access_token}`
-                            }
-                        });
-                        
-                        if (metadataResponse.status === 401) {
-                            // Token expired, get a new one and retry
-                            const newToken = await getSpotifyToken();
-                            const retryResponse = await fetch(`https://api.spotify.com/v1/tracks/${trackId}`, {
-                                headers: {
-                                    'Authorization': `Bearer ${newToken}`
-                                }
-                            });
-                            
-                            if (retryResponse.ok) {
-                                const metadata = await retryResponse.json();
-                                round.song_info.title = metadata.name;
-                                round.song_info.artist = metadata.artists.map(artist => artist.name).join(', ');
-                            }
-                        } else if (metadataResponse.ok) {
-                            const metadata = await metadataResponse.json();
-                            round.song_info.title = metadata.name;
-                            round.song_info.artist = metadata.artists.map(artist => artist.name).join(', ');
-                        }
-                    }
-                } catch (e) {
-                    console.error(`Error fetching metadata for ${round.song_info.spotify_url}:`, e);
-                }
+                songs[round.round_num] = {
+                    title: round.song_info.title,
+                    artist: round.song_info.artist
+                };
             }
-        }));
-        
-        // Now get the Excel file with the updated metadata
-        const excelResponse = await fetch(`/api/export_battle_data?session_id=${sessionId}&format=excel`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                rounds: battleData.rounds
-            })
         });
-        
-        if (!excelResponse.ok) {
-            throw new Error(`Failed to generate Excel file: ${excelResponse.status}`);
-        }
+        const jobId = await waitForExport(songs);
         
         // Download the Excel file
-        const blob = await excelResponse.blob();
-        const url = window.URL.createObjectURL(blob);
         const a = document.createElement('a');
-        a.href = url;
+        a.href = `/api/export_jobs/${encodeURIComponent(jobId)}/download`;
         a.download = `battle_data_${sessionId}.xlsx`;
         document.body.appendChild(a);
         a.click();
-        window.URL.revokeObjectURL(url);
         document.body.removeChild(a);
         
     } catch (error) {
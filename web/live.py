@@ -0,0 +1,103 @@
+"""
+Live battle updates for the Hustle n' Tussle web application.
+
+Screens follow a battle through a Server-Sent Events stream instead of
+polling. Streams don't carry the changes themselves: a save only wakes the
+streams watching that game (see ``Broadcaster``), and each stream then sends
+whichever parts of the game differ from what it last sent (``game_updates``).
+Games saved by another worker don't wake anything here, so streams also
+check the game's stored version every few seconds.
+"""
+import json
+import threading
+
+
+class Broadcaster:
+    """Wakes every stream subscribed to a game when the game is saved.
+
+    Each open stream holds one of the worker's threads, so at most
+    ``max_subscribers`` streams are let in, leaving the rest of the threads
+    to the requests that run the battle.
+    """
+
+    def __init__(self, max_subscribers=None):
+        self._max_subscribers = max_subscribers
+        self._subscribers = {}  # session_id -> set of threading.Event
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, session_id):
+        """A new stream's wake-up event, or None if the worker has no room for another stream."""
+        event = threading.Event()
+        with self._lock:
+            if self._max_subscribers is not None and self._count >= self._max_subscribers:
+                return None
+            self._subscribers.setdefault(session_id, set()).add(event)
+            self._count += 1
+        return event
+
+    def unsubscribe(self, session_id, event):
+        with self._lock:
+            subscribers = self._subscribers.get(session_id)
+            if subscribers is not None and event in subscribers:
+                subscribers.discard(event)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[session_id]
+
+    def publish(self, session_id):
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for event in subscribers:
+            event.set()
+
+    def subscriber_count(self, session_id):
+        with self._lock:
+            return len(self._subscribers.get(session_id, ()))
+
+
+def game_updates(game, sent):
+    """Yield ``(event, data)`` for each part of the game that changed since ``sent``.
+
+    ``sent`` holds what the stream has sent so far and is updated in place;
+    pass an empty dict to get the full state.
+    """
+    state = game.get_game_state()
+    current = game.current_round
+    parts = {
+        "round": {
+            "round": state["round"],
+            "pair_1": state["pair_1"],
+            "pair_2": state["pair_2"],
+            "contestant_judges": state["contestant_judges"],
+        },
+        "result": {
+            "round": state["round"],
+            "lead_winner": current.lead_winner,
+            "follow_winner": current.follow_winner,
+            "lead_votes": current.lead_votes,
+            "follow_votes": current.follow_votes,
+        },
+        "crown": {
+            "win_messages": current.win_messages or [],
+            "game_finished": game.is_finished(),
+        },
+    }
+    for name, data in parts.items():
+        if sent.get(name) != data:
+            sent[name] = data
+            yield name, data
+
+    # The scoreboard keeps its own version, so there's no need to compare it
+    if sent.get("scores") != game.scoreboard_version:
+        sent["scores"] = game.scoreboard_version
+        yield "scores", game.scoreboard()
+
+
+def format_event(name, data, event_id=None):
+    """Encode one Server-Sent Event."""
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
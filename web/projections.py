@@ -0,0 +1,71 @@
+"""
+Live win probabilities for the Hustle n' Tussle web application.
+
+Projecting a battle means simulating the rest of it a thousand times or so,
+which takes too long to do inside a request. The ProjectionCache runs
+projections on a background thread and keeps the results per game state, so
+the projector display polls an endpoint that always answers straight away:
+with the projection if it's ready, or with "pending" while it's computed.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from simulate import project
+
+
+class ProjectionCache:
+    """Background Monte Carlo projections, cached by game state.
+
+    Keys should identify the game state exactly, e.g. ``(session_id,
+    round_num, version)``; a game's state never changes under a key, so
+    results never need invalidating and are only evicted by age.
+    """
+
+    def __init__(self, simulations=1000, max_entries=256, workers=1):
+        self.simulations = simulations
+        self._max_entries = max_entries
+        self._results = OrderedDict()  # key -> projection
+        self._pending = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='projection')
+
+    def get(self, key, fork_game, seed=0):
+        """Return the projection for ``key``, or None while it is computed.
+
+        ``fork_game`` is called (with the game's lock held by the caller) only
+        when a projection has to be started, and must return a copy of the
+        game the background thread can own.
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+            if key in self._pending:
+                return None
+            game = fork_game()
+            future = self._executor.submit(project, game, self.simulations, seed)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return None
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.exception() is not None:
+                # Leave it uncached so the next request tries again
+                return
+            self._results[key] = future.result()
+            while len(self._results) > self._max_entries:
+                self._results.popitem(last=False)
+
+    def wait(self, timeout=None):
+        """Block until the projections in progress have finished."""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
@@ -0,0 +1,250 @@
+"""
+Spotify access for the Hustle n' Tussle web application.
+
+The app uses Spotify's client credentials flow: one access token, good for
+an hour, serves every request. ``TokenManager`` keeps that token until
+shortly before it expires and fetches a new one only then, by a single
+request however many ask at once. Backends do the fetching, so tests and
+benchmarks can use ``StubTokenBackend`` instead of the network.
+
+Song titles and artists come from ``TrackCache``, which looks up all the
+tracks it doesn't already know with Spotify's several-tracks endpoint (up to
+50 per request) and remembers them for a day, so a battle's whole song list
+resolves in one request, usually without reaching Spotify at all.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SpotifyError(Exception):
+    """Raised when Spotify can't be reached or refuses a request."""
+
+
+def pooled_session(pool_size=10):
+    """A requests.Session that keeps connections to Spotify open between requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return session
+
+
+class HTTPTokenBackend:
+    """Client credentials tokens from accounts.spotify.com."""
+
+    TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+    def __init__(self, client_id, client_secret, session=None, timeout=10):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = session or pooled_session()
+        self.timeout = timeout
+
+    def fetch_token(self):
+        if not self.client_id or not self.client_secret:
+            raise SpotifyError('Spotify credentials not configured')
+        try:
+            response = self.session.post(
+                self.TOKEN_URL,
+                auth=(self.client_id, self.client_secret),
+                data={'grant_type': 'client_credentials'},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise SpotifyError(f'Failed to get Spotify access token: {e}') from e
+        if response.status_code != 200:
+            raise SpotifyError('Failed to get Spotify access token')
+        return response.json()
+
+
+class StubTokenBackend:
+    """Local stand-in for Spotify's token endpoint, counting the tokens it hands out."""
+
+    def __init__(self, expires_in=3600, latency=0.0):
+        self.expires_in = expires_in
+        self.latency = latency  # Seconds each fetch takes, to stand in for the network
+        self.fetches = 0
+        self._lock = threading.Lock()
+
+    def fetch_token(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.fetches += 1
+            number = self.fetches
+        return {'access_token': f'stub-token-{number}', 'token_type': 'Bearer',
+                'expires_in': self.expires_in}
+
+
+class TokenManager:
+    """One shared access token, refreshed shortly before it expires."""
+
+    def __init__(self, backend, refresh_margin=60, clock=time.monotonic):
+        self.backend = backend
+        self.refresh_margin = refresh_margin  # Seconds before expiry to fetch a new token
+        self._clock = clock
+        self._token = None  # (token response, expires at)
+        self._lock = threading.Lock()
+
+    def _fresh(self, cached):
+        return cached is not None and cached[1] - self.refresh_margin > self._clock()
+
+    def token(self, stale=None):
+        """The current token as Spotify returns it, with ``expires_in`` counting down.
+
+        ``stale`` is a token the caller found rejected; if it's still the
+        current one a new token is fetched, otherwise the newer token is
+        returned, so a burst of rejections costs one fetch.
+        """
+        cached = self._token
+        if not self._fresh(cached) or cached[0]['access_token'] == stale:
+            with self._lock:
+                # Whoever held the lock may have fetched a new token already
+                cached = self._token
+                if not self._fresh(cached) or cached[0]['access_token'] == stale:
+                    response = self.backend.fetch_token()
+                    cached = (response, self._clock() + response.get('expires_in', 3600))
+                    self._token = cached
+        response, expires_at = cached
+        return {**response, 'expires_in': max(0, int(expires_at - self._clock()))}
+
+
+TRACK_ID = re.compile(r'^[A-Za-z0-9]{1,64}$')
+
+
+def _track_metadata(track):
+    return {
+        'title': track['name'],
+        'artist': ', '.join(artist['name'] for artist in track.get('artists', [])),
+    }
+
+
+class HTTPTracksBackend:
+    """Track metadata from api.spotify.com, up to MAX_IDS tracks per request."""
+
+    TRACKS_URL = 'https://api.spotify.com/v1/tracks'
+    MAX_IDS = 50
+
+    def __init__(self, tokens, session=None, timeout=10):
+        self.tokens = tokens
+        self.session = session or pooled_session()
+        self.timeout = timeout
+
+    def fetch_tracks(self, ids):
+        """Map each ID to its title and artist, or None if Spotify doesn't know it."""
+        access_token = self.tokens.token()['access_token']
+        for attempt in range(2):
+            try:
+                response = self.session.get(
+                    self.TRACKS_URL,
+                    params={'ids': ','.join(ids)},
+                    headers={'Authorization': f'Bearer {access_token}'},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as e:
+                raise SpotifyError(f'Failed to fetch tracks: {e}') from e
+            if response.status_code == 401 and attempt == 0:
+                # Token expired or revoked: replace it once and retry
+                access_token = self.tokens.token(stale=access_token)['access_token']
+                continue
+            break
+        if response.status_code != 200:
+            raise SpotifyError(f'Failed to fetch tracks: {response.status_code}')
+        tracks = response.json().get('tracks', [])
+        return {track_id: _track_metadata(track) if track else None
+                for track_id, track in zip(ids, tracks)}
+
+
+class FakeTracksBackend:
+    """Local stand-in for Spotify's tracks endpoint, recording each batch it is asked for."""
+
+    MAX_IDS = 50
+
+    def __init__(self, tracks=None, latency=0.0):
+        self.tracks = tracks  # ID -> {'name', 'artists'}; None makes up a track for any ID
+        self.latency = latency
+        self.requests = []
+
+    def fetch_tracks(self, ids):
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests.append(list(ids))
+        if self.tracks is None:
+            return {track_id: {'title': f'Track {track_id}', 'artist': 'Artist'} for track_id in ids}
+        return {track_id: _track_metadata(self.tracks[track_id]) if track_id in self.tracks else None
+                for track_id in ids}
+
+
+class TrackCache:
+    """Track metadata by Spotify ID, in a bounded LRU whose entries expire."""
+
+    def __init__(self, backend, max_entries=2048, ttl=86400, clock=time.monotonic):
+        self.backend = backend
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # track ID -> (metadata or None, expires at)
+        self._lock = threading.Lock()
+
+    def lookup(self, ids):
+        """Map each ID to ``{'title', 'artist'}``, or None for IDs Spotify doesn't know."""
+        results = {}
+        missing = []
+        now = self._clock()
+        with self._lock:
+            for track_id in dict.fromkeys(ids):
+                if not TRACK_ID.match(track_id):
+                    # One malformed ID would fail Spotify's whole batch
+                    results[track_id] = None
+                    continue
+                entry = self._entries.get(track_id)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(track_id)
+                    results[track_id] = entry[0]
+                else:
+                    missing.append(track_id)
+
+        for start in range(0, len(missing), self.backend.MAX_IDS):
+            batch = missing[start:start + self.backend.MAX_IDS]
+            fetched = self.backend.fetch_tracks(batch)
+            expires_at = self._clock() + self._ttl
+            with self._lock:
+                for track_id in batch:
+                    # Unknown tracks are remembered too, so they aren't asked for every time
+                    metadata = fetched.get(track_id)
+                    results[track_id] = metadata
+                    self._entries[track_id] = (metadata, expires_at)
+                    self._entries.move_to_end(track_id)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def create_token_manager(config):
+    """Build the token manager described by the app configuration."""
+    if config.SPOTIFY_BACKEND == 'stub':
+        backend = StubTokenBackend()
+    elif config.SPOTIFY_BACKEND == 'http':
+        backend = HTTPTokenBackend(config.SPOTIFY_CLIENT_ID, config.SPOTIFY_CLIENT_SECRET)
+    else:
+        raise ValueError(f"Unknown Spotify backend: {config.SPOTIFY_BACKEND}")
+    return TokenManager(backend)
+
+
+def create_track_cache(config, tokens):
+    """Build the track cache described by the app configuration."""
+    if config.SPOTIFY_BACKEND == 'stub':
+        backend = FakeTracksBackend()
+    elif config.SPOTIFY_BACKEND == 'http':
+        backend = HTTPTracksBackend(tokens, session=getattr(tokens.backend, 'session', None))
+    else:
+        raise ValueError(f"Unknown Spotify backend: {config.SPOTIFY_BACKEND}")
+    return TrackCache(backend, max_entries=config.TRACK_CACHE_SIZE, ttl=config.TRACK_CACHE_TTL)